@@ -0,0 +1,86 @@
+import asyncio
+import datetime as dt
+import time
+
+from sqlalchemy import cast, func, select
+
+from app.core.config import get_settings
+from app.core.db import SessionLocal
+from app.models import Booking, EventsOutbox
+from app.services.booking_intervals import LIVE_STATUSES
+from app.services.end_pipeline import EndedSession, complete_sessions, end_pipeline
+
+_settings = get_settings()
+
+
+async def end_pipeline_loop():
+    """Drain the end-of-session queue: one capture transaction per batch. A batch that
+    fails is retried one session at a time so a single bad row cannot hold back the rest;
+    sessions that still fail are re-queued with backoff (end_pipeline.retry_later)."""
+    if SessionLocal is None:
+        return
+    while True:
+        batch = await end_pipeline.next_batch()
+        t0 = time.perf_counter()
+        failed = 0
+        try:
+            async with SessionLocal() as db:  # type: ignore
+                await complete_sessions(db, batch)
+        except Exception as e:
+            print("[end_pipeline] batch failed, retrying individually:", e)
+            for item in batch:
+                try:
+                    async with SessionLocal() as db:  # type: ignore
+                        await complete_sessions(db, [item])
+                except Exception as e2:
+                    failed += 1
+                    delay = end_pipeline.retry_later(item)
+                    print("[end_pipeline] capture failed for", item.session_id, e2,
+                          f"(retry in {delay}s)" if delay is not None else "(left to recovery)")
+        end_pipeline.record_batch(len(batch), (time.perf_counter() - t0) * 1000.0, failed)
+
+
+async def end_pipeline_recovery_loop():
+    """Every END_PIPELINE_RECOVERY_SEC (and at startup), re-queue sessions the pipeline did
+    not finish: captures queued when the process stopped, sessions that found the queue
+    full, and ones that ran out of retries."""
+    if SessionLocal is None:
+        return
+    while True:
+        try:
+            await recover_ended_sessions()
+        except Exception as e:
+            print("[end_pipeline] recovery failed", e)
+        await asyncio.sleep(_settings.end_pipeline_recovery_sec)
+
+
+async def recover_ended_sessions() -> int:
+    """Sessions ended through sessions.end are marked by the session.ended outbox row of
+    their end transaction; those from the last END_PIPELINE_RECOVERY_WINDOW_SEC whose
+    booking is still live are re-queued, oldest first, at most END_PIPELINE_RECOVERY_LIMIT
+    per sweep (idx_outbox_session_ended). Sessions ended any other way (seeded history,
+    manual edits) are never captured here. Workers skip the sweep while another one holds
+    its advisory lock."""
+    since = dt.datetime.now(dt.timezone.utc) - dt.timedelta(seconds=_settings.end_pipeline_recovery_window_sec)
+    session_id = EventsOutbox.payload["session_id"].as_string()
+    booking_id = EventsOutbox.payload["booking_id"].as_string()
+    async with SessionLocal() as db:  # type: ignore
+        got = await db.execute(select(func.pg_try_advisory_xact_lock(func.hashtext("end_pipeline_recovery"))))
+        if not got.scalar():
+            return 0
+        res = await db.execute(
+            select(session_id, booking_id, EventsOutbox.created_at)
+            .join(Booking, Booking.booking_id == cast(booking_id, Booking.booking_id.type))
+            .where(
+                EventsOutbox.event_type == "session.ended",
+                EventsOutbox.created_at > since,
+                Booking.status.in_(LIVE_STATUSES),
+            )
+            .order_by(EventsOutbox.created_at)
+            .limit(_settings.end_pipeline_recovery_limit)
+        )
+        rows = res.all()
+    queued = sum(1 for sid, bid, ended in rows if end_pipeline.offer(EndedSession(sid, bid, ended)))
+    if queued:
+        print(f"[end_pipeline] recovered {queued} ended sessions awaiting capture")
+    return queued
@@ -0,0 +1,120 @@
+import datetime as dt
+import time
+import uuid
+from typing import List
+
+from sqlalchemy import delete, exists, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import get_settings
+from app.core.db import SessionLocal
+from app.models import Booking, BookingCandidate, BookingStatus, EventsOutbox
+from app.services.booking_intervals import booking_intervals
+from app.services.hold_expiry import hold_expiry
+
+_settings = get_settings()
+
+
+async def hold_expiry_loop():
+    """Sleep until the earliest hold deadline (or an earlier one is scheduled), then release
+    due holds in batches. Deadlines come from the in-memory queue; the DB is only read at
+    startup and every HOLD_EXPIRY_RESYNC_SEC, never scanned for expired rows."""
+    resync_at = 0.0
+    while True:
+        try:
+            if time.monotonic() >= resync_at:
+                resync_at = time.monotonic() + _settings.hold_expiry_resync_sec
+                await load_pending()
+            await expire_due()
+        except Exception as e:
+            try:
+                print("[holds] loop error", e)
+            except Exception:
+                pass
+        timeout = resync_at - time.monotonic()
+        head = hold_expiry.next_deadline()
+        if head is not None:
+            timeout = min(timeout, head - time.time())
+        await hold_expiry.wait(timeout)
+
+
+async def load_pending():
+    """(Re)load every outstanding hold deadline, including overdue ones from before a restart."""
+    if SessionLocal is None:
+        return
+    async with SessionLocal() as db:  # type: ignore
+        res = await db.execute(
+            select(BookingCandidate.booking_id, func.min(BookingCandidate.hold_expires_at))
+            .where(BookingCandidate.hold_expires_at.isnot(None))
+            .group_by(BookingCandidate.booking_id)
+        )
+        hold_expiry.replace(res.all())
+
+
+async def expire_due() -> int:
+    if SessionLocal is None:
+        return 0
+    expired = 0
+    while True:
+        now = dt.datetime.now(dt.timezone.utc)
+        due = hold_expiry.pop_due(now, _settings.hold_expiry_batch_size)
+        if not due:
+            return expired
+        async with SessionLocal() as db:  # type: ignore
+            expired += await expire_holds(db, due, now)
+
+
+async def expire_holds(db: AsyncSession, booking_ids: List[str], now: dt.datetime) -> int:
+    """Release the holds of booking_ids that lapsed by now, in one transaction.
+
+    Bookings still ``held`` are cancelled (booking.hold_expired is emitted for each); backup
+    candidates are dropped and the primary's deadline cleared for all of them, so bookings
+    that were started or swapped meanwhile just lose their spare slots. Safe to run on
+    several workers at once: only the worker whose UPDATE matched emits the event.
+    """
+    lapsed = exists().where(
+        BookingCandidate.booking_id == Booking.booking_id,
+        BookingCandidate.hold_expires_at <= now,
+    )
+    res = await db.execute(
+        update(Booking)
+        .where(Booking.booking_id.in_(booking_ids), Booking.status == BookingStatus.held, lapsed)
+        .values(status=BookingStatus.cancelled)
+        .returning(Booking.booking_id, Booking.slot_id, Booking.eta_minute)
+    )
+    cancelled = res.all()
+    await db.execute(
+        delete(BookingCandidate).where(
+            BookingCandidate.booking_id.in_(booking_ids),
+            BookingCandidate.role == "backup",
+            BookingCandidate.hold_expires_at <= now,
+        )
+    )
+    await db.execute(
+        update(BookingCandidate)
+        .where(BookingCandidate.booking_id.in_(booking_ids), BookingCandidate.hold_expires_at <= now)
+        .values(hold_expires_at=None)
+    )
+    if cancelled:
+        await db.execute(insert(EventsOutbox).values([
+            {
+                "event_id": str(uuid.uuid4()),
+                "event_type": "booking.hold_expired",
+                "payload": {
+                    "booking_id": bid,
+                    "slot_id": slot_id,
+                    "eta_minute": eta.isoformat(),
+                    "expired_at": now.isoformat(),
+                },
+                "status": "pending",
+                "created_at": now,
+            }
+            for bid, slot_id, eta in cancelled
+        ]))
+    await db.commit()
+    for bid, _, _ in cancelled:
+        booking_intervals.remove(bid)
+    hold_expiry.expired += len(cancelled)
+    if cancelled:
+        print(f"[holds] expired {len(cancelled)} holds")
+    return len(cancelled)
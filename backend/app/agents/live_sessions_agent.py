@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+from app.core.config import get_settings
+from app.core.db import SessionLocal
+from app.services.event_bus import event_bus
+from app.services.live_sessions import live_sessions
+
+_settings = get_settings()
+
+
+async def live_sessions_loop():
+    """Seed the live-session projection, then fold in published outbox events as they
+    arrive. It is rebuilt when the bus reports dropped events (resync), and checked against
+    the DB (and replaced if it drifted) only every LIVE_SESSIONS_CHECK_SEC."""
+    if SessionLocal is None:
+        return
+    q = event_bus.subscribe()  # before seeding, so nothing published meanwhile is lost
+    check_at = 0.0
+    resync = True
+    while True:
+        try:
+            if resync or time.monotonic() >= check_at:
+                check_at = time.monotonic() + _settings.live_sessions_check_sec
+                async with SessionLocal() as db:  # type: ignore
+                    if live_sessions.ready and not resync:
+                        report = await live_sessions.check(db, repair=True)
+                        if report["repaired"]:
+                            print(
+                                f"[live_sessions] repaired drift: {len(report['missing'])} missing, "
+                                f"{len(report['extra'])} extra, {len(report['changed'])} changed"
+                            )
+                    else:
+                        await live_sessions.rebuild(db)
+                resync = False
+            try:
+                evt = await asyncio.wait_for(q.get(), timeout=max(check_at - time.monotonic(), 0.1))
+            except asyncio.TimeoutError:
+                continue
+            if evt is None:
+                resync = True
+                continue
+            async with SessionLocal() as db:  # type: ignore
+                await live_sessions.apply(db, evt)
+        except Exception as e:
+            try:
+                print("[live_sessions] loop error", e)
+            except Exception:
+                pass
+            resync = True
+            await asyncio.sleep(5)
@@ -1,23 +1,38 @@
 import asyncio
 import datetime as dt
-from typing import Optional
+from typing import List, Optional
 
-from sqlalchemy import select, update
+from sqlalchemy import func, select, text, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.core.db import SessionLocal
+from app.core.config import get_settings
+from app.core.db import SessionLocal, engine
 from app.models import EventsOutbox
+from app.services.event_bus import BusEvent, event_bus
 
 
 DEFAULT_CADENCE_SEC = 5
 BATCH_SIZE = 100
+# NOTIFY channel carrying comma-separated ids of newly published events; payloads are
+# capped at 8000 bytes, so ids go out in chunks
+NOTIFY_CHANNEL = "outbox_published"
+NOTIFY_CHUNK = 150
+LISTEN_POLL_SEC = 30.0
+# LISTEN needs a session-level connection: through PgBouncer in transaction pooling it
+# silently receives nothing, so cross-worker fan-out only runs on DATABASE_URL_DIRECT (which
+# the engine then uses); without it each worker hands its own events to its event_bus
+LISTEN_ENABLED = bool(get_settings().database_url_direct)
 
 
 async def outbox_loop(cadence: int = DEFAULT_CADENCE_SEC, batch_size: int = BATCH_SIZE):
     """Background loop that scans events_outbox for pending events and marks them published.
 
     This simulates a Kafka publisher: in a real deployment, replace the publish() call
-    with a producer send and only mark published on success.
+    with a producer send and only mark published on success. Every worker runs this loop;
+    rows are claimed with FOR UPDATE SKIP LOCKED so each event is published once. With
+    LISTEN_ENABLED the commit NOTIFYs the new event ids and outbox_listen_loop hands them to
+    the event_bus (live SSE streams, live-session projection) of every worker; otherwise
+    the publishing worker's own event_bus gets them.
     """
     while True:
         try:
@@ -39,48 +54,100 @@ async def publish_once(batch_size: int = BATCH_SIZE, session: Optional[AsyncSess
         session = SessionLocal()  # type: ignore
     assert session is not None
     try:
-        # Fetch a batch of pending events FIFO by creation time
+        # Claim a batch of pending events FIFO by creation time; rows another worker is
+        # publishing right now are skipped, not waited on
         res = await session.execute(
             select(EventsOutbox)
             .where(EventsOutbox.status == "pending")
             .order_by(EventsOutbox.created_at.asc())
             .limit(batch_size)
+            .with_for_update(skip_locked=True)
         )
         events = res.scalars().all()
         if not events:
-            if owns_session:
-                await session.close()
+            await session.commit()
             return
 
-        published = 0
+        delivered: List[BusEvent] = []
+        failed: List[str] = []
         for evt in events:
             try:
                 # Simulate publish: replace with real producer send if available
                 _simulate_publish(evt)
-                await session.execute(
-                    update(EventsOutbox)
-                    .where(EventsOutbox.event_id == evt.event_id)
-                    .values(status="published", published_at=dt.datetime.utcnow())
-                )
-                published += 1
+                delivered.append(BusEvent(evt.event_id, evt.event_type, evt.payload or {}, evt.created_at))
             except Exception as pub_ex:
                 # Mark as error to avoid tight retry loop; can be retried with a repair job
                 print("[outbox] publish failed for", evt.event_id, pub_ex)
-                await session.execute(
-                    update(EventsOutbox)
-                    .where(EventsOutbox.event_id == evt.event_id)
-                    .values(status="error")
-                )
-        if published:
-            await session.commit()
-            print(f"[outbox] published {published} events")
-        else:
-            await session.commit()
+                failed.append(evt.event_id)
+        if delivered:
+            ids = [e.event_id for e in delivered]
+            await session.execute(
+                update(EventsOutbox)
+                .where(EventsOutbox.event_id.in_(ids))
+                .values(status="published", published_at=dt.datetime.utcnow())
+            )
+            if LISTEN_ENABLED:
+                # delivered to listeners only if (and once) this transaction commits
+                for i in range(0, len(ids), NOTIFY_CHUNK):
+                    await session.execute(select(func.pg_notify(NOTIFY_CHANNEL, ",".join(ids[i:i + NOTIFY_CHUNK]))))
+        if failed:
+            await session.execute(
+                update(EventsOutbox).where(EventsOutbox.event_id.in_(failed)).values(status="error")
+            )
+        await session.commit()
+        if delivered:
+            print(f"[outbox] published {len(delivered)} events")
+        if not event_bus.listening:
+            for bus_evt in delivered:
+                event_bus.publish(bus_evt)
     finally:
         if owns_session:
             await session.close()
 
 
+async def outbox_listen_loop():
+    """LISTEN for published event ids on a dedicated connection and publish those events
+    to this process's event_bus, whichever worker's outbox loop published them (one
+    lookup per notification). Subscribers are told to resync whenever the connection is
+    (re)established, since notifications sent while it was down are lost. Only runs with
+    LISTEN_ENABLED; event_bus.listening stays False otherwise, keeping the local hand-off
+    in publish_once."""
+    if engine is None or SessionLocal is None or not LISTEN_ENABLED:
+        return
+    while True:
+        try:
+            async with engine.connect() as conn:
+                conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                await conn.execute(text(f"LISTEN {NOTIFY_CHANNEL}"))
+                listener = (await conn.get_raw_connection()).driver_connection
+                event_bus.listening = True
+                event_bus.resync()
+                while True:
+                    async for note in listener.notifies(timeout=LISTEN_POLL_SEC):
+                        await _deliver(note.payload.split(","))
+        except Exception as e:
+            try:
+                print("[outbox] listener error", e)
+            except Exception:
+                pass
+        finally:
+            event_bus.listening = False
+        await asyncio.sleep(DEFAULT_CADENCE_SEC)
+
+
+async def _deliver(event_ids: List[str]):
+    async with SessionLocal() as db:  # type: ignore
+        res = await db.execute(
+            select(EventsOutbox.event_id, EventsOutbox.event_type, EventsOutbox.payload, EventsOutbox.created_at)
+            .where(EventsOutbox.event_id.in_(event_ids))
+        )
+        by_id = {r.event_id: r for r in res.all()}
+    for event_id in event_ids:  # publish order
+        r = by_id.get(event_id)
+        if r is not None:
+            event_bus.publish(BusEvent(r.event_id, r.event_type, r.payload or {}, r.created_at))
+
+
 def _simulate_publish(evt: EventsOutbox):
     # Keep it simple: console log as a stand-in for Kafka
     try:
@@ -8,6 +8,8 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.services.feature_builder import build_features
 from app.services.model_service import model_service
+from app.services.prediction_index import prediction_index
+from app.services.offer_cache import offer_cache
 # Removed memory fallback import for DB-only fetch phase
 from app.core.db import SessionLocal
 from app.models import Slot, SlotPrediction
@@ -58,6 +60,11 @@ async def run_once(horizon_min: int = 60, step_min: int = 15):
         print("[predictor] DB slot fetch failed:", e)
         return
 
+    if model_service.model is None:
+        # Model disabled (e.g. free tier): predictions come from seeding; just serve them
+        await _refresh_index()
+        return
+
     # 2) Build feature rows
     rows: List[Dict[str, Any]] = []
     meta: List[Dict[str, Any]] = []
@@ -106,6 +113,18 @@ async def run_once(horizon_min: int = 60, step_min: int = 15):
                 await db.commit()
         except Exception as e:
             print("[predictor] DB upsert failed:", e)
+    await _refresh_index()
+
+async def _refresh_index():
+    """Reload the in-process prediction index used by offers/bookings lookups."""
+    if SessionLocal is None:
+        return
+    try:
+        async with SessionLocal() as db:  # type: ignore
+            await prediction_index.refresh_from_db(db)
+        offer_cache.invalidate("predictions.refreshed")
+    except Exception as e:
+        print("[predictor] index refresh failed:", e)
 
 async def _upsert_slots(db: AsyncSession, slots: List[Dict[str, Any]]):
     if not slots:
@@ -5,6 +5,8 @@ from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.db import SessionLocal
 from app.models import Slot, SlotPrediction, EventsOutbox
+from app.services.offer_cache import offer_cache
+from app.services.slot_catalog import slot_catalog
 
 DEFAULT_CADENCE_SEC = 120
 WINDOW_MINUTES = 30
@@ -27,6 +29,7 @@ async def run_once():
         now = dt.datetime.utcnow().replace(tzinfo=dt.timezone.utc)
         horizon = now + dt.timedelta(minutes=WINDOW_MINUTES)
         changed = 0
+        new_prices = {}
         for s in slots:
             # nearest upcoming prediction within window
             pred_q = await db.execute(
@@ -67,7 +70,10 @@ async def run_once():
                     },
                 )
                 db.add(evt)
+                new_prices[s.slot_id] = new_price
                 changed += 1
         if changed:
             await db.commit()
+            slot_catalog.apply_prices(new_prices)
+            offer_cache.invalidate("pricing.adjusted")
             print(f"[pricing] adjusted {changed} slot prices")
@@ -25,7 +25,61 @@ class Settings(BaseSettings):
     # Frontend CORS origins (comma-separated list). Example:
     # FRONTEND_ORIGINS="https://user-app.example,https://provider-app.example"
     frontend_origins: str | None = None
-    
+    # Offers search: max candidate slots considered per search (raise to cover whole cities)
+    offers_max_slots: int = 50
+    # Offers result cache (per geo cell + 15 min ETA bucket); invalidated on price/prediction changes
+    offers_cache_max_entries: int = 1024
+    offers_cache_ttl_sec: float = 60.0
+    # In-process prediction index: reloaded from slot_predictions this often between predictor
+    # runs; an older snapshot (failed reload) sends lookups to the DB
+    prediction_index_refresh_sec: float = 60.0
+    # Slot catalogue cache: how often other workers' price changes are pulled in
+    slot_catalog_price_ttl_sec: float = 30.0
+    # How long a booking occupies its slot from the ETA (conflict detection; bookings store only the ETA)
+    booking_duration_min: int = 120
+    # Idempotency-Key replay window and hot in-memory LRU size (table: idempotency_keys)
+    idempotency_ttl_hours: int = 24
+    idempotency_cache_max_entries: int = 4096
+    # Smart holds lapse this long after the ETA if the driver has not started a session
+    hold_grace_min: int = 15
+    # Hold expiry agent: max bookings released per transaction, and how often it re-reads
+    # upcoming deadlines from the DB (picks up holds written by other workers)
+    hold_expiry_batch_size: int = 200
+    hold_expiry_resync_sec: float = 300.0
+    # Live-session projection: kept current by outbox events; this is only the safety-net
+    # interval at which it is compared against (and repaired from) the full DB join. Without
+    # the LISTEN fan-out (no DATABASE_URL_DIRECT) it also bounds how long sessions changed on
+    # other workers can be missing or stale
+    live_sessions_check_sec: float = 300.0
+    # Per-lot occupancy counters: reconciled against active sessions in the DB this often
+    lot_occupancy_reconcile_sec: float = 60.0
+    # Plate -> active session index: reconciled against the DB this often
+    plate_index_reconcile_sec: float = 60.0
+    # End-of-session pipeline: queued captures before sessions.end answers 503, sessions per
+    # capture transaction, and how long a partial batch waits for more sessions
+    end_pipeline_queue_size: int = 5000
+    end_pipeline_batch_size: int = 200
+    end_pipeline_max_wait_ms: int = 50
+    # Failed captures are retried this many times (backoff doubling from the base); every
+    # END_PIPELINE_RECOVERY_SEC one worker re-queues up to END_PIPELINE_RECOVERY_LIMIT sessions
+    # ended through sessions.end in the last END_PIPELINE_RECOVERY_WINDOW_SEC whose booking is
+    # still live
+    end_pipeline_max_retries: int = 5
+    end_pipeline_retry_base_sec: float = 1.0
+    end_pipeline_recovery_sec: float = 60.0
+    end_pipeline_recovery_window_sec: float = 86400.0
+    end_pipeline_recovery_limit: int = 1000
+    # Rollup writes are skipped while the rollup tables are missing (unpatched DB); a
+    # missing table is looked up again this often
+    rollup_tables_recheck_sec: float = 30.0
+    # Analytics response cache: fresh TTL per endpoint, then served stale (while one
+    # background refresh runs) for up to ANALYTICS_CACHE_STALE_SEC more
+    analytics_cache_max_entries: int = 256
+    analytics_cache_stale_sec: float = 300.0
+    analytics_summary_ttl_sec: float = 30.0
+    analytics_revenue_ttl_sec: float = 300.0
+    analytics_occupancy_ttl_sec: float = 60.0
+
     if _USE_SETTINGS_CONFIG:
         # Prefer backend/.env but allow project root .env as fallback
         model_config = SettingsConfigDict(
@@ -2,6 +2,7 @@ from __future__ import annotations
 import sys
 import asyncio
 from typing import AsyncGenerator
+from fastapi import HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from app.core.config import get_settings
@@ -144,6 +145,14 @@ if _DATABASE_URL:
         engine = None
         SessionLocal = None
 
+def get_session_factory() -> sessionmaker:
+    """The session factory itself, for work that outlives the request (cached analytics
+    refreshes open their own sessions); overridable like get_db."""
+    if SessionLocal is None:
+        raise HTTPException(status_code=503, detail="Database not configured")
+    return SessionLocal
+
+
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
     if SessionLocal is None:
         raise RuntimeError("Database not configured. Set database_url in .env")
@@ -18,8 +18,12 @@ from app.routers import inventory as inventory_router
 from app.routers import analytics as analytics_router
 from app.agents.predictor import predictor_loop
 from app.agents.pricing_agent import pricing_loop
-from app.agents.outbox_publisher import outbox_loop
+from app.agents.outbox_publisher import outbox_listen_loop, outbox_loop
 from app.agents.incentives_agent import incentives_loop
+from app.agents.hold_expiry_agent import hold_expiry_loop
+from app.agents.live_sessions_agent import live_sessions_loop
+from app.agents.end_pipeline_agent import end_pipeline_loop, end_pipeline_recovery_loop
+from app.services.booking_intervals import warm_booking_intervals
 
 settings = get_settings()
 
@@ -144,7 +148,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["x-request-id"],
+    expose_headers=["x-request-id", "x-next-cursor", "idempotent-replayed"],
     max_age=600,
 )
 
@@ -158,8 +162,19 @@ async def _startup():
     asyncio.create_task(pricing_loop())
     # start outbox publisher loop
     asyncio.create_task(outbox_loop())
+    # hand events published by any worker to this process's event bus
+    asyncio.create_task(outbox_listen_loop())
     # start incentives agent loop
     asyncio.create_task(incentives_loop())
+    # release lapsed smart holds at their deadline
+    asyncio.create_task(hold_expiry_loop())
+    # in-memory projection behind /sessions/live
+    asyncio.create_task(live_sessions_loop())
+    # batched booking completion + payment capture for ended sessions
+    asyncio.create_task(end_pipeline_loop())
+    asyncio.create_task(end_pipeline_recovery_loop())
+    # load live bookings into the per-slot conflict index
+    asyncio.create_task(warm_booking_intervals())
 
 app.include_router(ml.router)
 app.include_router(auth.router)
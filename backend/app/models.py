@@ -1,6 +1,6 @@
 from __future__ import annotations
 from sqlalchemy.orm import Mapped, mapped_column, relationship, declarative_base
-from sqlalchemy import String, Integer, Boolean, Numeric, Text, ForeignKey, DateTime, Enum, JSON
+from sqlalchemy import String, Integer, Boolean, Numeric, Text, ForeignKey, Date, DateTime, Enum, JSON
 from sqlalchemy.dialects.postgresql import UUID
 import enum
 import datetime as dt
@@ -131,6 +131,19 @@ class Session(Base):
     validation_method: Mapped[ValidationMethod | None] = mapped_column(Enum(ValidationMethod, native_enum=False))
     bay_label: Mapped[str | None] = mapped_column(String)
     grace_ends_at: Mapped[dt.datetime | None] = mapped_column(DateTime(timezone=True))
+    plate: Mapped[str | None] = mapped_column(String)  # normalised (see normalize_plate)
+
+class Vehicle(Base):
+    __tablename__ = "vehicles"
+    vehicle_id: Mapped[str] = mapped_column(UUID(as_uuid=False), primary_key=True)
+    user_id: Mapped[str | None] = mapped_column(UUID(as_uuid=False), ForeignKey("app_users.user_id"))
+    plate: Mapped[str] = mapped_column(String, unique=True)  # normalised (see normalize_plate)
+    make: Mapped[str | None] = mapped_column(String)
+    model: Mapped[str | None] = mapped_column(String)
+    type: Mapped[str] = mapped_column(String, default="car")
+    is_ev: Mapped[bool] = mapped_column(Boolean, default=False)
+    needs_accessibility: Mapped[bool] = mapped_column(Boolean, default=False)
+    created_at: Mapped[dt.datetime] = mapped_column(DateTime(timezone=True), default=dt.datetime.utcnow)
 
 class Payment(Base):
     __tablename__ = "payments"
@@ -141,6 +154,26 @@ class Payment(Base):
     status: Mapped[PaymentStatus] = mapped_column(Enum(PaymentStatus, native_enum=False))
     created_at: Mapped[dt.datetime] = mapped_column(DateTime(timezone=True), default=dt.datetime.utcnow)
 
+class PaymentRollup(Base):
+    """Payment counts and amounts per (created day, location, status); see app.services.payment_rollups."""
+    __tablename__ = "payment_rollups"
+    day: Mapped[dt.date] = mapped_column(Date, primary_key=True)
+    location_id: Mapped[str] = mapped_column(String, primary_key=True)  # '' when the booking has no location
+    status: Mapped[PaymentStatus] = mapped_column(Enum(PaymentStatus, native_enum=False), primary_key=True)
+    payments: Mapped[int] = mapped_column(Integer, default=0)
+    amount_authorized: Mapped[float] = mapped_column(Numeric, default=0)
+    amount_captured: Mapped[float] = mapped_column(Numeric, default=0)
+
+class HourlyRollup(Base):
+    """Per (UTC hour, location): ended-session occupancy and captured revenue; see app.services.hourly_rollups."""
+    __tablename__ = "hourly_rollups"
+    hour: Mapped[dt.datetime] = mapped_column(DateTime(timezone=True), primary_key=True)
+    location_id: Mapped[str] = mapped_column(String, primary_key=True)  # '' when unknown
+    occupied_seconds: Mapped[float] = mapped_column(Numeric, default=0)
+    sessions: Mapped[int] = mapped_column(Integer, default=0)  # ended sessions, counted in their start hour
+    captured_payments: Mapped[int] = mapped_column(Integer, default=0)  # payments in captured status, by created_at hour
+    revenue: Mapped[float] = mapped_column(Numeric, default=0)  # their amount_captured
+
 class Alert(Base):
     __tablename__ = "alerts"
     alert_id: Mapped[str] = mapped_column(UUID(as_uuid=False), primary_key=True)
@@ -160,3 +193,12 @@ class EventsOutbox(Base):
     status: Mapped[str] = mapped_column(String, default="pending")  # pending|published|error
     created_at: Mapped[dt.datetime] = mapped_column(DateTime(timezone=True), default=dt.datetime.utcnow)
     published_at: Mapped[dt.datetime | None] = mapped_column(DateTime(timezone=True))
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    scope: Mapped[str] = mapped_column(String, primary_key=True)  # e.g. "POST /bookings/"
+    key: Mapped[str] = mapped_column(String, primary_key=True)  # client-supplied Idempotency-Key header
+    request_hash: Mapped[str] = mapped_column(String)
+    status_code: Mapped[int] = mapped_column(Integer)
+    response: Mapped[dict] = mapped_column(JSON)
+    created_at: Mapped[dt.datetime] = mapped_column(DateTime(timezone=True), default=dt.datetime.utcnow)
@@ -1,4 +1,7 @@
-from fastapi import APIRouter, HTTPException
+import datetime as dt
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, text
 from app.core.db import SessionLocal
@@ -18,6 +21,16 @@ from app.models import (
     AlertSeverity,
 )
 from app.services.inmemory_store import SLOTS as MEM_SLOTS
+from app.services.prediction_index import prediction_index
+from app.services.offer_cache import offer_cache
+from app.services.booking_intervals import booking_intervals
+from app.services.slot_catalog import slot_catalog
+from app.services.live_sessions import live_sessions
+from app.services.lot_occupancy import lot_occupancy
+from app.services.payment_rollups import live_summary_select, rebuild_payment_rollups, record_new_payments, summary_select
+from app.services.hourly_rollups import backfill_hourly_rollups, record_ended_sessions
+from app.services.rollup_tables import rollup_tables
+from app.services.analytics_cache import analytics_cache
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
@@ -47,6 +60,7 @@ async def seed_slots():
         if to_add:
             db.add_all(to_add)
             await db.commit()
+            slot_catalog.bump("admin.seed_slots")
         return {"inserted": len(to_add), "existing": len(existing)}
 
 @router.post("/db/indexes")
@@ -60,8 +74,73 @@ async def create_indexes():
         ON slot_predictions (slot_id, eta_minute);
         """)
         await db.execute(ddl)
+        # Offer search: candidate slots for the lots returned by the geo grid
+        await db.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_slots_location_id
+        ON slots (location_id);
+        """))
+        # Offer search filters: partial indexes keep filtered searches cheaper than unfiltered ones
+        await db.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_slots_ev_location
+        ON slots (location_id, dynamic_price) WHERE is_ev;
+        """))
+        await db.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_slots_accessible_location
+        ON slots (location_id, dynamic_price) WHERE is_accessible;
+        """))
+        await db.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_slots_cluster_price
+        ON slots (cluster_id, dynamic_price);
+        """))
+        # Booking conflict checks: live bookings on a slot around an ETA
+        await db.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_bookings_slot_eta
+        ON bookings (slot_id, eta_minute);
+        """))
+        # Hold expiry agent: outstanding deadlines only
+        await db.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_booking_candidate_hold_expires
+        ON booking_candidate (hold_expires_at) WHERE hold_expires_at IS NOT NULL;
+        """))
+        # Gate validation lookups: active sessions by plate / booking
+        await db.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_sessions_plate_active
+        ON sessions (plate) WHERE ended_at IS NULL;
+        """))
+        await db.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_sessions_booking_id
+        ON sessions (booking_id);
+        """))
+        # Bookings ledger keyset pagination: (created_at, booking_id) newest first
+        await db.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_bookings_created_at_id
+        ON bookings (created_at DESC, booking_id DESC);
+        """))
+        # End pipeline recovery sweep: recent session.ended markers
+        await db.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_outbox_session_ended
+        ON events_outbox (created_at) WHERE event_type = 'session.ended';
+        """))
+        # Ledger / payment transitions: a booking's payments, latest first
+        await db.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_payments_booking_created
+        ON payments (booking_id, created_at DESC);
+        """))
         await db.commit()
-        return {"created": ["idx_slot_predictions_slot_eta"]}
+        return {"created": [
+            "idx_bookings_slot_eta",
+            "idx_bookings_created_at_id",
+            "idx_booking_candidate_hold_expires",
+            "idx_sessions_plate_active",
+            "idx_sessions_booking_id",
+            "idx_payments_booking_created",
+            "idx_outbox_session_ended",
+            "idx_slot_predictions_slot_eta",
+            "idx_slots_location_id",
+            "idx_slots_ev_location",
+            "idx_slots_accessible_location",
+            "idx_slots_cluster_price",
+        ]}
 
 @router.get("/outbox/events")
 async def list_outbox(limit: int = 50):
@@ -84,6 +163,49 @@ async def list_outbox(limit: int = 50):
             for e in events
         ]
 
+@router.get("/projections/live-sessions/check")
+async def check_live_sessions(repair: bool = False):
+    """Diff the in-memory live-session projection against a DB rebuild (repair=true adopts it)."""
+    if SessionLocal is None:
+        raise HTTPException(status_code=503, detail="Database not configured")
+    async with SessionLocal() as db:  # type: ignore
+        return await live_sessions.check(db, repair=repair)
+
+@router.get("/rollups/payments/check")
+async def check_payment_rollups(repair: bool = False):
+    """Compare the rollup-backed payments summary with a direct aggregate over payments
+    (repair=true rebuilds the rollups from payments)."""
+    if SessionLocal is None:
+        raise HTTPException(status_code=503, detail="Database not configured")
+    async with SessionLocal() as db:  # type: ignore
+        rollup = dict((await db.execute(summary_select())).one()._mapping)
+        live = dict((await db.execute(live_summary_select())).one()._mapping)
+        consistent = rollup == live
+        buckets = None
+        if repair and not consistent:
+            buckets = await rebuild_payment_rollups(db)
+            await db.commit()
+        return {
+            "consistent": consistent,
+            "rollup": {k: float(v) for k, v in rollup.items()},
+            "live": {k: float(v) for k, v in live.items()},
+            "rebuilt_buckets": buckets,
+        }
+
+@router.post("/rollups/backfill")
+async def backfill_rollups(days: Optional[int] = Query(None, ge=1)):
+    """Rebuild the analytics rollups from sessions and payments: payment_rollups in full,
+    hourly_rollups for the last `days` days (all history when omitted)."""
+    if SessionLocal is None:
+        raise HTTPException(status_code=503, detail="Database not configured")
+    since = dt.datetime.now(dt.timezone.utc) - dt.timedelta(days=days) if days else None
+    async with SessionLocal() as db:  # type: ignore
+        buckets = await rebuild_payment_rollups(db)
+        hours = await backfill_hourly_rollups(db, since)
+        await db.commit()
+    analytics_cache.invalidate()
+    return {"payment_buckets": buckets, "hourly_rows": hours, "since": since.isoformat() if since else None}
+
 @router.post("/seed/demo")
 async def seed_demo(horizon_minutes: int = 120, step: int = 15):
     """Populate database with synthetic demo data across core tables.
@@ -213,6 +335,9 @@ async def seed_demo(horizon_minutes: int = 120, step: int = 15):
                 status=PaymentStatus.captured,
             )
             db.add(payment)
+            await db.flush()
+            await record_new_payments(db, [payment.payment_id])
+            await record_ended_sessions(db, [session_id])
 
         # 5. Alerts
         alert = Alert(
@@ -234,6 +359,12 @@ async def seed_demo(horizon_minutes: int = 120, step: int = 15):
             ])
 
         await db.commit()
+        # make the freshly seeded predictions visible to offers/bookings right away
+        await prediction_index.refresh_from_db(db)
+        await booking_intervals.refresh_from_db(db)
+        await lot_occupancy.reconcile(db)
+        slot_catalog.bump("admin.seed_demo")
+        offer_cache.invalidate("predictions.seeded")
         return {
             "slots": len(new_slots) if new_slots else 0,
             "predictions": len(pred_rows),
@@ -258,6 +389,9 @@ async def patch_db():
     """Apply minimal DDL to align DB schema with current models (idempotent).
     - Ensure events_outbox exists and has required columns.
     - Create prediction index if missing.
+    - Create idempotency_keys (Idempotency-Key replays for bookings/sessions/payments).
+    - Add sessions.plate (ANPR batch validation) and the vehicles table.
+    - Create payment_rollups and hourly_rollups and backfill them.
     """
     if SessionLocal is None:
         raise HTTPException(status_code=503, detail="Database not configured")
@@ -279,11 +413,54 @@ async def patch_db():
             ALTER TABLE events_outbox ADD COLUMN IF NOT EXISTS published_at TIMESTAMPTZ;
             CREATE INDEX IF NOT EXISTS idx_slot_predictions_slot_eta
             ON slot_predictions (slot_id, eta_minute);
+            ALTER TABLE sessions ADD COLUMN IF NOT EXISTS plate VARCHAR;
+            CREATE TABLE IF NOT EXISTS vehicles (
+                vehicle_id UUID PRIMARY KEY,
+                user_id UUID REFERENCES app_users (user_id),
+                plate VARCHAR NOT NULL UNIQUE,
+                make VARCHAR,
+                model VARCHAR,
+                type VARCHAR DEFAULT 'car',
+                is_ev BOOLEAN DEFAULT false,
+                needs_accessibility BOOLEAN DEFAULT false,
+                created_at TIMESTAMPTZ DEFAULT now()
+            );
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                scope VARCHAR NOT NULL,
+                key VARCHAR NOT NULL,
+                request_hash VARCHAR NOT NULL,
+                status_code INTEGER NOT NULL,
+                response JSONB,
+                created_at TIMESTAMPTZ DEFAULT now(),
+                PRIMARY KEY (scope, key)
+            );
+            CREATE TABLE IF NOT EXISTS payment_rollups (
+                day DATE NOT NULL,
+                location_id VARCHAR NOT NULL,
+                status VARCHAR(10) NOT NULL,
+                payments INTEGER NOT NULL DEFAULT 0,
+                amount_authorized NUMERIC NOT NULL DEFAULT 0,
+                amount_captured NUMERIC NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, location_id, status)
+            );
+            CREATE TABLE IF NOT EXISTS hourly_rollups (
+                hour TIMESTAMPTZ NOT NULL,
+                location_id VARCHAR NOT NULL,
+                occupied_seconds NUMERIC NOT NULL DEFAULT 0,
+                sessions INTEGER NOT NULL DEFAULT 0,
+                captured_payments INTEGER NOT NULL DEFAULT 0,
+                revenue NUMERIC NOT NULL DEFAULT 0,
+                PRIMARY KEY (hour, location_id)
+            );
             """
         )
         await db.execute(ddl)
+        rollup_tables.forget()
+        await rebuild_payment_rollups(db)
+        await backfill_hourly_rollups(db)
         await db.commit()
-        return {"patched": ["events_outbox columns", "idx_slot_predictions_slot_eta"]}
+        analytics_cache.invalidate()
+        return {"patched": ["events_outbox columns", "idx_slot_predictions_slot_eta", "idempotency_keys", "sessions.plate", "vehicles", "payment_rollups", "hourly_rollups"]}
 
 
 @router.post("/demo/flow")
@@ -415,16 +592,19 @@ async def demo_flow():
         ))
 
         # 5) End session and capture
+        await db.flush()  # autoflush is off: the UPDATEs below must see the session/payment rows
         end_time = now + dt.timedelta(minutes=5)
         await db.execute(
             update(SessionModel).where(SessionModel.session_id == session_id).values(ended_at=end_time)
         )
+        await record_ended_sessions(db, [session_id])
         await db.execute(
             update(Booking).where(Booking.booking_id == booking_id).values(status=BookingStatus.completed)
         )
         await db.execute(
             update(Payment).where(Payment.payment_id == payment_id).values(amount_captured=amount, status=PaymentStatus.captured)
         )
+        await record_new_payments(db, [payment_id])
         db.add(EventsOutbox(
             event_id=str(uuid.uuid4()),
             event_type="payment.captured",
@@ -437,6 +617,8 @@ async def demo_flow():
         ))
 
         await db.commit()
+        if created_slots:
+            slot_catalog.bump("admin.demo_flow")
 
         # Return a concise summary and recent events
         ev_res = await db.execute(
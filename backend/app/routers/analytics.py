@@ -1,15 +1,24 @@
-from typing import List, Dict
-from fastapi import APIRouter, Depends
+from typing import Any, Awaitable, Callable, List, Dict, Optional
+from fastapi import APIRouter, Depends, Query
 from pydantic import BaseModel
 from sqlalchemy import select, func
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
-import datetime as dt
 
-from app.core.db import get_db
-from app.models import Payment, PaymentStatus, Session, Slot
+from app.core.config import get_settings
+from app.core.db import get_session_factory
+from app.models import Payment, PaymentStatus
+from app.services.analytics_cache import analytics_cache
+from app.services.payment_rollups import live_summary_select, summary_select
+from app.services.hourly_rollups import revenue_daily_select, rollup_occupied_seconds
+from app.services.occupancy_history import (
+    BUCKET, Granularity, bucket_starts, capacity_by_location, occupancy_pct, occupied_seconds, range_for,
+)
 
 router = APIRouter(prefix="/analytics", tags=["analytics"])
 
+_settings = get_settings()
+
 
 class PaymentsSummary(BaseModel):
     total_revenue: float
@@ -18,22 +27,33 @@ class PaymentsSummary(BaseModel):
     failed_count: int
 
 
+async def _cached(session_factory, key: tuple, ttl_sec: float, fn: Callable[..., Awaitable[Any]], *args):
+    """fn(db, *args) through the analytics cache, on its own DB session from session_factory
+    (a stale-while-revalidate refresh runs after the request that triggered it has finished)."""
+    async def compute():
+        async with session_factory() as db:
+            return await fn(db, *args)
+    return await analytics_cache.get_or_compute(key, ttl_sec, compute)
+
+
 @router.get("/payments/summary", response_model=PaymentsSummary)
-async def payments_summary(db: AsyncSession = Depends(get_db)):
-    # total revenue = sum captured
-    total_res = await db.execute(select(func.coalesce(func.sum(Payment.amount_captured), 0)))
-    total_revenue = float(total_res.scalar_one() or 0.0)
-    paid_res = await db.execute(select(func.count()).where(Payment.status == PaymentStatus.captured))
-    paid_count = int(paid_res.scalar_one() or 0)
-    pending_res = await db.execute(select(func.coalesce(func.sum(Payment.amount_authorized), 0)).where(Payment.status == PaymentStatus.preauth_ok))
-    pending_amount = float(pending_res.scalar_one() or 0.0)
-    failed_res = await db.execute(select(func.count()).where(Payment.status == PaymentStatus.cancelled))
-    failed_count = int(failed_res.scalar_one() or 0)
+async def payments_summary(session_factory=Depends(get_session_factory)):
+    return await _cached(session_factory, ("payments/summary",), _settings.analytics_summary_ttl_sec, _payments_summary)
+
+
+async def _payments_summary(db: AsyncSession) -> PaymentsSummary:
+    # served from payment_rollups (kept in step by payment writes); one FILTER aggregate
+    # over payments when the rollup table is not there yet (run /admin/db/patch)
+    try:
+        row = (await db.execute(summary_select())).one()
+    except SQLAlchemyError:
+        await db.rollback()
+        row = (await db.execute(live_summary_select())).one()
     return PaymentsSummary(
-        total_revenue=total_revenue,
-        paid_count=paid_count,
-        pending_amount=pending_amount,
-        failed_count=failed_count,
+        total_revenue=float(row.total_revenue or 0.0),
+        paid_count=int(row.paid_count or 0),
+        pending_amount=float(row.pending_amount or 0.0),
+        failed_count=int(row.failed_count or 0),
     )
 
 
@@ -43,79 +63,72 @@ class RevenuePoint(BaseModel):
 
 
 @router.get("/revenue/daily", response_model=List[RevenuePoint])
-async def revenue_daily(days: int = 30, db: AsyncSession = Depends(get_db)):
-    # group by date on created_at for captured payments
-    res = await db.execute(
-        select(func.date(Payment.created_at).label("d"), func.coalesce(func.sum(Payment.amount_captured), 0))
-        .where(Payment.status == PaymentStatus.captured)
-        .group_by(func.date(Payment.created_at))
-        .order_by(func.date(Payment.created_at).desc())
-        .limit(days)
-    )
-    rows = res.all()
+async def revenue_daily(days: int = 30, session_factory=Depends(get_session_factory)):
+    return await _cached(session_factory, ("revenue/daily", days), _settings.analytics_revenue_ttl_sec, _revenue_daily, days)
+
+
+async def _revenue_daily(db: AsyncSession, days: int) -> List[RevenuePoint]:
+    # captured revenue per UTC day from hourly_rollups; raw payments until /admin/db/patch
+    try:
+        rows = (await db.execute(revenue_daily_select(days))).all()
+    except SQLAlchemyError:
+        await db.rollback()
+        res = await db.execute(
+            select(func.date(Payment.created_at).label("d"), func.coalesce(func.sum(Payment.amount_captured), 0))
+            .where(Payment.status == PaymentStatus.captured)
+            .group_by(func.date(Payment.created_at))
+            .order_by(func.date(Payment.created_at).desc())
+            .limit(days)
+        )
+        rows = res.all()
     points = [RevenuePoint(date=str(d), amount=float(a or 0.0)) for d, a in rows]
     # reverse to chronological
     return list(reversed(points))
 
 
 class OccupancyPoint(BaseModel):
-    date: str
+    date: str  # YYYY-MM-DD, or the ISO bucket start for hourly granularity
     occupancy: float  # percentage 0..100
+    location_id: Optional[str] = None  # set when by_location=true ('' = no location)
 
 
 @router.get("/occupancy/daily", response_model=List[OccupancyPoint])
-async def occupancy_daily(days: int = 30, db: AsyncSession = Depends(get_db)):
-    # total capacity across all slots
-    cap_res = await db.execute(select(func.coalesce(func.sum(Slot.capacity), 0)))
-    total_capacity = int(cap_res.scalar_one() or 0)
-
-    if total_capacity <= 0:
-        # No capacity defined; return zeros
-        today = dt.datetime.utcnow().date()
-        start_date = today - dt.timedelta(days=max(days - 1, 0))
-        out = []
-        d = start_date
-        while d <= today:
-            out.append(OccupancyPoint(date=str(d), occupancy=0.0))
-            d += dt.timedelta(days=1)
-        return out
-
-    # Range in UTC
-    today = dt.datetime.utcnow().date()
-    start_date = today - dt.timedelta(days=max(days - 1, 0))
-    start_dt = dt.datetime.combine(start_date, dt.time.min, tzinfo=dt.timezone.utc)
-    end_dt = dt.datetime.combine(today + dt.timedelta(days=1), dt.time.min, tzinfo=dt.timezone.utc)
-
-    # Fetch sessions overlapping the range: started before end and (ended_at is null or ended after start)
-    sess_res = await db.execute(
-        select(Session.session_id, Session.started_at, Session.ended_at)
-        .where(Session.started_at != None)
-        .where(Session.started_at < end_dt)
-        .where((Session.ended_at == None) | (Session.ended_at > start_dt))
+async def occupancy_daily(
+    days: int = Query(30, ge=0, le=366),
+    granularity: Granularity = "day",
+    by_location: bool = False,
+    session_factory=Depends(get_session_factory),
+):
+    """Occupied share of slot capacity per UTC day (or hour) over the last `days` days.
+
+    Ended sessions are read from hourly_rollups and only open sessions are bucketed live,
+    so the cost stays flat as history grows (without the rollup table every session in
+    range is bucketed in SQL, see occupancy_history). With by_location=true there is one
+    series per location, each against that location's capacity.
+    """
+    return await _cached(
+        session_factory, ("occupancy/daily", days, granularity, by_location), _settings.analytics_occupancy_ttl_sec,
+        _occupancy_daily, days, granularity, by_location,
     )
-    sessions = sess_res.all()
 
-    # Build daily buckets
-    out: List[OccupancyPoint] = []
-    day_ptr = start_date
-    while day_ptr <= today:
-        day_start = dt.datetime.combine(day_ptr, dt.time.min, tzinfo=dt.timezone.utc)
-        day_end = day_start + dt.timedelta(days=1)
-        total_occupied_seconds = 0.0
-        now_utc = dt.datetime.now(dt.timezone.utc)
-        for _, s_start, s_end in sessions:
-            s_start = s_start if s_start.tzinfo else s_start.replace(tzinfo=dt.timezone.utc)
-            s_end = (s_end if s_end is not None else now_utc)
-            s_end = s_end if s_end.tzinfo else s_end.replace(tzinfo=dt.timezone.utc)
-            # Overlap of [s_start, s_end) with [day_start, day_end)
-            overlap_start = max(s_start, day_start)
-            overlap_end = min(s_end, day_end)
-            if overlap_end > overlap_start:
-                total_occupied_seconds += (overlap_end - overlap_start).total_seconds()
-
-        denom = total_capacity * 24 * 3600
-        occ = 0.0 if denom <= 0 else min(100.0, (total_occupied_seconds / denom) * 100.0)
-        out.append(OccupancyPoint(date=str(day_ptr), occupancy=round(occ, 2)))
-        day_ptr += dt.timedelta(days=1)
 
+async def _occupancy_daily(db: AsyncSession, days: int, granularity: Granularity, by_location: bool) -> List[OccupancyPoint]:
+    start, end = range_for(days)
+    step = BUCKET[granularity]
+    capacity = await capacity_by_location(db, by_location)
+    seconds = {}
+    if any(capacity.values()):
+        try:
+            seconds = await rollup_occupied_seconds(db, start, end, granularity, by_location)
+        except SQLAlchemyError:
+            await db.rollback()
+            seconds = await occupied_seconds(db, start, end, granularity, by_location)
+    out: List[OccupancyPoint] = []
+    for lid in sorted(capacity):
+        for b in bucket_starts(start, end, granularity):
+            out.append(OccupancyPoint(
+                date=str(b.date()) if granularity == "day" else b.isoformat(),
+                occupancy=occupancy_pct(seconds.get((lid, b), 0.0), capacity[lid], step),
+                location_id=lid if by_location else None,
+            ))
     return out
@@ -1,21 +1,37 @@
+import base64
+import csv
+import io
+import json
+import uuid
 from typing import Optional, List, Dict, Any
-from fastapi import APIRouter, HTTPException, Depends, Query, Path
+from fastapi import APIRouter, HTTPException, Depends, Query, Path, Header, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 from app.services.inmemory_store import (
     create_booking, BOOKINGS, BOOKING_CANDIDATES, add_backup_slots, swap_booking_slot,
     SLOTS, nearest_prediction
 )
 from app.schemas.ml import AgentsConfig  # reuse config defaults for reliability threshold
-from sqlalchemy import select, update, func, literal_column
+from sqlalchemy import select, insert, func, literal_column, cast, String, or_, tuple_, literal, true
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.core.db import get_db
-from app.models import Booking, BookingCandidate, BookingStatus, BookingMode, Slot, SlotPrediction, EventsOutbox, Payment, PaymentStatus, Location, Session, AppUser
+from app.core.db import get_db, SessionLocal
+from app.models import Booking, BookingCandidate, BookingStatus, BookingMode, Slot, EventsOutbox, Payment, PaymentStatus, Location, Session, AppUser
+from app.services.prediction_index import nearest_with_fallback, nearest_with_fallback_batch, prediction_index
+from app.services.prediction_queries import nearest_prediction_select
+from app.services.idempotency import idempotency
+from app.services.booking_swaps import swap_bookings
+from app.services.slot_catalog import slot_catalog
+from app.services.hold_expiry import hold_deadline, hold_expiry
+from app.services.booking_intervals import (
+    BookingIntervalIndex, booking_intervals, booking_span, lock_slot, lock_slots, slot_conflicts, overlapping_select,
+)
 
 router = APIRouter(prefix="/bookings", tags=["bookings"])
 
 # Reuse an in-memory config; in real system fetch from persisted config
 CONFIG = AgentsConfig()
+BULK_MAX_ITEMS = 500
 
 class BookingCreateRequest(BaseModel):
     slot_id: str = Field(..., description="Target parking slot identifier", example="LOT1_S042")
@@ -37,6 +53,49 @@ class SwapRequest(BaseModel):
     new_slot_id: str
 
 
+class BulkSwapMove(BaseModel):
+    booking_id: str
+    new_slot_id: str
+
+
+class BulkSwapRequest(BaseModel):
+    moves: List[BulkSwapMove] = Field(..., min_length=1, max_length=BULK_MAX_ITEMS)
+
+
+class BulkSwapResult(BaseModel):
+    index: int
+    booking_id: str
+    ok: bool
+    status_code: int
+    booking: Optional[BookingResponse] = None
+    error: Optional[str] = None
+
+
+class BulkSwapResponse(BaseModel):
+    swapped: int
+    failed: int
+    results: List[BulkSwapResult]
+
+
+class BulkBookingRequest(BaseModel):
+    items: List[BookingCreateRequest] = Field(..., min_length=1, max_length=BULK_MAX_ITEMS,
+                                              description="Bookings to create (one per vehicle)")
+
+
+class BulkBookingResult(BaseModel):
+    index: int
+    ok: bool
+    status_code: int
+    booking: Optional[BookingResponse] = None
+    error: Optional[str] = None
+
+
+class BulkBookingResponse(BaseModel):
+    created: int
+    failed: int
+    results: List[BulkBookingResult]
+
+
 class BookingLedgerItem(BaseModel):
     id: str
     customer: Optional[str] = None
@@ -51,12 +110,199 @@ class BookingLedgerItem(BaseModel):
     paymentStatus: Optional[str] = None
 
 
+IDEMPOTENCY_SCOPE_CREATE = "POST /bookings/"
+BACKUP_POOL_SIZE = 50  # same-cluster slots considered as smart-hold backups
+
+
+async def _rank_backups(
+    db: AsyncSession,
+    cluster_id: str,
+    exclude_slot_id: str,
+    eta_dt,
+    window,
+    limit: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """Top `limit` (default CONFIG.backups_limit) same-cluster slots by p_free at the ETA.
+
+    Constant round trips: with the slot catalogue and prediction index warm it needs at
+    most one prediction query (index misses); with a cold index the pool, nearest-prediction
+    lookup and ranking run as a single statement.
+    """
+    limit = limit or CONFIG.backups_limit
+    pool = (
+        select(Slot.slot_id)
+        .where(Slot.cluster_id == cluster_id, Slot.slot_id != exclude_slot_id)
+        .order_by(Slot.slot_id)
+        .limit(BACKUP_POOL_SIZE)
+    )
+    if slot_catalog.ready and prediction_index.ready:
+        # fully in-process unless the index misses some slots
+        alt_ids = [sid for sid in slot_catalog.in_cluster(cluster_id) if sid != exclude_slot_id][:BACKUP_POOL_SIZE]
+        if alt_ids:
+            preds = await nearest_with_fallback(db, alt_ids, eta_dt, window)
+            candidates = [{"slot_id": sid, "confidence": preds[sid][1]} for sid in alt_ids if sid in preds]
+            candidates.sort(key=lambda x: (-x["confidence"], x["slot_id"]))
+            return candidates[:limit]
+    if not prediction_index.ready:
+        nearest = nearest_prediction_select(pool.subquery("pool"), eta_dt, window).subquery("nearest")
+        res = await db.execute(
+            select(nearest.c.slot_id, nearest.c.p_free)
+            .order_by(nearest.c.p_free.desc(), nearest.c.slot_id)
+            .limit(limit)
+        )
+        return [{"slot_id": sid, "confidence": float(p)} for sid, p in res.all()]
+    alt_ids = [sid for (sid,) in (await db.execute(pool)).all()]
+    preds = await nearest_with_fallback(db, alt_ids, eta_dt, window)
+    candidates = [{"slot_id": sid, "confidence": preds[sid][1]} for sid in alt_ids if sid in preds]
+    candidates.sort(key=lambda x: (-x["confidence"], x["slot_id"]))
+    return candidates[:limit]
+
+
+async def _reroute(
+    db: AsyncSession,
+    cluster_id: str,
+    taken_slot_id: str,
+    eta_dt,
+    window,
+    span,
+) -> Optional[tuple]:
+    """Best free same-cluster slot for a smart hold whose target is taken: (slot_id, p_free) or None.
+
+    Slots the interval index already knows are busy are skipped without a query. Locks are
+    only try-acquired here: we already hold taken_slot_id's lock, and waiting on a second
+    one could deadlock with a writer doing the reverse.
+    """
+    ranked = await _rank_backups(db, cluster_id, taken_slot_id, eta_dt, window, limit=BACKUP_POOL_SIZE)
+    for cand in ranked:
+        sid = cand["slot_id"]
+        if booking_intervals.overlapping(sid, *span):
+            continue
+        if not await lock_slot(db, sid, wait=False):
+            continue
+        if not await slot_conflicts(db, sid, *span):
+            return sid, cand["confidence"]
+    return None
+
+
+def _ledger_query():
+    """Bookings joined to user, lot, payment and session, newest first (keyset order).
+
+    One row per booking: its latest payment and latest session are picked by LATERAL
+    subqueries (idx_payments_booking_created, idx_sessions_booking_id), so LIMIT counts
+    bookings and a booking with several payments or sessions is not repeated.
+    """
+    pay = (
+        select(Payment.amount_captured, Payment.amount_authorized, Payment.status)
+        .where(Payment.booking_id == Booking.booking_id)
+        .order_by(Payment.created_at.desc())
+        .limit(1)
+        .lateral("pay")
+    )
+    sess = (
+        select(Session.started_at, Session.ended_at)
+        .where(Session.booking_id == Booking.booking_id)
+        .order_by(Session.started_at.desc().nulls_last())
+        .limit(1)
+        .lateral("sess")
+    )
+    return (
+        select(
+            Booking.booking_id,
+            Booking.slot_id,
+            Booking.cluster_id,
+            Booking.eta_minute,
+            Booking.status,
+            Booking.created_at,
+            AppUser.email.label("user_email"),
+            Location.name.label("lot_name"),
+            pay.c.amount_captured,
+            pay.c.amount_authorized,
+            pay.c.status.label("pay_status"),
+            sess.c.started_at.label("sess_started"),
+            sess.c.ended_at.label("sess_ended"),
+        )
+        .select_from(Booking)
+        .outerjoin(AppUser, AppUser.user_id == Booking.user_id)
+        .outerjoin(Slot, Slot.slot_id == Booking.slot_id)
+        .outerjoin(Location, Location.location_id == Slot.location_id)
+        .outerjoin(pay, true())
+        .outerjoin(sess, true())
+        .order_by(Booking.created_at.desc(), Booking.booking_id.desc())
+    )
+
+
+def _ledger_item(r, now) -> BookingLedgerItem:
+    (booking_id, slot_id, cluster_id, eta_minute, status, created_at, user_email, lot_name,
+     amount_captured, amount_authorized, pay_status, sess_started, sess_ended) = r
+    # Amount resolution
+    amount_val = None
+    if amount_captured is not None:
+        amount_val = float(amount_captured)
+    elif amount_authorized is not None:
+        amount_val = float(amount_authorized)
+    # Payment status mapping
+    payment_status_ui = None
+    if pay_status is not None:
+        if pay_status == PaymentStatus.captured:
+            payment_status_ui = "paid"
+        elif pay_status == PaymentStatus.preauth_ok:
+            payment_status_ui = "pending"
+        elif pay_status in (PaymentStatus.cancelled, PaymentStatus.refunded):
+            payment_status_ui = "failed" if pay_status == PaymentStatus.cancelled else "paid"
+    # Duration: if session started
+    duration_str = None
+    if sess_started is not None:
+        end_ref = sess_ended or now
+        delta = end_ref - sess_started
+        mins = int(delta.total_seconds() // 60)
+        if mins >= 60:
+            hours = mins // 60
+            rem = mins % 60
+            duration_str = f"{hours}h {rem}m" if rem else f"{hours}h"
+        else:
+            duration_str = f"{mins}m"
+    # Customer display (local part of email)
+    customer_name = None
+    if user_email:
+        customer_name = user_email.split("@")[0]
+    return BookingLedgerItem(
+        id=booking_id,
+        customer=customer_name,
+        email=user_email,
+        lot=lot_name or cluster_id,
+        startDate=eta_minute.isoformat() if eta_minute else None,
+        endDate=sess_ended.isoformat() if sess_ended else None,
+        duration=duration_str,
+        amount=(f"${amount_val:.2f}" if amount_val is not None else None),
+        paymentMethod=("Card" if amount_val is not None else None),
+        status=status.value if status else None,
+        paymentStatus=payment_status_ui,
+    )
+
+
+def _encode_ledger_cursor(created_at, booking_id: str) -> str:
+    raw = json.dumps([created_at.isoformat(), booking_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_ledger_cursor(cursor: str) -> tuple:
+    from datetime import datetime
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, booking_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), str(uuid.UUID(booking_id))
+    except Exception:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+
+
 @router.get("/recent", response_model=List[BookingLedgerItem],
     summary="Get recent bookings ledger",
     response_description="Recent bookings with user, location, payment, and session details",
 )
 async def recent(
+    response: Response,
     limit: int = Query(50, ge=1, le=500, description="Maximum number of bookings to return"),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the previous page's X-Next-Cursor header"),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -69,113 +315,125 @@ async def recent(
     - Session duration and timestamps
     
     Optimized with a single SQL query to avoid N+1 problems.
+
+    ## Pagination
+
+    Keyset pagination on `(created_at, booking_id)`, newest first (index
+    idx_bookings_created_at_id). When more rows exist the response carries an
+    `X-Next-Cursor` header; pass it back as `cursor`. Deep pages cost the same as the
+    first. Bookings without created_at have no place in that order and are left out here;
+    `GET /bookings/recent/export` streams every booking.
     """
     try:
-        # Build a LEFT JOIN query to avoid N+1 lookups
-        q = (
-            select(
-                Booking.booking_id,
-                Booking.slot_id,
-                Booking.cluster_id,
-                Booking.eta_minute,
-                Booking.status,
-                Booking.created_at,
-                AppUser.email.label("user_email"),
-                Location.name.label("lot_name"),
-                Payment.amount_captured,
-                Payment.amount_authorized,
-                Payment.status.label("pay_status"),
-                Session.started_at.label("sess_started"),
-                Session.ended_at.label("sess_ended"),
-            )
-            .select_from(Booking)
-            .outerjoin(AppUser, AppUser.user_id == Booking.user_id)
-            .outerjoin(Slot, Slot.slot_id == Booking.slot_id)
-            .outerjoin(Location, Location.location_id == Slot.location_id)
-            .outerjoin(Payment, Payment.booking_id == Booking.booking_id)
-            .outerjoin(Session, Session.booking_id == Booking.booking_id)
-            .order_by(Booking.created_at.desc())
-            .limit(limit)
-        )
-        res = await db.execute(q)
+        q = _ledger_query().where(Booking.created_at.isnot(None))
+        if cursor:
+            created_at, booking_id = _decode_ledger_cursor(cursor)
+            q = q.where(tuple_(Booking.created_at, Booking.booking_id) < tuple_(
+                literal(created_at, Booking.created_at.type), literal(booking_id, Booking.booking_id.type)
+            ))
+        res = await db.execute(q.limit(limit + 1))
         rows = res.all()
-        items: List[BookingLedgerItem] = []
         from datetime import datetime, timezone
         now = datetime.now(timezone.utc)
-        for r in rows:
-            (booking_id, slot_id, cluster_id, eta_minute, status, created_at, user_email, lot_name,
-             amount_captured, amount_authorized, pay_status, sess_started, sess_ended) = r
-            # Amount resolution
-            amount_val = None
-            if amount_captured is not None:
-                amount_val = float(amount_captured)
-            elif amount_authorized is not None:
-                amount_val = float(amount_authorized)
-            # Payment status mapping
-            payment_status_ui = None
-            if pay_status is not None:
-                if pay_status == PaymentStatus.captured:
-                    payment_status_ui = "paid"
-                elif pay_status == PaymentStatus.preauth_ok:
-                    payment_status_ui = "pending"
-                elif pay_status in (PaymentStatus.cancelled, PaymentStatus.refunded):
-                    payment_status_ui = "failed" if pay_status == PaymentStatus.cancelled else "paid"
-            # Duration: if session started
-            duration_str = None
-            if sess_started is not None:
-                end_ref = sess_ended or now
-                delta = end_ref - sess_started
-                mins = int(delta.total_seconds() // 60)
-                if mins >= 60:
-                    hours = mins // 60
-                    rem = mins % 60
-                    duration_str = f"{hours}h {rem}m" if rem else f"{hours}h"
-                else:
-                    duration_str = f"{mins}m"
-            # Customer display (local part of email)
-            customer_name = None
-            if user_email:
-                customer_name = user_email.split("@")[0]
-            items.append(BookingLedgerItem(
-                id=booking_id,
-                customer=customer_name,
-                email=user_email,
-                lot=lot_name or cluster_id,
-                startDate=eta_minute.isoformat() if eta_minute else None,
-                endDate=sess_ended.isoformat() if sess_ended else None,
-                duration=duration_str,
-                amount=(f"${amount_val:.2f}" if amount_val is not None else None),
-                paymentMethod=("Card" if amount_val is not None else None),
-                status=status.value if status else None,
-                paymentStatus=payment_status_ui,
-            ))
-        return items
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            response.headers["X-Next-Cursor"] = _encode_ledger_cursor(last.created_at, last.booking_id)
+        return [_ledger_item(r, now) for r in rows]
     except SQLAlchemyError as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+
+EXPORT_BATCH_ROWS = 1000
+
+
+@router.get("/recent/export",
+    summary="Stream the bookings ledger",
+    response_description="All bookings as NDJSON or CSV, newest first",
+)
+async def export_recent(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$", description="ndjson or csv"),
+):
+    """
+    Stream every ledger row (same fields as `/bookings/recent`) in constant memory.
+
+    Rows come from a server-side cursor (`yield_per`) and are written out in batches of
+    EXPORT_BATCH_ROWS, so exporting millions of bookings never materialises the result set.
+    The stream opens its own DB session because the request-scoped one is closed before
+    a streaming body runs.
+    """
+    if SessionLocal is None:
+        raise HTTPException(status_code=503, detail="Database not configured")
+    fields = list(BookingLedgerItem.model_fields)
+
+    async def rows():
+        from datetime import datetime, timezone
+        now = datetime.now(timezone.utc)
+        if format == "csv":
+            buf = io.StringIO()
+            csv.writer(buf).writerow(fields)
+            yield buf.getvalue()
+        async with SessionLocal() as db:  # type: ignore
+            result = await db.stream(_ledger_query().execution_options(yield_per=EXPORT_BATCH_ROWS))
+            async for batch in result.partitions():
+                buf = io.StringIO()
+                if format == "csv":
+                    w = csv.writer(buf)
+                    for r in batch:
+                        item = _ledger_item(r, now).model_dump()
+                        w.writerow(["" if item[f] is None else item[f] for f in fields])
+                else:
+                    for r in batch:
+                        buf.write(_ledger_item(r, now).model_dump_json())
+                        buf.write("\n")
+                yield buf.getvalue()
+
+    media = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        rows(),
+        media_type=media,
+        headers={"Content-Disposition": f'attachment; filename="bookings.{format}"'},
+    )
+
 @router.post("/", response_model=BookingResponse,
     summary="Create a new parking booking",
     response_description="Created booking with confirmation details",
     status_code=201,
 )
-async def create(req: BookingCreateRequest, db: AsyncSession = Depends(get_db)):
+async def create(
+    req: BookingCreateRequest,
+    db: AsyncSession = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255,
+                                            description="Client retry key; a replay returns the original response"),
+):
+    request_hash = idempotency.fingerprint(req.model_dump())
+    replay = await idempotency.replay(db, IDEMPOTENCY_SCOPE_CREATE, idempotency_key, request_hash)
+    if replay is not None:
+        return replay
     # Validate/resolve slot (DB first). Demo-friendly: if provided id is actually a cluster_id or location_id,
     # resolve it to a real slot to avoid 404s when UI sends pseudo IDs.
     target_slot_id: str = req.slot_id
     cluster_id: Optional[str] = None
     try:
-        res = await db.execute(select(Slot.cluster_id).where(Slot.slot_id == target_slot_id))
-        cluster_id = res.scalar_one_or_none()
+        await slot_catalog.ensure_fresh(db)
+        info = slot_catalog.resolve(target_slot_id)
+        if info is not None:
+            target_slot_id, cluster_id = info.slot_id, info.cluster_id
+        else:
+            res = await db.execute(select(Slot.cluster_id).where(Slot.slot_id == target_slot_id))
+            cluster_id = res.scalar_one_or_none()
         if cluster_id is None:
             res2 = await db.execute(
                 select(Slot.slot_id, Slot.cluster_id)
-                .where((Slot.cluster_id == target_slot_id) | (Slot.location_id == target_slot_id))
+                .where((Slot.cluster_id == target_slot_id) | (cast(Slot.location_id, String) == target_slot_id))
                 .limit(1)
             )
             row = res2.first()
             if row is not None:
                 target_slot_id = row[0]
                 cluster_id = row[1]
+        if info is None and cluster_id is not None:
+            slot_catalog.mark_stale()
     except SQLAlchemyError:
         cluster_id = None
     if cluster_id is None:
@@ -196,27 +454,9 @@ async def create(req: BookingCreateRequest, db: AsyncSession = Depends(get_db)):
     from datetime import datetime, timedelta
     eta_dt = datetime.fromisoformat(req.eta.replace("Z", "+00:00"))
     window = timedelta(minutes=req.window_minutes)
-    lower = eta_dt - window
-    upper = eta_dt + window
-    # nearest for primary slot using dual before/after within window
-    before_q = await db.execute(
-        select(SlotPrediction)
-        .where(SlotPrediction.slot_id == target_slot_id, SlotPrediction.eta_minute <= eta_dt, SlotPrediction.eta_minute >= lower)
-        .order_by(SlotPrediction.eta_minute.desc())
-        .limit(1)
-    )
-    before = before_q.scalar_one_or_none()
-    after_q = await db.execute(
-        select(SlotPrediction)
-        .where(SlotPrediction.slot_id == target_slot_id, SlotPrediction.eta_minute >= eta_dt, SlotPrediction.eta_minute <= upper)
-        .order_by(SlotPrediction.eta_minute.asc())
-        .limit(1)
-    )
-    after = after_q.scalar_one_or_none()
-    chosen = before or after
-    if before and after:
-        chosen = before if abs((before.eta_minute - eta_dt).total_seconds()) <= abs((after.eta_minute - eta_dt).total_seconds()) else after
-    p = float(chosen.p_free) if chosen is not None else None
+    # nearest prediction for primary slot (in-process index, DB on miss)
+    primary = await nearest_with_fallback(db, [target_slot_id], eta_dt, window)
+    p = primary[target_slot_id][1] if target_slot_id in primary else None
 
     # Try DB persistence
     try:
@@ -225,6 +465,25 @@ async def create(req: BookingCreateRequest, db: AsyncSession = Depends(get_db)):
         status = BookingStatus.held if req.mode == "smart_hold" else BookingStatus.confirmed
         mode_enum = BookingMode.smart_hold if req.mode == "smart_hold" else BookingMode.guaranteed
         eta_dt = dt.datetime.fromisoformat(req.eta.replace("Z", "+00:00"))
+        span = booking_span(eta_dt)
+        # Serialise writers on this slot (all workers), then check live bookings in SQL
+        await lock_slot(db, target_slot_id)
+        # a concurrent retry with the same key may have committed while we waited for the
+        # lock; its booking would show up as a conflict below, so replay it instead
+        replay = await idempotency.replay(db, IDEMPOTENCY_SCOPE_CREATE, idempotency_key, request_hash)
+        if replay is not None:
+            return replay
+        conflicts = await slot_conflicts(db, target_slot_id, *span)
+        if conflicts:
+            rerouted = None
+            if req.mode == "smart_hold" and cluster_id:
+                rerouted = await _reroute(db, cluster_id, target_slot_id, eta_dt, window, span)
+            if rerouted is None:
+                raise HTTPException(
+                    status_code=409,
+                    detail={"message": "slot already booked around this ETA", "conflicting_booking_ids": conflicts},
+                )
+            target_slot_id, p = rerouted
         b = Booking(
             booking_id=booking_id,
             user_id=None,
@@ -236,51 +495,26 @@ async def create(req: BookingCreateRequest, db: AsyncSession = Depends(get_db)):
             p_free_at_hold=p,
         )
         db.add(b)
+        hold_expires_at = hold_deadline(eta_dt) if req.mode == "smart_hold" else None
         # primary candidate
         db.add(BookingCandidate(
             booking_id=booking_id,
             slot_id=target_slot_id,
             role="primary",
             confidence_at_add=p,
-            hold_expires_at=None,
+            hold_expires_at=hold_expires_at,
         ))
         backups: List[Dict[str, Any]] = []
         if req.mode == "smart_hold" and p is not None and p < CONFIG.reliability_threshold and cluster_id:
-            # choose alternatives in same cluster from DB and rank by nearest prediction probability
-            res_slots = await db.execute(
-                select(Slot.slot_id).where(Slot.cluster_id == cluster_id, Slot.slot_id != target_slot_id).limit(50)
-            )
-            alt_ids = [sid for (sid,) in res_slots.all()]
-            candidates: List[Dict[str, Any]] = []
-            for sid in alt_ids:
-                bq = await db.execute(
-                    select(SlotPrediction)
-                    .where(SlotPrediction.slot_id == sid, SlotPrediction.eta_minute <= eta_dt, SlotPrediction.eta_minute >= lower)
-                    .order_by(SlotPrediction.eta_minute.desc())
-                    .limit(1)
-                )
-                aq = await db.execute(
-                    select(SlotPrediction)
-                    .where(SlotPrediction.slot_id == sid, SlotPrediction.eta_minute >= eta_dt, SlotPrediction.eta_minute <= upper)
-                    .order_by(SlotPrediction.eta_minute.asc())
-                    .limit(1)
-                )
-                bpred = bq.scalar_one_or_none()
-                apred = aq.scalar_one_or_none()
-                pick = bpred or apred
-                if bpred and apred:
-                    pick = bpred if abs((bpred.eta_minute - eta_dt).total_seconds()) <= abs((apred.eta_minute - eta_dt).total_seconds()) else apred
-                if pick is not None:
-                    candidates.append({"slot_id": sid, "confidence": float(pick.p_free)})
-            candidates.sort(key=lambda x: -x["confidence"])
-            backups = candidates[: CONFIG.backups_limit]
+            # choose alternatives in same cluster and rank by nearest prediction probability
+            backups = await _rank_backups(db, cluster_id, target_slot_id, eta_dt, window)
             for cand in backups:
                 db.add(BookingCandidate(
                     booking_id=booking_id,
                     slot_id=cand["slot_id"],
                     role="backup",
                     confidence_at_add=cand.get("confidence"),
-                    hold_expires_at=None,
+                    hold_expires_at=hold_expires_at,
                 ))
         # Outbox event for booking.created (include backups with confidence)
         evt_payload = {
@@ -299,8 +533,7 @@ async def create(req: BookingCreateRequest, db: AsyncSession = Depends(get_db)):
             event_type="booking.created",
             payload=evt_payload,
         ))
-        await db.commit()
-        return BookingResponse(
+        resp = BookingResponse(
             booking_id=booking_id,
             slot_id=target_slot_id,
             eta_minute=req.eta,
@@ -309,6 +542,15 @@ async def create(req: BookingCreateRequest, db: AsyncSession = Depends(get_db)):
             p_free_at_hold=p,
             backups=backups,
         )
+        replay = await idempotency.commit(
+            db, IDEMPOTENCY_SCOPE_CREATE, idempotency_key, request_hash, 201, resp.model_dump(),
+        )
+        if replay is not None:
+            return replay
+        booking_intervals.add(target_slot_id, booking_id, *span)
+        if hold_expires_at is not None:
+            hold_expiry.schedule(booking_id, hold_expires_at)
+        return resp
     except SQLAlchemyError as e:
         await db.rollback()
         # Fallback to memory path
@@ -329,7 +571,7 @@ async def create(req: BookingCreateRequest, db: AsyncSession = Depends(get_db)):
             backups = candidates[: CONFIG.backups_limit]
             if backups:
                 add_backup_slots(booking["booking_id"], backups)
-        return BookingResponse(
+        resp = BookingResponse(
             booking_id=booking["booking_id"],
             slot_id=booking["slot_id"],
             eta_minute=booking["eta_minute"],
@@ -338,6 +580,216 @@ async def create(req: BookingCreateRequest, db: AsyncSession = Depends(get_db)):
             p_free_at_hold=booking["p_free_at_hold"],
             backups=BOOKING_CANDIDATES.get(booking["booking_id"], []),
         )
+        if idempotency_key:
+            # memory fallback: only this process can replay it
+            idempotency.remember(IDEMPOTENCY_SCOPE_CREATE, idempotency_key, request_hash, 201, resp.model_dump())
+        return resp
+
+@router.post("/bulk", response_model=BulkBookingResponse,
+    summary="Create many bookings in one transaction",
+    response_description="Per-item results; failed items do not block the rest",
+)
+async def create_bulk(
+    req: BulkBookingRequest,
+    db: AsyncSession = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
+):
+    """
+    Create up to 500 bookings (fleet / corporate customers) with a fixed number of queries.
+
+    Slots (slot, cluster or lot ids, as in `POST /bookings/`) are resolved from the slot
+    catalogue (one query for ids it does not know), all target slots are locked in one
+    statement, predictions come from the in-process index with one DB query for all of its
+    misses, and bookings, candidates and `booking.created` outbox rows are written with
+    multi-row inserts and a single commit.
+
+    Items fail individually (`ok=false` with a status code): unknown slot (404), bad ETA
+    (422) or an overlap with a live booking or an earlier item of the same batch (409).
+    Unlike the single endpoint, conflicting smart holds are not re-routed.
+    """
+    import uuid, datetime as dt
+    request_hash = idempotency.fingerprint(req.model_dump())
+    replay = await idempotency.replay(db, "POST /bookings/bulk", idempotency_key, request_hash)
+    if replay is not None:
+        return replay
+
+    results: Dict[int, BulkBookingResult] = {}
+
+    def fail(i: int, code: int, msg: str):
+        results[i] = BulkBookingResult(index=i, ok=False, status_code=code, error=msg)
+
+    etas: Dict[int, dt.datetime] = {}
+    for i, item in enumerate(req.items):
+        try:
+            etas[i] = dt.datetime.fromisoformat(item.eta.replace("Z", "+00:00"))
+        except ValueError:
+            fail(i, 422, "invalid eta")
+
+    # 1) resolve every requested id (slot, cluster or location): slot catalogue, then one
+    #    query for whatever it does not know
+    await slot_catalog.ensure_fresh(db)
+    resolved: Dict[str, tuple] = {}
+    pseudo: Dict[str, tuple] = {}
+    for ref in {req.items[i].slot_id for i in etas}:
+        info = slot_catalog.resolve(ref)
+        if info is not None:
+            resolved[ref] = (info.slot_id, info.cluster_id)
+    wanted = sorted({req.items[i].slot_id for i in etas} - set(resolved))
+    if wanted:
+        res = await db.execute(
+            select(Slot.slot_id, Slot.cluster_id, cast(Slot.location_id, String))
+            .where(or_(Slot.slot_id.in_(wanted), Slot.cluster_id.in_(wanted), cast(Slot.location_id, String).in_(wanted)))
+            .order_by(Slot.slot_id)
+        )
+        rows = res.all()
+        for sid, cid, lid in rows:
+            resolved.setdefault(sid, (sid, cid))
+            pseudo.setdefault(cid, (sid, cid))
+            if lid:
+                pseudo.setdefault(lid, (sid, cid))
+        if rows:
+            slot_catalog.mark_stale()
+    targets: Dict[int, tuple] = {}
+    for i in etas:
+        hit = resolved.get(req.items[i].slot_id) or pseudo.get(req.items[i].slot_id)
+        if hit is None:
+            fail(i, 404, "slot not found")
+        else:
+            targets[i] = hit
+
+    # 2) lock target slots in sorted order (no deadlock between bulk writers; single
+    #    creates only ever wait on one lock), then one overlap query for all of them
+    slot_ids = sorted({sid for sid, _ in targets.values()})
+    await lock_slots(db, slot_ids)
+    batch = BookingIntervalIndex()
+    if targets:
+        spans = [booking_span(etas[i]) for i in targets]
+        q = overlapping_select(slot_ids, min(a for a, _ in spans), max(b for _, b in spans))
+        for bid, sid, eta in (await db.execute(q)).all():
+            batch.add(sid, bid, *booking_span(eta))
+            booking_intervals.add(sid, bid, *booking_span(eta))
+
+    # 3) predictions: in-process index, one query for the misses of every (eta, window)
+    groups: Dict[tuple, List[int]] = {}
+    for i in targets:
+        groups.setdefault((etas[i], req.items[i].window_minutes), []).append(i)
+    smart_clusters = sorted({targets[i][1] for i in targets if req.items[i].mode == "smart_hold" and targets[i][1]})
+    cluster_slots: Dict[str, List[str]] = {}
+    if smart_clusters and slot_catalog.ready and all(slot_catalog.in_cluster(c) for c in smart_clusters):
+        cluster_slots = {c: slot_catalog.in_cluster(c)[: BACKUP_POOL_SIZE + 1] for c in smart_clusters}
+    elif smart_clusters:
+        res = await db.execute(
+            select(Slot.slot_id, Slot.cluster_id).where(Slot.cluster_id.in_(smart_clusters)).order_by(Slot.slot_id)
+        )
+        for sid, cid in res.all():
+            pool = cluster_slots.setdefault(cid, [])
+            if len(pool) <= BACKUP_POOL_SIZE:
+                pool.append(sid)
+    requests = []
+    for (eta_dt, window_minutes), idxs in groups.items():
+        ids = {targets[i][0] for i in idxs}
+        for i in idxs:
+            if req.items[i].mode == "smart_hold":
+                ids.update(cluster_slots.get(targets[i][1], []))
+        requests.append((sorted(ids), eta_dt, dt.timedelta(minutes=window_minutes)))
+    preds: Dict[tuple, Dict[str, tuple]] = dict(zip(groups, await nearest_with_fallback_batch(db, requests)))
+
+    # 4) build rows in request order; earlier items win intra-batch conflicts
+    now = dt.datetime.now(dt.timezone.utc)
+    booking_rows: List[Dict[str, Any]] = []
+    candidate_rows: List[Dict[str, Any]] = []
+    outbox_rows: List[Dict[str, Any]] = []
+    accepted: List[tuple] = []
+    for i in sorted(targets):
+        item = req.items[i]
+        target_slot_id, cluster_id = targets[i]
+        span = booking_span(etas[i])
+        if batch.overlapping(target_slot_id, *span):
+            fail(i, 409, "slot already booked around this ETA")
+            continue
+        group_preds = preds[(etas[i], item.window_minutes)]
+        p = group_preds[target_slot_id][1] if target_slot_id in group_preds else None
+        backups: List[Dict[str, Any]] = []
+        if item.mode == "smart_hold" and p is not None and p < CONFIG.reliability_threshold and cluster_id:
+            pool = [sid for sid in cluster_slots.get(cluster_id, []) if sid != target_slot_id][:BACKUP_POOL_SIZE]
+            ranked = sorted(
+                ({"slot_id": sid, "confidence": group_preds[sid][1]} for sid in pool if sid in group_preds),
+                key=lambda x: (-x["confidence"], x["slot_id"]),
+            )
+            backups = ranked[: CONFIG.backups_limit]
+        booking_id = str(uuid.uuid4())
+        status = BookingStatus.held if item.mode == "smart_hold" else BookingStatus.confirmed
+        hold_expires_at = hold_deadline(etas[i]) if item.mode == "smart_hold" else None
+        batch.add(target_slot_id, booking_id, *span)
+        booking_rows.append({
+            "booking_id": booking_id,
+            "user_id": None,
+            "slot_id": target_slot_id,
+            "cluster_id": cluster_id or "",
+            "eta_minute": etas[i],
+            "mode": BookingMode.smart_hold if item.mode == "smart_hold" else BookingMode.guaranteed,
+            "status": status,
+            "p_free_at_hold": p,
+            "created_at": now,
+        })
+        candidate_rows.append({
+            "booking_id": booking_id, "slot_id": target_slot_id, "role": "primary",
+            "confidence_at_add": p, "hold_expires_at": hold_expires_at,
+        })
+        candidate_rows.extend(
+            {"booking_id": booking_id, "slot_id": c["slot_id"], "role": "backup",
+             "confidence_at_add": c["confidence"], "hold_expires_at": hold_expires_at}
+            for c in backups
+        )
+        outbox_rows.append({
+            "event_id": str(uuid.uuid4()),
+            "event_type": "booking.created",
+            "payload": {
+                "booking_id": booking_id,
+                "slot_id": target_slot_id,
+                "eta_minute": item.eta,
+                "mode": item.mode,
+                "status": status.value,
+                "p_free_at_hold": p,
+                "backups": backups,
+                "add_on_ids": item.add_on_ids,
+                "bulk": True,
+                "created_at": now.isoformat(),
+            },
+            "status": "pending",
+            "created_at": now,
+        })
+        results[i] = BulkBookingResult(index=i, ok=True, status_code=201, booking=BookingResponse(
+            booking_id=booking_id,
+            slot_id=target_slot_id,
+            eta_minute=item.eta,
+            mode=item.mode,
+            status=status.value,
+            p_free_at_hold=p,
+            backups=backups,
+        ))
+        accepted.append((target_slot_id, booking_id, span, hold_expires_at))
+
+    # 5) multi-row inserts, one commit
+    if booking_rows:
+        await db.execute(insert(Booking).values(booking_rows))
+        await db.execute(insert(BookingCandidate).values(candidate_rows))
+        await db.execute(insert(EventsOutbox).values(outbox_rows))
+    ordered = [results[i] for i in range(len(req.items))]
+    resp = BulkBookingResponse(
+        created=len(booking_rows),
+        failed=len(ordered) - len(booking_rows),
+        results=ordered,
+    )
+    replay = await idempotency.commit(db, "POST /bookings/bulk", idempotency_key, request_hash, 200, resp.model_dump())
+    if replay is not None:
+        return replay
+    for slot_id, booking_id, span, hold_expires_at in accepted:
+        booking_intervals.add(slot_id, booking_id, *span)
+        if hold_expires_at is not None:
+            hold_expiry.schedule(booking_id, hold_expires_at)
+    return resp
+
 
 @router.get("/{booking_id}", response_model=BookingResponse,
     summary="Get booking by ID",
@@ -389,6 +841,35 @@ async def get_booking(
         backups=BOOKING_CANDIDATES.get(booking_id, []),
     )
 
+@router.post("/swap/bulk", response_model=BulkSwapResponse,
+    summary="Swap many bookings in one transaction",
+    response_description="Per-move results; failed moves do not block the rest",
+)
+async def swap_bulk(req: BulkSwapRequest, db: AsyncSession = Depends(get_db)):
+    """
+    Move up to 500 bookings to new slots at once (backup activation when a lot fills,
+    incentive and violation flows). Same rules as the single swap, applied per move:
+    404 for unknown bookings/slots, 409 for non-live bookings or slots taken around the
+    booking's ETA (including by an earlier move in the same request).
+
+    Emits one `booking.swapped` outbox event per successful move.
+    """
+    outcomes = await swap_bookings(db, [(m.booking_id, m.new_slot_id) for m in req.moves])
+    results = [
+        BulkSwapResult(
+            index=i,
+            booking_id=o.booking_id,
+            ok=o.ok,
+            status_code=o.status_code,
+            booking=BookingResponse(**o.booking) if o.ok else None,
+            error=o.error,
+        )
+        for i, o in enumerate(outcomes)
+    ]
+    swapped = sum(1 for r in results if r.ok)
+    return BulkSwapResponse(swapped=swapped, failed=len(results) - swapped, results=results)
+
+
 @router.post("/{booking_id}/swap", response_model=BookingResponse,
     summary="Swap booking to a different slot",
     response_description="Updated booking with new slot assignment",
@@ -408,61 +889,12 @@ async def swap(
     
     Emits a `booking.swapped` event to the outbox for downstream processing.
     """
-    # Try DB path
+    # Try DB path: one transaction (lock, check, UPDATE ... RETURNING with backups, outbox)
     try:
-        # validate slot
-        res_slot = await db.execute(select(Slot.slot_id).where(Slot.slot_id == req.new_slot_id))
-        if res_slot.scalar_one_or_none() is None:
-            raise HTTPException(status_code=404, detail="slot not found")
-        res_b = await db.execute(select(Booking).where(Booking.booking_id == booking_id))
-        b = res_b.scalar_one_or_none()
-        if b is None:
-            raise HTTPException(status_code=404, detail="booking not found")
-        old_slot_id = b.slot_id or ""
-        await db.execute(
-            update(Booking)
-            .where(Booking.booking_id == booking_id)
-            .values(slot_id=req.new_slot_id, status=BookingStatus.confirmed)
-        )
-        await db.commit()
-        # reload
-        res_b2 = await db.execute(select(Booking).where(Booking.booking_id == booking_id))
-        b2 = res_b2.scalar_one()
-        # candidates
-        cres = await db.execute(select(BookingCandidate).where(BookingCandidate.booking_id == booking_id))
-        cands = cres.scalars().all()
-        backups = [
-            {"slot_id": c.slot_id, "role": c.role, "confidence": float(c.confidence_at_add) if c.confidence_at_add is not None else None}
-            for c in cands if c.role == "backup"
-        ]
-        # Outbox event booking.swapped
-        import uuid, datetime as dt
-        swap_evt = EventsOutbox(
-            event_id=str(uuid.uuid4()),
-            event_type="booking.swapped",
-            payload={
-                "booking_id": b2.booking_id,
-                "old_slot_id": old_slot_id,
-                "new_slot_id": b2.slot_id,
-                "status": b2.status.value,
-                "mode": b2.mode.value,
-                "eta_minute": b2.eta_minute.isoformat(),
-                "p_free_at_hold": float(b2.p_free_at_hold) if b2.p_free_at_hold is not None else None,
-                "backups": backups,
-                "swapped_at": dt.datetime.utcnow().isoformat(),
-            },
-        )
-        db.add(swap_evt)
-        await db.commit()
-        return BookingResponse(
-            booking_id=b2.booking_id,
-            slot_id=b2.slot_id or "",
-            eta_minute=b2.eta_minute.isoformat(),
-            mode=b2.mode.value,
-            status=b2.status.value,
-            p_free_at_hold=float(b2.p_free_at_hold) if b2.p_free_at_hold is not None else None,
-            backups=backups,
-        )
+        (outcome,) = await swap_bookings(db, [(booking_id, req.new_slot_id)])
+        if not outcome.ok:
+            raise HTTPException(status_code=outcome.status_code, detail=outcome.error)
+        return BookingResponse(**outcome.booking)
     except SQLAlchemyError:
         # Fallback to memory
         if req.new_slot_id not in [s["slot_id"] for s in SLOTS]:
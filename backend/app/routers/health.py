@@ -3,6 +3,19 @@ from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
 from app.core.db import SessionLocal
 from app.agents.predictor import PREDICTOR_STATUS
+from app.services.prediction_index import prediction_index
+from app.services.offer_cache import offer_cache
+from app.services.idempotency import idempotency
+from app.services.booking_intervals import booking_intervals
+from app.services.slot_catalog import slot_catalog
+from app.services.hold_expiry import hold_expiry
+from app.services.event_bus import event_bus
+from app.services.live_sessions import live_sessions
+from app.services.lot_occupancy import lot_occupancy
+from app.services.plate_index import plate_index
+from app.services.end_pipeline import end_pipeline
+from app.services.analytics_cache import analytics_cache
+from app.services.rollup_tables import rollup_tables
 
 router = APIRouter(prefix="/health", tags=["health"])
 
@@ -19,4 +32,22 @@ async def health_db():
 
 @router.get("/predictor")
 async def health_predictor():
-    return {"ok": PREDICTOR_STATUS.get("last_run") is not None, **PREDICTOR_STATUS}
+    return {"ok": PREDICTOR_STATUS.get("last_run") is not None, **PREDICTOR_STATUS, "index": prediction_index.status()}
+
+@router.get("/caches")
+async def health_caches():
+    """Hit/miss counters for in-process caches (use to size them)."""
+    return {
+        "offers": offer_cache.stats(),
+        "idempotency": idempotency.stats(),
+        "booking_intervals": booking_intervals.status(),
+        "slot_catalog": slot_catalog.status(),
+        "hold_expiry": hold_expiry.status(),
+        "event_bus": event_bus.status(),
+        "live_sessions": live_sessions.status(),
+        "lot_occupancy": lot_occupancy.status(),
+        "plate_index": plate_index.status(),
+        "end_pipeline": end_pipeline.status(),
+        "analytics": analytics_cache.stats(),
+        "rollup_tables": rollup_tables.status(),
+    }
@@ -1,11 +1,15 @@
 from typing import List, Optional, Dict, Any
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
-from sqlalchemy import select, func
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.db import get_db
-from app.models import Location, Slot, Session as SessionModel, Booking
+from app.models import Location, Slot
+from app.services.geo_index import geo_index
+from app.services.offer_cache import offer_cache
+from app.services.slot_catalog import slot_catalog
+from app.services.lot_occupancy import lot_occupancy
 
 router = APIRouter(prefix="/inventory", tags=["inventory"])
 
@@ -29,6 +33,13 @@ class LotDetail(BaseModel):
     amenities: List[str] = []
     slots: List[Dict[str, Any]] = []  # [{slot_id, is_ev, is_accessible, occupied}]
 
+class LotOccupancyItem(BaseModel):
+    id: str
+    capacity: int
+    occupancy: int
+    available: int
+    occupied_slots: Optional[List[str]] = None
+
 class LotCreateRequest(BaseModel):
     name: str
     address: Optional[str] = None
@@ -52,19 +63,14 @@ LOT_META: Dict[str, Dict[str, Any]] = {}
 async def list_lots(db: AsyncSession = Depends(get_db)):
     loc_res = await db.execute(select(Location))
     locations = loc_res.scalars().all()
+    await slot_catalog.ensure_fresh(db)
+    await lot_occupancy.ensure_fresh(db)
+    capacities = slot_catalog.capacity_by_location()
     items: List[LotItem] = []
     for loc in locations:
-        cap_res = await db.execute(select(func.count()).select_from(Slot).where(Slot.location_id == loc.location_id))
-        capacity = int(cap_res.scalar_one() or 0)
+        capacity = capacities.get(loc.location_id, 0)
         # Active sessions (ended_at is NULL) for slots at this location
-        occ_res = await db.execute(
-            select(func.count())
-            .select_from(SessionModel)
-            .join(Booking, Booking.booking_id == SessionModel.booking_id)
-            .join(Slot, Slot.slot_id == Booking.slot_id)
-            .where(Slot.location_id == loc.location_id, SessionModel.ended_at.is_(None))
-        )
-        occupancy = int(occ_res.scalar_one() or 0)
+        occupancy = lot_occupancy.count(loc.location_id)
         meta = LOT_META.get(loc.location_id, {})
         items.append(LotItem(
             id=loc.location_id,
@@ -78,31 +84,43 @@ async def list_lots(db: AsyncSession = Depends(get_db)):
         ))
     return items
 
+@router.get("/lots/occupancy", response_model=List[LotOccupancyItem])
+async def lots_occupancy(include_slots: bool = False, db: AsyncSession = Depends(get_db)):
+    """Capacity and occupancy of every lot in one call, from the in-memory counters."""
+    await slot_catalog.ensure_fresh(db)
+    await lot_occupancy.ensure_fresh(db)
+    capacities = slot_catalog.capacity_by_location()
+    items: List[LotOccupancyItem] = []
+    for location_id, capacity in sorted(capacities.items()):
+        occupied = lot_occupancy.occupied(location_id)
+        items.append(LotOccupancyItem(
+            id=location_id,
+            capacity=capacity,
+            occupancy=lot_occupancy.count(location_id),
+            available=max(capacity - len(occupied), 0),
+            occupied_slots=sorted(occupied) if include_slots else None,
+        ))
+    return items
+
 @router.get("/lots/{location_id}", response_model=LotDetail)
 async def get_lot(location_id: str, db: AsyncSession = Depends(get_db)):
     loc_res = await db.execute(select(Location).where(Location.location_id == location_id))
     loc = loc_res.scalar_one_or_none()
     if not loc:
         raise HTTPException(status_code=404, detail="lot not found")
-    cap_res = await db.execute(select(func.count()).select_from(Slot).where(Slot.location_id == location_id))
-    capacity = int(cap_res.scalar_one() or 0)
-    active_res = await db.execute(
-        select(Booking.slot_id)
-        .join(SessionModel, SessionModel.booking_id == Booking.booking_id)
-        .join(Slot, Slot.slot_id == Booking.slot_id)
-        .where(Slot.location_id == location_id, SessionModel.ended_at.is_(None))
-    )
-    occupied_slot_ids = {row[0] for row in active_res.all()}
+    await slot_catalog.ensure_fresh(db)
+    await lot_occupancy.ensure_fresh(db)
+    slots = slot_catalog.in_location(location_id)
+    capacity = len(slots)
+    occupied_slot_ids = lot_occupancy.occupied(location_id)
     occ = len(occupied_slot_ids)
-    slots_res = await db.execute(select(Slot).where(Slot.location_id == location_id))
-    slots = slots_res.scalars().all()
     slot_payload = [
         {
             "slot_id": s.slot_id,
             "is_ev": bool(s.is_ev),
             "is_accessible": bool(s.is_accessible),
             "occupied": s.slot_id in occupied_slot_ids,
-            "dynamic_price": float(s.dynamic_price),
+            "dynamic_price": s.dynamic_price,
         }
         for s in slots
     ]
@@ -162,6 +180,10 @@ async def create_lot(req: LotCreateRequest, db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=500, detail=str(e))
     # Store meta
     LOT_META[loc_id] = {"amenities": req.amenities}
+    if req.latitude is not None and req.longitude is not None:
+        geo_index.add(loc_id, req.latitude, req.longitude)
+    slot_catalog.bump("lot.created")
+    offer_cache.invalidate("lot.created")
     return LotCreateResponse(id=loc_id, created_slots=slots_created, message="lot created")
 
 
@@ -177,19 +199,16 @@ class SlotItem(BaseModel):
 
 @router.get("/slots", response_model=List[SlotItem])
 async def list_slots(location_id: Optional[str] = None, db: AsyncSession = Depends(get_db)):
-    q = select(Slot)
-    if location_id:
-        q = q.where(Slot.location_id == location_id)
-    res = await db.execute(q)
-    slots = res.scalars().all()
+    await slot_catalog.ensure_fresh(db)
+    slots = slot_catalog.in_location(location_id) if location_id else slot_catalog.all()
     return [
         SlotItem(
             slot_id=s.slot_id,
             location_id=s.location_id,
             cluster_id=s.cluster_id,
-            base_price=float(s.base_price),
-            dynamic_price=float(s.dynamic_price),
-            is_ev=bool(s.is_ev),
-            is_accessible=bool(s.is_accessible),
+            base_price=s.base_price,
+            dynamic_price=s.dynamic_price,
+            is_ev=s.is_ev,
+            is_accessible=s.is_accessible,
         ) for s in slots
     ]
@@ -1,6 +1,15 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Depends
 from pydantic import BaseModel
 from typing import List, Optional
+import uuid
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.db import get_db
+from app.models import Session as SessionModel
+from app.services.live_sessions import live_sessions
+from app.services.plate_index import normalize_plate, plate_index
 
 router = APIRouter(prefix="/navigation", tags=["navigation"])
 
@@ -68,24 +77,69 @@ async def get_path(
 	return NavPath(origin=origin, destination=bay, nodes=nodes, steps=steps)
 
 class LocateRequest(BaseModel):
-	session_id: str
+	session_id: str | None = None
+	plate: str | None = None
 	current_lat: float
 	current_lng: float
 	bay_label: str | None = None
 
+
+async def _resolve_session(db: AsyncSession, req: LocateRequest) -> str:
+	"""Active session for the request: given directly, or via the plate index (checked
+	against the DB, which is also asked on a miss)."""
+	if req.session_id:
+		return req.session_id
+	plate = normalize_plate(req.plate)
+	if plate is None:
+		raise HTTPException(status_code=422, detail="provide session_id or plate")
+	await plate_index.ensure_fresh(db)
+	session_id = plate_index.lookup(plate)
+	if session_id is not None:
+		res = await db.execute(
+			select(SessionModel.session_id)
+			.where(SessionModel.session_id == session_id, SessionModel.ended_at.is_(None))
+		)
+		if res.scalar_one_or_none() is None:  # ended on another worker since the index was built
+			plate_index.session_ended(session_id)
+			session_id = None
+	if session_id is None:
+		res = await db.execute(
+			select(SessionModel.session_id)
+			.where(SessionModel.plate == plate, SessionModel.ended_at.is_(None))
+			.order_by(SessionModel.started_at.desc())
+			.limit(1)
+		)
+		session_id = res.scalar_one_or_none()
+	if session_id is None:
+		raise HTTPException(status_code=404, detail="no active session for plate")
+	return session_id
+
+
+async def _session_bay(db: AsyncSession, session_id: str) -> str | None:
+	live = live_sessions.get(session_id)
+	if live is not None:
+		return live.bay_label
+	try:
+		uuid.UUID(session_id)
+	except ValueError:
+		return None
+	res = await db.execute(select(SessionModel.bay_label).where(SessionModel.session_id == session_id))
+	return res.scalar_one_or_none()
+
 @router.post("/locate", response_model=NavPath,
 	summary="Locate parked car (panic mode)",
 	response_description="Navigation path from current position to parked vehicle",
 )
-async def locate(req: LocateRequest):
+async def locate(req: LocateRequest, db: AsyncSession = Depends(get_db)):
 	"""
 	Generate path from user's current position to their parked vehicle.
 	
 	## Use Case: Panic Mode / Car Locator
 	
 	When a driver can't remember where they parked:
-	1. Provide current GPS coordinates
-	2. Session bay_label is used to determine vehicle location
+	1. Provide current GPS coordinates and either `session_id` or the car's `plate`
+	2. Session bay_label is used to determine vehicle location (looked up from the
+	   live-session projection when not supplied)
 	3. Returns step-by-step path through parking structure
 	
 	## Path Generation
@@ -98,18 +152,20 @@ async def locate(req: LocateRequest):
 	- Unfamiliar parking structures
 	- Low-visibility conditions
 	"""
+	session_id = await _resolve_session(db, req)
+	bay_label = req.bay_label or await _session_bay(db, session_id)
 	origin = NavNode(id="origin", lat=req.current_lat, lng=req.current_lng, level="G")
 	# Fake destination based on label hash for visual variation
 	import hashlib
-	seed = int(hashlib.sha256((req.bay_label or "B2-A1").encode()).hexdigest(), 16) % 1000
+	seed = int(hashlib.sha256((bay_label or "B2-A1").encode()).hexdigest(), 16) % 1000
 	dlat = (seed % 10) * 0.00001
 	dlng = ((seed // 10) % 10) * 0.00001
 	ramp = NavNode(id="ramp", lat=req.current_lat - 0.0002, lng=req.current_lng + 0.0001, level="B1")
-	dest = NavNode(id=f"bay:{req.bay_label or 'B2-A1'}", lat=ramp.lat - dlat, lng=ramp.lng + dlng, level="B2")
+	dest = NavNode(id=f"bay:{bay_label or 'B2-A1'}", lat=ramp.lat - dlat, lng=ramp.lng + dlng, level="B2")
 	steps = [
 		NavStep(instruction="Proceed to internal ramp", distance_m=50, level="G"),
 		NavStep(instruction="Descend to B1", distance_m=40, level="B1"),
-		NavStep(instruction=f"Follow aisle to bay {req.bay_label or 'B2-A1'}", distance_m=30, level="B2"),
+		NavStep(instruction=f"Follow aisle to bay {bay_label or 'B2-A1'}", distance_m=30, level="B2"),
 	]
 	return NavPath(origin=origin, destination=dest, nodes=[origin, ramp, dest], steps=steps)
 
@@ -1,13 +1,24 @@
-from typing import List
-from fastapi import APIRouter, Query, Depends
+import base64
+import heapq
+import json
+from datetime import datetime, timedelta
+from typing import List, NamedTuple, Optional
+from fastapi import APIRouter, Query, Depends, HTTPException, Response
 from pydantic import BaseModel
+from app.core.config import get_settings
 from app.core.db import get_db, SessionLocal
-from sqlalchemy import select
+from sqlalchemy import select, func, bindparam, cast, String
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.models import Slot, SlotPrediction
+from app.models import Slot
+from app.services.geo_index import geo_index, haversine_m
+from app.services.offer_cache import offer_cache
+from app.services.prediction_index import nearest_with_fallback
 
 router = APIRouter(prefix="/offers", tags=["offers"])
 
+_settings = get_settings()
+
 class Offer(BaseModel):
     slot_id: str
     cluster_id: str
@@ -24,10 +35,18 @@ class Offer(BaseModel):
     response_description="List of parking offers sorted by availability confidence",
 )
 async def search_offers(
+    response: Response,
     lat: float = Query(..., description="User's current latitude", example=18.5204),
     lng: float = Query(..., description="User's current longitude", example=73.8567),
     eta: str = Query(..., description="Expected arrival time (ISO 8601)", example="2025-11-09T14:30:00Z"),
     window_minutes: int = Query(60, ge=5, le=240, description="Time window for predictions (minutes)", example=60),
+    radius_m: int = Query(3000, ge=100, le=50000, description="Search radius around the user (meters)", example=3000),
+    ev: Optional[bool] = Query(None, description="Only EV-charging (true) or non-EV (false) bays"),
+    accessible: Optional[bool] = Query(None, description="Only accessible (true) or standard (false) bays"),
+    max_price: Optional[float] = Query(None, ge=0, description="Maximum current dynamic price"),
+    cluster_id: Optional[str] = Query(None, description="Restrict to one slot cluster"),
+    limit: int = Query(50, ge=1, le=500, description="Page size"),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the previous page's X-Next-Cursor header"),
     db: AsyncSession = Depends(get_db),
 ):
     """
@@ -35,10 +54,21 @@ async def search_offers(
     
     ## Algorithm
     
-    1. **Time Window Bounding** - Restricts search to predictions within ±window_minutes of ETA
-    2. **Dual Query Strategy** - Fetches one prediction before and one after ETA, selects closest
-    3. **Confidence Filtering** - Skips slots with no predictions in the time window
-    4. **Ranking** - Sorts by confidence (desc), price (asc), distance (asc)
+    1. **Radius Filter** - Only lots whose entrance lies within `radius_m` (haversine) are considered,
+       looked up in an in-memory grid index; nearest lots fill the candidate cap first
+    2. **Time Window Bounding** - Restricts search to predictions within ±window_minutes of ETA
+    3. **Nearest Prediction** - Read at the exact ETA from the in-process prediction index (refreshed
+       by the predictor); slots it cannot answer use one set-based query (candidate count capped by
+       `OFFERS_MAX_SLOTS`). Candidate slots are cached per ~550 m cell, predictions are not
+    4. **Confidence Filtering** - Skips slots with no predictions in the time window
+       (`ev`, `accessible`, `max_price` and `cluster_id` filters are applied in the candidate query)
+    5. **Ranking** - Sorts by confidence (desc), price (asc), distance (asc); only the requested
+       page is selected (heap top-k), so cost scales with `limit`, not the candidate count
+    
+    ## Pagination
+    
+    Returns at most `limit` offers. When more are available the response carries an
+    `X-Next-Cursor` header; pass it back as `cursor` to fetch the next page.
     
     ## Response Fields
     
@@ -68,74 +98,174 @@ async def search_offers(
     ## Notes
     
     - Slots with `p_free < 0.7` may offer backup slots in smart_hold mode
-    - Distance is calculated as straight-line from user position
+    - Distance is the straight-line (haversine) distance from the user to the lot entrance
     - Prices are in local currency (INR by default)
     """
-    from datetime import datetime, timedelta
     eta_dt = datetime.fromisoformat(eta.replace("Z", "+00:00"))
     window = timedelta(minutes=window_minutes)
-    lower = eta_dt - window
-    upper = eta_dt + window
-
-    # Fetch candidate slots (limit for demo)
-    res = await db.execute(select(Slot).limit(50))
-    slots = res.scalars().all()
-    offers: List[Offer] = []
-
-    for s in slots:
-        # prediction before
-        before_q = await db.execute(
-            select(SlotPrediction)
-            .where(SlotPrediction.slot_id == s.slot_id, SlotPrediction.eta_minute <= eta_dt, SlotPrediction.eta_minute >= lower)
-            .order_by(SlotPrediction.eta_minute.desc())
-            .limit(1)
-        )
-        before = before_q.scalar_one_or_none()
-        # prediction after
-        after_q = await db.execute(
-            select(SlotPrediction)
-            .where(SlotPrediction.slot_id == s.slot_id, SlotPrediction.eta_minute >= eta_dt, SlotPrediction.eta_minute <= upper)
-            .order_by(SlotPrediction.eta_minute.asc())
-            .limit(1)
-        )
-        after = after_q.scalar_one_or_none()
-        chosen = None
-        if before and after:
-            # choose closer by absolute time delta
-            if abs((before.eta_minute - eta_dt).total_seconds()) <= abs((after.eta_minute - eta_dt).total_seconds()):
-                chosen = before
-            else:
-                chosen = after
+
+    await geo_index.ensure_fresh(db)
+    # Candidate slots are shared per geo cell; predictions are read at this request's exact
+    # ETA, and distance and the exact radius cut are applied per request below
+    filters = _Filters(ev=ev, accessible=accessible, max_price=max_price, cluster_id=cluster_id)
+    key = offer_cache.key(lat, lng, radius_m, filters)
+    candidates = offer_cache.get(key)
+    if candidates is None:
+        generation = offer_cache.generation
+        c_lat, c_lng = offer_cache.cell_center(key)
+        candidates = await _candidate_slots(db, c_lat, c_lng, radius_m + offer_cache.cell_radius_m(key), filters)
+        offer_cache.put(key, candidates, generation)
+    scored = await _score_candidates(db, candidates, eta_dt, window)
+    # Rank key: (-p_free, price, distance_m, slot_id); slot_id makes the order total so the
+    # cursor is stable. Only the requested page is ranked with a heap and serialised.
+    keyed: List[tuple] = []  # (rank key, candidate)
+    for c in scored:
+        point = geo_index.point(c.location_id) if c.location_id else None
+        if point is not None:
+            distance = haversine_m(lat, lng, point[0], point[1])
+            if distance > radius_m:
+                continue
         else:
-            chosen = before or after
-        if not chosen:
-            continue  # no prediction in window
-        offers.append(Offer(
-            slot_id=s.slot_id,
-            cluster_id=s.cluster_id,
-            distance_m=200,
-            eta_minute=eta,
-            p_free=float(chosen.p_free),
-            price=float(s.dynamic_price),
-            ev=bool(s.is_ev),
-            accessible=bool(s.is_accessible),
-        ))
-    offers.sort(key=lambda o: (-o.p_free, o.price, o.distance_m))
+            distance = 200  # unlocated demo slot
+        keyed.append(((-c.p_free, c.price, int(round(distance)), c.slot_id), c))
 
     # Inject deterministic high-confidence top slots per cluster for demo
-    # For each cluster_id keep first 3 and elevate p_free if below thresholds
+    # For each cluster_id take its top 3 and elevate p_free if below thresholds
     demo_thresholds = [0.95, 0.92, 0.84]
-    seen: dict[str, int] = {}
-    adjusted: List[Offer] = []
-    for off in offers:
-        count = seen.get(off.cluster_id, 0)
-        if count < len(demo_thresholds):
-            target = demo_thresholds[count]
-            if off.p_free < target:
-                off.p_free = target
-            seen[off.cluster_id] = count + 1
-        adjusted.append(off)
-    offers = adjusted
-    # Re-sort after adjustment
-    offers.sort(key=lambda o: (-o.p_free, o.price, o.distance_m))
-    return offers
+    by_cluster: dict[str, List[tuple]] = {}
+    for k, c in keyed:
+        by_cluster.setdefault(c.cluster_id, []).append(k)
+    boosted: dict[str, float] = {}
+    for keys in by_cluster.values():
+        for target, k in zip(demo_thresholds, heapq.nsmallest(len(demo_thresholds), keys)):
+            if -k[0] < target:
+                boosted[k[3]] = target
+
+    after = _decode_cursor(cursor) if cursor else None
+
+    def beyond_cursor():
+        for k, c in keyed:
+            if k[3] in boosted:
+                k = (-boosted[k[3]], *k[1:])
+            if after is None or k > after:
+                yield k, c
+
+    page = heapq.nsmallest(limit + 1, beyond_cursor(), key=lambda kc: kc[0])
+    if len(page) > limit:
+        page = page[:limit]
+        response.headers["X-Next-Cursor"] = _encode_cursor(page[-1][0])
+    return [
+        Offer(
+            slot_id=c.slot_id,
+            cluster_id=c.cluster_id,
+            distance_m=distance_m,
+            eta_minute=eta,
+            p_free=-neg_p,
+            price=price,
+            ev=c.ev,
+            accessible=c.accessible,
+        )
+        for (neg_p, price, distance_m, _), c in page
+    ]
+
+
+def _encode_cursor(key: tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        neg_p, price, distance_m, slot_id = json.loads(raw)
+        return (float(neg_p), float(price), int(distance_m), str(slot_id))
+    except Exception:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+
+
+class _Filters(NamedTuple):
+    ev: Optional[bool] = None
+    accessible: Optional[bool] = None
+    max_price: Optional[float] = None
+    cluster_id: Optional[str] = None
+
+
+class _Candidate(NamedTuple):
+    slot_id: str
+    cluster_id: str
+    location_id: Optional[str]
+    price: float
+    ev: bool
+    accessible: bool
+
+
+class _Scored(NamedTuple):
+    slot_id: str
+    cluster_id: str
+    location_id: Optional[str]
+    p_free: float
+    price: float
+    ev: bool
+    accessible: bool
+
+
+async def _candidate_slots(
+    db: AsyncSession,
+    lat: float,
+    lng: float,
+    radius_m: float,
+    filters: _Filters = _Filters(),
+) -> List[_Candidate]:
+    """Candidate slots around (lat, lng), nearest lots first, capped at OFFERS_MAX_SLOTS.
+
+    Filters are applied in the candidate SQL (partial indexes idx_slots_ev_location /
+    idx_slots_accessible_location, idx_slots_cluster_price), so filtered-out slots never cost
+    a prediction lookup or a place under the cap.
+    """
+    # Candidate selection: lots within radius_m from the in-memory grid, nearest lots first.
+    # Unlocated demo catalogues (no lot has entrance coordinates) keep the legacy behaviour.
+    slot_q = select(Slot.slot_id, Slot.cluster_id, Slot.location_id, Slot.dynamic_price, Slot.is_ev, Slot.is_accessible)
+    # bare column / NOT column (not "IS true"), so the planner can use the partial indexes
+    if filters.ev is not None:
+        slot_q = slot_q.where(Slot.is_ev if filters.ev else ~Slot.is_ev)
+    if filters.accessible is not None:
+        slot_q = slot_q.where(Slot.is_accessible if filters.accessible else ~Slot.is_accessible)
+    if filters.max_price is not None:
+        slot_q = slot_q.where(Slot.dynamic_price <= filters.max_price)
+    if filters.cluster_id is not None:
+        slot_q = slot_q.where(Slot.cluster_id == filters.cluster_id)
+    if len(geo_index):
+        near_ids = [lid for lid, _ in geo_index.nearby(lat, lng, radius_m)]
+        if not near_ids:
+            return []
+        slot_q = (
+            slot_q.where(Slot.location_id.in_(near_ids))
+            .order_by(func.array_position(bindparam("near_ids", near_ids, type_=ARRAY(String)), cast(Slot.location_id, String)))
+        )
+    res = await db.execute(slot_q.limit(_settings.offers_max_slots))
+    return [
+        _Candidate(
+            slot_id=r.slot_id,
+            cluster_id=r.cluster_id,
+            location_id=r.location_id,
+            price=float(r.dynamic_price),
+            ev=bool(r.is_ev),
+            accessible=bool(r.is_accessible),
+        )
+        for r in res.all()
+    ]
+
+
+async def _score_candidates(
+    db: AsyncSession,
+    candidates: List[_Candidate],
+    eta_dt: datetime,
+    window: timedelta,
+) -> List[_Scored]:
+    """Candidates with their nearest prediction to eta_dt (slots without one are dropped):
+    in-process prediction index, one set-based query for the slots it cannot answer."""
+    found = await nearest_with_fallback(db, [c.slot_id for c in candidates], eta_dt, window)
+    return [
+        _Scored(c.slot_id, c.cluster_id, c.location_id, float(found[c.slot_id][1]), c.price, c.ev, c.accessible)
+        for c in candidates
+        if c.slot_id in found
+    ]
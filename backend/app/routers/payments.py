@@ -1,14 +1,18 @@
-from typing import Optional
+from typing import List, Literal, Optional
 import uuid
 import datetime as dt
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header
 from pydantic import BaseModel, Field
-from sqlalchemy import select, update
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.db import get_db
-from app.models import Payment, PaymentStatus, Booking, EventsOutbox, Slot
+from app.models import Payment, PaymentStatus, Booking, EventsOutbox
+from app.services.idempotency import idempotency
+from app.services.payment_fsm import transition_payments
+from app.services.payment_rollups import record_new_payments
+from app.services.slot_catalog import current_price
 
 router = APIRouter(prefix="/payments", tags=["payments"])
 
@@ -28,7 +32,15 @@ class PaymentResponse(BaseModel):
 
 
 @router.post("/preauth", response_model=PaymentResponse)
-async def preauth(req: PreauthRequest, db: AsyncSession = Depends(get_db)):
+async def preauth(
+    req: PreauthRequest,
+    db: AsyncSession = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
+):
+    request_hash = idempotency.fingerprint(req.model_dump())
+    replay = await idempotency.replay(db, "POST /payments/preauth", idempotency_key, request_hash)
+    if replay is not None:
+        return replay
     # Validate booking
     b_res = await db.execute(select(Booking).where(Booking.booking_id == req.booking_id))
     booking = b_res.scalar_one_or_none()
@@ -41,10 +53,7 @@ async def preauth(req: PreauthRequest, db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=409, detail="payment already exists")
     amount = req.amount_override
     if amount is None and booking.slot_id:
-        s_res = await db.execute(select(Slot).where(Slot.slot_id == booking.slot_id))
-        slot = s_res.scalar_one_or_none()
-        if slot:
-            amount = float(slot.dynamic_price)
+        amount = await current_price(db, booking.slot_id)
     if amount is None:
         amount = 0.0
     payment = Payment(
@@ -55,6 +64,7 @@ async def preauth(req: PreauthRequest, db: AsyncSession = Depends(get_db)):
         status=PaymentStatus.preauth_ok,
     )
     db.add(payment)
+    await record_new_payments(db, [payment.payment_id])
     # outbox event
     db.add(EventsOutbox(
         event_id=str(uuid.uuid4()),
@@ -66,8 +76,8 @@ async def preauth(req: PreauthRequest, db: AsyncSession = Depends(get_db)):
             "at": dt.datetime.utcnow().isoformat(),
         },
     ))
-    await db.commit()
-    return PaymentResponse(
+    await db.flush()  # populate created_at before building the response
+    resp = PaymentResponse(
         payment_id=payment.payment_id,
         booking_id=payment.booking_id,
         amount_authorized=float(payment.amount_authorized or 0.0),
@@ -75,78 +85,78 @@ async def preauth(req: PreauthRequest, db: AsyncSession = Depends(get_db)):
         status=payment.status.value,
         created_at=payment.created_at.isoformat(),
     )
+    replay = await idempotency.commit(
+        db, "POST /payments/preauth", idempotency_key, request_hash, 200, resp.model_dump(),
+    )
+    return replay if replay is not None else resp
+
+
+PAYMENT_TRANSITION_MAX_ITEMS = 1000
+
+
+class BulkTransitionRequest(BaseModel):
+    action: Literal["capture", "refund", "cancel"]
+    payment_ids: List[str] = Field(..., min_length=1, max_length=PAYMENT_TRANSITION_MAX_ITEMS)
+
+
+class BulkTransitionResult(BaseModel):
+    index: int
+    payment_id: str
+    ok: bool
+    status_code: int
+    payment: Optional[PaymentResponse] = None
+    error: Optional[str] = None
+
+
+class BulkTransitionResponse(BaseModel):
+    transitioned: int
+    failed: int
+    results: List[BulkTransitionResult]
+
+
+async def _transition_one(db: AsyncSession, action: str, payment_id: str) -> PaymentResponse:
+    outcome = (await transition_payments(db, action, [(payment_id, None)]))[0]
+    if not outcome.ok:
+        raise HTTPException(status_code=outcome.status_code, detail=outcome.error)
+    return PaymentResponse(**outcome.payment)
 
 
 @router.post("/{payment_id}/capture", response_model=PaymentResponse)
 async def capture(payment_id: str, db: AsyncSession = Depends(get_db)):
-    p_res = await db.execute(select(Payment).where(Payment.payment_id == payment_id))
-    payment = p_res.scalar_one_or_none()
-    if payment is None:
-        raise HTTPException(status_code=404, detail="payment not found")
-    if payment.status not in (PaymentStatus.preauth_ok, PaymentStatus.init):
-        raise HTTPException(status_code=409, detail="payment not capturable")
-    amount = float(payment.amount_authorized or 0.0)
-    await db.execute(
-        update(Payment)
-        .where(Payment.payment_id == payment_id)
-        .values(amount_captured=amount, status=PaymentStatus.captured)
-    )
-    db.add(EventsOutbox(
-        event_id=str(uuid.uuid4()),
-        event_type="payment.captured",
-        payload={
-            "payment_id": payment_id,
-            "booking_id": payment.booking_id,
-            "amount_captured": amount,
-            "at": dt.datetime.utcnow().isoformat(),
-        },
-    ))
-    await db.commit()
-    # reload
-    p2_res = await db.execute(select(Payment).where(Payment.payment_id == payment_id))
-    p2 = p2_res.scalar_one()
-    return PaymentResponse(
-        payment_id=p2.payment_id,
-        booking_id=p2.booking_id,
-        amount_authorized=float(p2.amount_authorized or 0.0),
-        amount_captured=float(p2.amount_captured or 0.0) if p2.amount_captured is not None else None,
-        status=p2.status.value,
-        created_at=p2.created_at.isoformat(),
-    )
+    return await _transition_one(db, "capture", payment_id)
 
 
 @router.post("/{payment_id}/refund", response_model=PaymentResponse)
 async def refund(payment_id: str, db: AsyncSession = Depends(get_db)):
-    p_res = await db.execute(select(Payment).where(Payment.payment_id == payment_id))
-    payment = p_res.scalar_one_or_none()
-    if payment is None:
-        raise HTTPException(status_code=404, detail="payment not found")
-    if payment.status != PaymentStatus.captured:
-        raise HTTPException(status_code=409, detail="payment not refundable")
-    await db.execute(
-        update(Payment)
-        .where(Payment.payment_id == payment_id)
-        .values(status=PaymentStatus.refunded)
-    )
-    db.add(EventsOutbox(
-        event_id=str(uuid.uuid4()),
-        event_type="payment.refunded",
-        payload={
-            "payment_id": payment_id,
-            "booking_id": payment.booking_id,
-            "amount_refunded": float(payment.amount_captured or 0.0),
-            "at": dt.datetime.utcnow().isoformat(),
-        },
-    ))
-    await db.commit()
-    # reload
-    p2_res = await db.execute(select(Payment).where(Payment.payment_id == payment_id))
-    p2 = p2_res.scalar_one()
-    return PaymentResponse(
-        payment_id=p2.payment_id,
-        booking_id=p2.booking_id,
-        amount_authorized=float(p2.amount_authorized or 0.0),
-        amount_captured=float(p2.amount_captured or 0.0) if p2.amount_captured is not None else None,
-        status=p2.status.value,
-        created_at=p2.created_at.isoformat(),
-    )
+    return await _transition_one(db, "refund", payment_id)
+
+
+@router.post("/transitions", response_model=BulkTransitionResponse,
+    summary="Capture, refund or cancel many payments in one transaction",
+    response_description="Per-payment results; failed items do not block the rest",
+)
+async def transition_bulk(req: BulkTransitionRequest, db: AsyncSession = Depends(get_db)):
+    """
+    Apply one state transition to up to 1000 payments (end-of-day settlement, mass
+    refunds after an outage). Each payment moves only from a valid source state:
+    capture and cancel from `init`/`preauth_ok`, refund from `captured`. Unknown
+    payments are 404, payments in any other state (including ones a concurrent request
+    just moved) are 409.
+
+    Emits one `payment.captured` / `payment.refunded` / `payment.cancelled` outbox event
+    per successful transition.
+    """
+    outcomes = await transition_payments(db, req.action, [(pid, None) for pid in req.payment_ids])
+    results = [
+        BulkTransitionResult(
+            index=i,
+            payment_id=o.ref,
+            ok=o.ok,
+            status_code=o.status_code,
+            payment=PaymentResponse(**o.payment) if o.ok else None,
+            error=o.error,
+        )
+        for i, o in enumerate(outcomes)
+    ]
+    transitioned = sum(1 for r in results if r.ok)
+    return BulkTransitionResponse(transitioned=transitioned, failed=len(results) - transitioned, results=results)
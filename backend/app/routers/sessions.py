@@ -1,13 +1,17 @@
 from typing import Optional
+import asyncio
+import json
 import uuid
 import datetime as dt
 
-from fastapi import APIRouter, HTTPException, Depends, Query, Path
+from fastapi import APIRouter, HTTPException, Depends, Query, Path, Header, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 from sqlalchemy import select, update
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.core.db import get_db
+from app.core.db import get_db, SessionLocal
 from app.models import (
     Session as SessionModel,
     Booking,
@@ -15,11 +19,20 @@ from app.models import (
     ValidationMethod,
     Payment,
     PaymentStatus,
-    Slot,
-    Location,
-    AppUser,
     EventsOutbox,
+    Vehicle,
 )
+from app.services.idempotency import idempotency
+from app.services.booking_intervals import booking_intervals
+from app.services.slot_catalog import current_price, slot_catalog
+from app.services.lot_occupancy import lot_occupancy
+from app.services.session_validation import GateEvent, validate_sessions
+from app.services.plate_index import normalize_plate, plate_index
+from app.services.end_pipeline import EndedSession, end_pipeline
+from app.services.payment_rollups import record_new_payments
+from app.services.hourly_rollups import record_ended_sessions
+from app.services.event_bus import event_bus
+from app.services.live_sessions import LiveSession, live_session_select, live_sessions
 
 
 router = APIRouter(prefix="/sessions", tags=["sessions"])
@@ -29,6 +42,8 @@ class StartRequest(BaseModel):
     booking_id: str
     validation_method: Optional[str] = Field(default=None, pattern="^(qr|nfc|plate)$")
     bay_label: Optional[str] = None
+    plate: Optional[str] = Field(default=None, max_length=32, description="Vehicle plate, for ANPR validation")
+    vehicle_id: Optional[str] = Field(default=None, description="Registered vehicle; supplies the plate if none is given")
     grace_minutes: int = Field(default=15, ge=0, le=240)
 
 
@@ -88,8 +103,21 @@ async def live(
     1. Captured amount (if payment finalized)
     2. Authorized amount (if pre-auth exists)
     3. Duration × dynamic_price (real-time estimate)
+
+    Active-only requests (`recent_hours=0`) are answered from the in-memory live-session
+    projection without a DB query once it is seeded; `recent_hours > 0` queries the DB.
+    Dashboards that poll this should use `GET /sessions/live/stream` instead.
     """
+    return await _live_sessions(db, limit, recent_hours)
+
+
+async def _live_sessions(
+    db: AsyncSession, limit: int, recent_hours: int, location_id: Optional[str] = None,
+) -> list[SessionResponse]:
     now = dt.datetime.utcnow().replace(tzinfo=dt.timezone.utc)
+    if recent_hours == 0 and live_sessions.ready:
+        # active sessions are served from the in-memory projection
+        return [_session_view(r, now) for r in live_sessions.rows(limit, location_id)]
     cutoff = now - dt.timedelta(hours=recent_hours) if recent_hours > 0 else None
     # Build a single joined query to avoid N+1
     base_filters = []
@@ -99,72 +127,172 @@ async def live(
         base_filters.append((SessionModel.ended_at.is_(None)) | (SessionModel.ended_at >= cutoff))
 
     q = (
-        select(
-            SessionModel,
-            Booking,
-            Slot,
-            Location,
-            Payment,
-            AppUser,
-        )
-        .join(Booking, Booking.booking_id == SessionModel.booking_id, isouter=True)
-        .join(AppUser, Booking.user_id == AppUser.user_id, isouter=True)
-        .join(Slot, Booking.slot_id == Slot.slot_id, isouter=True)
-        .join(Location, Slot.location_id == Location.location_id, isouter=True)
-        .join(Payment, Payment.booking_id == Booking.booking_id, isouter=True)
+        live_session_select(location_id)
         .where(*base_filters)
         .order_by(SessionModel.started_at.desc())
         .limit(limit)
     )
     res = await db.execute(q)
-    rows = res.all()
-    payload: list[SessionResponse] = []
-    for s, b, slot, loc, pay, user in rows:
-        # duration in minutes (if ended use ended_at else now)
-        duration_minutes: Optional[int]
-        if s.started_at:
-            end_ref = s.ended_at or now
-            # Clamp negative differences to 0 in case of clock skew or future start times
-            seconds = max(0, (end_ref - s.started_at).total_seconds())
-            # Floor minutes for ended sessions; for active ones ensure at least 1 minute once >0s have elapsed
-            base_minutes = int(seconds // 60)
-            if s.ended_at is None and base_minutes == 0 and seconds > 0:
-                duration_minutes = 1
-            else:
-                duration_minutes = base_minutes
-        else:
-            duration_minutes = None
-        # cost estimate logic
-        if pay and pay.amount_authorized is not None:
-            cost_estimated = float(pay.amount_authorized)
-        elif slot and slot.dynamic_price is not None and duration_minutes is not None:
-            hours = max(1, duration_minutes // 60 or 1)
-            cost_estimated = float(slot.dynamic_price) * hours
+    return [_session_view(LiveSession.from_row(r), now) for r in res.all()]
+
+
+def _session_view(s: LiveSession, now: dt.datetime) -> SessionResponse:
+    # duration in minutes (if ended use ended_at else now)
+    duration_minutes: Optional[int]
+    if s.started_at:
+        end_ref = s.ended_at or now
+        # Clamp negative differences to 0 in case of clock skew or future start times
+        seconds = max(0, (end_ref - s.started_at).total_seconds())
+        # Floor minutes for ended sessions; for active ones ensure at least 1 minute once >0s have elapsed
+        base_minutes = int(seconds // 60)
+        if s.ended_at is None and base_minutes == 0 and seconds > 0:
+            duration_minutes = 1
         else:
-            cost_estimated = None
-        payload.append(SessionResponse(
-            session_id=s.session_id,
-            booking_id=s.booking_id,
-            started_at=s.started_at.isoformat() if s.started_at else None,
-            ended_at=s.ended_at.isoformat() if s.ended_at else None,
-            validation_method=s.validation_method.value if s.validation_method else None,
-            bay_label=s.bay_label,
-            grace_ends_at=s.grace_ends_at.isoformat() if s.grace_ends_at else None,
-            customer_email=getattr(user, "email", None),
-            customer_phone=(getattr(user, "email", "")[:10] if getattr(user, "email", None) else None),
-            lot_name=getattr(loc, "name", None),
-            lot_id=getattr(loc, "location_id", None),
-            lot_lat=float(loc.entrance_lat) if loc and loc.entrance_lat is not None else None,
-            lot_lng=float(loc.entrance_lng) if loc and loc.entrance_lng is not None else None,
-            slot_id=getattr(slot, "slot_id", None),
-            dynamic_price=float(slot.dynamic_price) if slot and slot.dynamic_price is not None else None,
-            payment_status=(pay.status.value if pay and pay.status else None),
-            amount_authorized=(float(pay.amount_authorized) if pay and pay.amount_authorized is not None else None),
-            amount_captured=(float(pay.amount_captured) if pay and pay.amount_captured is not None else None),
-            duration_minutes=duration_minutes,
-            cost_estimated=cost_estimated,
-        ))
-    return payload
+            duration_minutes = base_minutes
+    else:
+        duration_minutes = None
+    # cost estimate logic
+    if s.amount_authorized is not None:
+        cost_estimated = s.amount_authorized
+    elif s.dynamic_price is not None and duration_minutes is not None:
+        hours = max(1, duration_minutes // 60 or 1)
+        cost_estimated = s.dynamic_price * hours
+    else:
+        cost_estimated = None
+    return SessionResponse(
+        session_id=s.session_id,
+        booking_id=s.booking_id,
+        started_at=s.started_at.isoformat() if s.started_at else None,
+        ended_at=s.ended_at.isoformat() if s.ended_at else None,
+        validation_method=s.validation_method,
+        bay_label=s.bay_label,
+        grace_ends_at=s.grace_ends_at.isoformat() if s.grace_ends_at else None,
+        customer_email=s.customer_email,
+        customer_phone=(s.customer_email[:10] if s.customer_email else None),
+        lot_name=s.lot_name,
+        lot_id=s.lot_id,
+        lot_lat=s.lot_lat,
+        lot_lng=s.lot_lng,
+        slot_id=s.slot_id,
+        dynamic_price=s.dynamic_price,
+        payment_status=s.payment_status,
+        amount_authorized=s.amount_authorized,
+        amount_captured=s.amount_captured,
+        duration_minutes=duration_minutes,
+        cost_estimated=cost_estimated,
+    )
+
+
+# Outbox events that change what a live-sessions view shows, and the delta they map to
+SESSION_DELTA_OPS = {
+    "session.started": "insert",
+    "session.validated": "update",
+    "session.extended": "update",
+    "session.ended": "end",
+    "payment.preauth_ok": "update",
+    "payment.captured": "update",
+    "payment.refunded": "update",
+}
+STREAM_HEARTBEAT_SEC = 15.0
+
+
+def _sse(event: str, data, event_id: Optional[str] = None) -> str:
+    head = f"id: {event_id}\n" if event_id else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@router.get("/live/stream",
+    summary="Stream live session changes (SSE)",
+    response_description="text/event-stream: a snapshot, then insert/update/end deltas",
+)
+async def live_stream(
+    request: Request,
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of sessions in the snapshot"),
+    location_id: Optional[str] = Query(None, description="Only sessions (and deltas) at this location"),
+):
+    """
+    Server-sent events replacing `GET /sessions/live` polling.
+
+    The stream opens with `event: snapshot` (the same list `/sessions/live` returns), then
+    sends one event per relevant outbox event as it is published:
+
+    - `insert`: session.started
+    - `update`: session.validated / session.extended, or a payment event for the session's booking
+    - `end`: session.ended
+
+    Delta `data` is the outbox payload plus `event_type`; `id` is the outbox event_id.
+    Payment deltas carry `booking_id` rather than `session_id`. If the client falls too far
+    behind, a fresh `snapshot` is sent. Comment lines keep idle connections open.
+
+    With `location_id`, the snapshot and the deltas are limited to sessions whose slot is at
+    that location (matched by the `slot_id` of session.started; later deltas follow the
+    session and its booking).
+
+    Deltas come from the in-process event bus, so viewers add no DB load after the snapshot.
+    """
+    if SessionLocal is None:
+        raise HTTPException(status_code=503, detail="Database not configured")
+    if location_id is not None:
+        try:
+            location_id = str(uuid.UUID(location_id))
+        except ValueError:
+            raise HTTPException(status_code=422, detail="location_id must be a UUID")
+    sessions_here: set = set()  # with location_id: sessions / bookings at the location
+    bookings_here: set = set()
+
+    def at_location(evt) -> bool:
+        p = evt.payload
+        if evt.event_type == "session.started":
+            info = slot_catalog.get(p["slot_id"]) if p.get("slot_id") else None
+            if info is None or info.location_id != location_id:
+                return False
+            sessions_here.add(p.get("session_id"))
+            bookings_here.add(p.get("booking_id"))
+            return True
+        if evt.event_type.startswith("payment."):
+            return p.get("booking_id") in bookings_here  # captures arrive after session.ended
+        if evt.event_type == "session.ended" and p.get("session_id") in sessions_here:
+            sessions_here.discard(p.get("session_id"))
+            return True
+        return p.get("session_id") in sessions_here
+
+    async def events():
+        q = event_bus.subscribe()
+        try:
+            resync = True
+            while True:
+                if resync:
+                    async with SessionLocal() as db:  # type: ignore
+                        rows = await _live_sessions(db, limit, 0, location_id)
+                        if location_id is not None:
+                            await slot_catalog.ensure_fresh(db)  # locates session.started slots
+                    sessions_here.clear()
+                    bookings_here.clear()
+                    sessions_here.update(r.session_id for r in rows)
+                    bookings_here.update(r.booking_id for r in rows if r.booking_id)
+                    yield _sse("snapshot", [r.model_dump() for r in rows])
+                    resync = False
+                try:
+                    evt = await asyncio.wait_for(q.get(), timeout=STREAM_HEARTBEAT_SEC)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keepalive\n\n"
+                    continue
+                if evt is None:
+                    resync = True
+                    continue
+                op = SESSION_DELTA_OPS.get(evt.event_type)
+                if op is not None and (location_id is None or at_location(evt)):
+                    yield _sse(op, {"event_type": evt.event_type, **evt.payload}, evt.event_id)
+        finally:
+            event_bus.unsubscribe(q)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.post("/start", response_model=SessionResponse,
@@ -172,7 +300,11 @@ async def live(
     response_description="Created session with validation details",
     status_code=201,
 )
-async def start(req: StartRequest, db: AsyncSession = Depends(get_db)):
+async def start(
+    req: StartRequest,
+    db: AsyncSession = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
+):
     """
     Initialize a parking session from a confirmed booking.
     
@@ -190,7 +322,21 @@ async def start(req: StartRequest, db: AsyncSession = Depends(get_db)):
     ## Grace Period
     
     Allows drivers to complete checkout without overstay penalties within the grace window.
+
+    ## Retries
+
+    Send an `Idempotency-Key` header to make retries safe: a repeated key returns the
+    original session instead of starting another one.
     """
+    request_hash = idempotency.fingerprint(req.model_dump())
+    replay = await idempotency.replay(db, "POST /sessions/start", idempotency_key, request_hash)
+    if replay is not None:
+        return replay
+    plate = normalize_plate(req.plate)
+    if plate is None and req.vehicle_id:
+        plate = await _vehicle_plate(db, req.vehicle_id)
+        if plate is None:
+            raise HTTPException(status_code=404, detail="vehicle not found")
     # Validate booking exists
     res = await db.execute(select(Booking).where(Booking.booking_id == req.booking_id))
     b = res.scalar_one_or_none()
@@ -209,6 +355,7 @@ async def start(req: StartRequest, db: AsyncSession = Depends(get_db)):
         validation_method=ValidationMethod(req.validation_method) if req.validation_method else None,
         bay_label=req.bay_label,
         grace_ends_at=grace_ends,
+        plate=plate,
     )
     db.add(sess)
     await db.execute(
@@ -216,8 +363,21 @@ async def start(req: StartRequest, db: AsyncSession = Depends(get_db)):
         .where(Booking.booking_id == b.booking_id)
         .values(status=BookingStatus.active)
     )
-    await db.commit()
-    return SessionResponse(
+    db.add(EventsOutbox(
+        event_id=str(uuid.uuid4()),
+        event_type="session.started",
+        payload={
+            "session_id": sess.session_id,
+            "booking_id": b.booking_id,
+            "slot_id": b.slot_id,
+            "validation_method": req.validation_method,
+            "bay_label": req.bay_label,
+            "plate": sess.plate,
+            "started_at": now.isoformat(),
+            "grace_ends_at": grace_ends.isoformat(),
+        },
+    ))
+    resp = SessionResponse(
         session_id=sess.session_id,
         booking_id=sess.booking_id,
         started_at=sess.started_at.isoformat() if sess.started_at else None,
@@ -226,6 +386,15 @@ async def start(req: StartRequest, db: AsyncSession = Depends(get_db)):
         bay_label=sess.bay_label,
         grace_ends_at=sess.grace_ends_at.isoformat() if sess.grace_ends_at else None,
     )
+    replay = await idempotency.commit(
+        db, "POST /sessions/start", idempotency_key, request_hash, 201, resp.model_dump(),
+    )
+    if replay is not None:
+        return replay
+    info = slot_catalog.get(b.slot_id) if b.slot_id else None
+    lot_occupancy.session_started(sess.session_id, info.location_id if info else None, b.slot_id)
+    plate_index.session_started(sess.session_id, plate)
+    return resp
 
 
 class ValidateRequest(BaseModel):
@@ -233,6 +402,66 @@ class ValidateRequest(BaseModel):
     bay_label: Optional[str] = None
 
 
+BATCH_VALIDATE_MAX_EVENTS = 1000
+
+
+class GateValidationEvent(BaseModel):
+    plate: Optional[str] = Field(default=None, max_length=32, description="ANPR plate read")
+    token: Optional[str] = Field(default=None, max_length=64, description="QR payload: session or booking id")
+    validation_method: Optional[str] = Field(default=None, pattern="^(qr|nfc|plate)$",
+                                             description="Defaults to qr for tokens, plate for plates")
+    bay_label: Optional[str] = None
+
+
+class BatchValidateRequest(BaseModel):
+    events: list[GateValidationEvent] = Field(..., min_length=1, max_length=BATCH_VALIDATE_MAX_EVENTS)
+
+
+class BatchValidateResult(BaseModel):
+    index: int
+    ok: bool
+    status_code: int
+    session_id: Optional[str] = None
+    booking_id: Optional[str] = None
+    error: Optional[str] = None
+
+
+class BatchValidateResponse(BaseModel):
+    validated: int
+    failed: int
+    results: list[BatchValidateResult]
+
+
+@router.post("/validate/batch", response_model=BatchValidateResponse,
+    summary="Validate a burst of gate reads",
+    response_description="Per-event outcome, in request order",
+)
+async def validate_batch(req: BatchValidateRequest, db: AsyncSession = Depends(get_db)):
+    """
+    Ingest up to 1000 ANPR / QR validation events in one call and one transaction.
+
+    Each event names its session by `plate` (matched against the plate recorded at session
+    start) or by `token` (the session or booking id from a QR code). Effects per matched
+    session are the same as `POST /sessions/{id}/validate`: validation method and bay are
+    updated, a payment pre-authorisation is created if missing, and `session.validated`
+    (plus `payment.preauth_ok`) are emitted. An event without `bay_label` keeps the
+    current bay.
+
+    Unmatched events do not fail the batch: they come back with `ok=false` and 404
+    (no active session) or 422 (neither plate nor a valid token).
+    """
+    outcomes = await validate_sessions(db, [
+        GateEvent(e.plate, e.token, e.validation_method, e.bay_label) for e in req.events
+    ])
+    results = [
+        BatchValidateResult(index=i, ok=o.ok, status_code=o.status_code,
+                            session_id=o.session_id, booking_id=o.booking_id, error=o.error)
+        for i, o in enumerate(outcomes)
+    ]
+    validated = sum(1 for r in results if r.ok)
+    return BatchValidateResponse(validated=validated, failed=len(results) - validated, results=results)
+
+
 @router.post("/{session_id}/validate", response_model=SessionResponse,
     summary="Validate parking session",
     response_description="Updated session with validation confirmation",
@@ -276,10 +505,7 @@ async def validate(
             b = b_res.scalar_one_or_none()
             amount = None
             if b and b.slot_id:
-                s_res = await db.execute(select(Slot).where(Slot.slot_id == b.slot_id))
-                s = s_res.scalar_one_or_none()
-                if s:
-                    amount = float(s.dynamic_price)
+                amount = await current_price(db, b.slot_id)
             payment = Payment(
                 payment_id=str(uuid.uuid4()),
                 booking_id=booking_id,
@@ -288,6 +514,7 @@ async def validate(
                 status=PaymentStatus.preauth_ok,
             )
             db.add(payment)
+            await record_new_payments(db, [payment.payment_id])
             # outbox payment.preauth_ok
             db.add(EventsOutbox(
                 event_id=str(uuid.uuid4()),
@@ -370,6 +597,16 @@ async def extend(
         .where(SessionModel.session_id == session_id)
         .values(grace_ends_at=new_grace)
     )
+    db.add(EventsOutbox(
+        event_id=str(uuid.uuid4()),
+        event_type="session.extended",
+        payload={
+            "session_id": session_id,
+            "booking_id": sess.booking_id,
+            "grace_ends_at": new_grace.isoformat(),
+            "at": dt.datetime.utcnow().isoformat(),
+        },
+    ))
     await db.commit()
     # reload
     res2 = await db.execute(select(SessionModel).where(SessionModel.session_id == session_id))
@@ -387,90 +624,98 @@ async def extend(
 
 @router.post("/{session_id}/end", response_model=SessionResponse,
     summary="End parking session",
-    response_description="Completed session with final payment capture",
+    response_description="Ended session; payment capture is queued",
 )
 async def end(
     session_id: str = Path(..., description="Session identifier"),
     db: AsyncSession = Depends(get_db)
 ):
     """
-    Finalize a parking session and capture payment.
-    
-    Actions performed:
+    Finalize a parking session; payment capture follows asynchronously.
+
+    Actions performed in the request:
     1. Sets session `ended_at` timestamp
-    2. Transitions booking to `completed` status
-    3. Captures final payment amount based on slot's dynamic price
-    4. Emits `payment.captured` event
-    
+    2. Emits `session.ended`
+    3. Queues the session for the end-of-session pipeline
+
+    The pipeline then, in batched transactions (usually within milliseconds):
+    4. Transitions booking to `completed` status
+    5. Captures final payment amount based on slot's dynamic price
+    6. Emits `payment.captured`
+
+    Ending an already ended session returns it unchanged. When the capture backlog is
+    full the call is refused with 503 and a `Retry-After` header, before anything changes.
+
     Called when driver exits the parking facility.
     """
-    res = await db.execute(select(SessionModel).where(SessionModel.session_id == session_id))
-    sess = res.scalar_one_or_none()
-    if sess is None:
-        raise HTTPException(status_code=404, detail="session not found")
+    if not end_pipeline.has_room():
+        raise HTTPException(
+            status_code=503,
+            detail="session end backlog is full, retry shortly",
+            headers={"Retry-After": str(end_pipeline.retry_after_sec())},
+        )
     now = dt.datetime.utcnow().replace(tzinfo=dt.timezone.utc)
-    await db.execute(
+    res = await db.execute(
         update(SessionModel)
-        .where(SessionModel.session_id == session_id)
+        .where(SessionModel.session_id == session_id, SessionModel.ended_at.is_(None))
         .values(ended_at=now)
+        .returning(SessionModel)
     )
-    # Try to complete booking as well
-    if sess.booking_id:
-        await db.execute(
-            update(Booking)
-            .where(Booking.booking_id == sess.booking_id)
-            .values(status=BookingStatus.completed)
-        )
-        # Simulate capture on end: capture current slot dynamic price
-        b_res = await db.execute(select(Booking).where(Booking.booking_id == sess.booking_id))
-        b = b_res.scalar_one_or_none()
-        final_amount = 0.0
-        if b and b.slot_id:
-            s_res = await db.execute(select(Slot).where(Slot.slot_id == b.slot_id))
-            s = s_res.scalar_one_or_none()
-            if s:
-                final_amount = float(s.dynamic_price)
-        # ensure a payment exists
-        p_res = await db.execute(select(Payment).where(Payment.booking_id == sess.booking_id))
-        payment = p_res.scalar_one_or_none()
-        if payment is None:
-            payment = Payment(
-                payment_id=str(uuid.uuid4()),
-                booking_id=sess.booking_id,
-                amount_authorized=final_amount,
-                amount_captured=final_amount,
-                status=PaymentStatus.captured,
-            )
-            db.add(payment)
-        else:
-            await db.execute(
-                update(Payment)
-                .where(Payment.payment_id == payment.payment_id)
-                .values(amount_captured=final_amount, status=PaymentStatus.captured)
-            )
-        # outbox payment.captured
-        db.add(EventsOutbox(
-            event_id=str(uuid.uuid4()),
-            event_type="payment.captured",
-            payload={
-                "booking_id": sess.booking_id,
-                "payment_id": payment.payment_id,
-                "amount_captured": final_amount,
-                "at": dt.datetime.utcnow().isoformat(),
-            },
-        ))
+    sess = res.scalar_one_or_none()
+    if sess is None:
+        await db.rollback()
+        res = await db.execute(select(SessionModel).where(SessionModel.session_id == session_id))
+        sess = res.scalar_one_or_none()
+        if sess is None:
+            raise HTTPException(status_code=404, detail="session not found")
+        return _session_row_view(sess)
+    db.add(EventsOutbox(
+        event_id=str(uuid.uuid4()),
+        event_type="session.ended",
+        payload={
+            "session_id": session_id,
+            "booking_id": sess.booking_id,
+            "ended_at": now.isoformat(),
+        },
+    ))
+    await record_ended_sessions(db, [session_id])
+    resp = _session_row_view(sess)
     await db.commit()
-    # reload
-    res2 = await db.execute(select(SessionModel).where(SessionModel.session_id == session_id))
-    sess2 = res2.scalar_one()
+    lot_occupancy.session_ended(session_id)
+    plate_index.session_ended(session_id)
+    if sess.booking_id:
+        booking_intervals.remove(sess.booking_id)  # completed bookings no longer hold the slot
+        # if the queue filled up meanwhile, the session is already ended and committed;
+        # the end pipeline's recovery sweep picks it up
+        end_pipeline.offer(EndedSession(session_id, sess.booking_id, now))
+    return resp
+
+
+async def _vehicle_plate(db: AsyncSession, vehicle_id: str) -> Optional[str]:
+    """Plate of a registered vehicle; None for unknown or malformed ids (and when the
+    vehicles table is missing). Runs before anything else in the transaction, so the
+    rollback on a DB error discards nothing."""
+    try:
+        uuid.UUID(vehicle_id)
+    except ValueError:
+        return None
+    try:
+        res = await db.execute(select(Vehicle.plate).where(Vehicle.vehicle_id == vehicle_id))
+    except SQLAlchemyError:
+        await db.rollback()
+        return None
+    return normalize_plate(res.scalar_one_or_none())
+
+
+def _session_row_view(sess: SessionModel) -> SessionResponse:
     return SessionResponse(
-        session_id=sess2.session_id,
-        booking_id=sess2.booking_id,
-        started_at=sess2.started_at.isoformat() if sess2.started_at else None,
-        ended_at=sess2.ended_at.isoformat() if sess2.ended_at else None,
-        validation_method=sess2.validation_method.value if sess2.validation_method else None,
-        bay_label=sess2.bay_label,
-        grace_ends_at=sess2.grace_ends_at.isoformat() if sess2.grace_ends_at else None,
+        session_id=sess.session_id,
+        booking_id=sess.booking_id,
+        started_at=sess.started_at.isoformat() if sess.started_at else None,
+        ended_at=sess.ended_at.isoformat() if sess.ended_at else None,
+        validation_method=sess.validation_method.value if sess.validation_method else None,
+        bay_label=sess.bay_label,
+        grace_ends_at=sess.grace_ends_at.isoformat() if sess.grace_ends_at else None,
     )
 
 
@@ -1,8 +1,16 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
 from typing import List, Optional
 import uuid
 
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.db import get_db
+from app.models import Vehicle as VehicleModel
+from app.services.plate_index import normalize_plate
+
 router = APIRouter(prefix="/vehicles", tags=["vehicles"])
 
 class Vehicle(BaseModel):
@@ -22,16 +30,30 @@ class VehicleCreateRequest(BaseModel):
     isEV: bool = False
     needsAccessibility: bool = False
 
+# Demo vehicles; listed while the vehicles table is empty or unavailable
 _vehicles: List[Vehicle] = [
     Vehicle(id=str(uuid.uuid4()), plate="MH12AB1234", make="Maruti", model="Baleno", type="car", isEV=False, needsAccessibility=False),
     Vehicle(id=str(uuid.uuid4()), plate="MH14EV4321", make="Tata", model="Nexon", type="ev_car", isEV=True, needsAccessibility=False),
 ]
 
+
+def _from_row(v: VehicleModel) -> Vehicle:
+    return Vehicle(
+        id=v.vehicle_id,
+        plate=v.plate,
+        make=v.make or "",
+        model=v.model or "",
+        type=v.type or "car",
+        isEV=bool(v.is_ev),
+        needsAccessibility=bool(v.needs_accessibility),
+    )
+
+
 @router.get("/", response_model=List[Vehicle],
     summary="List user vehicles",
     response_description="All vehicles registered to the user",
 )
-async def list_vehicles():
+async def list_vehicles(db: AsyncSession = Depends(get_db)):
     """
     Retrieve all vehicles registered to the authenticated user.
     
@@ -49,15 +71,23 @@ async def list_vehicles():
     
     ## MVP Note
     
-    Returns demo vehicles. Production would filter by authenticated user_id.
+    Returns every stored vehicle (demo vehicles while none are stored or the vehicles
+    table is unavailable).
+    Production would filter by authenticated user_id.
     """
-    return _vehicles
+    try:
+        res = await db.execute(select(VehicleModel).order_by(VehicleModel.created_at))
+        stored = [_from_row(v) for v in res.scalars().all()]
+        return stored or _vehicles
+    except SQLAlchemyError:
+        await db.rollback()
+        return _vehicles
 
 @router.post("/", response_model=Vehicle, status_code=201,
     summary="Add a new vehicle",
     response_description="Created vehicle record",
 )
-async def add_vehicle(req: VehicleCreateRequest):
+async def add_vehicle(req: VehicleCreateRequest, db: AsyncSession = Depends(get_db)):
     """
     Register a new vehicle to the user's profile.
     
@@ -82,17 +112,41 @@ async def add_vehicle(req: VehicleCreateRequest):
     
     ## Validation
     
-    Plate uniqueness not enforced in MVP but recommended for production.
+    Plates are stored normalised (upper-case letters and digits, e.g. `MH12AB1234`) and
+    must be unique: registering a plate twice returns 409. The stored plate is what
+    ANPR gate validation and the car locator match against.
     """
-    v = Vehicle(id=str(uuid.uuid4()), **req.dict())
-    _vehicles.append(v)
-    return v
+    plate = normalize_plate(req.plate)
+    if plate is None:
+        raise HTTPException(status_code=422, detail="plate must contain letters or digits")
+    row = VehicleModel(
+        vehicle_id=str(uuid.uuid4()),
+        user_id=None,
+        plate=plate,
+        make=req.make,
+        model=req.model,
+        type=req.type,
+        is_ev=req.isEV,
+        needs_accessibility=req.needsAccessibility,
+    )
+    try:
+        db.add(row)
+        await db.commit()
+        return _from_row(row)
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="plate already registered")
+    except SQLAlchemyError:
+        await db.rollback()
+        v = Vehicle(id=row.vehicle_id, **{**req.model_dump(), "plate": plate})
+        _vehicles.append(v)
+        return v
 
 @router.delete("/{vehicle_id}",
     summary="Delete a vehicle",
     response_description="Deletion confirmation",
 )
-async def delete_vehicle(vehicle_id: str):
+async def delete_vehicle(vehicle_id: str, db: AsyncSession = Depends(get_db)):
     """
     Remove a vehicle from the user's profile.
     
@@ -107,6 +161,19 @@ async def delete_vehicle(vehicle_id: str):
     Returns 404 if vehicle_id not found.
     """
     global _vehicles
+    try:
+        uuid.UUID(vehicle_id)
+        res = await db.execute(
+            delete(VehicleModel).where(VehicleModel.vehicle_id == vehicle_id).returning(VehicleModel.vehicle_id)
+        )
+        deleted = res.first() is not None
+        await db.commit()
+        if deleted:
+            return {"ok": True}
+    except ValueError:
+        pass
+    except SQLAlchemyError:
+        await db.rollback()
     found = next((x for x in _vehicles if x.id == vehicle_id), None)
     if not found:
         raise HTTPException(status_code=404, detail="vehicle not found")
@@ -0,0 +1,132 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, NamedTuple, Set
+
+from app.core.config import get_settings
+
+_settings = get_settings()
+
+
+class _Entry(NamedTuple):
+    value: Any
+    fresh_until: float  # time.monotonic() deadlines
+    stale_until: float
+
+
+class AnalyticsCache:
+    """Bounded LRU of analytics responses with per-call TTL and stale-while-revalidate.
+
+    A fresh entry is returned as is. Past its TTL, and for up to stale_sec more, the stale
+    value is still returned immediately while one background task recomputes it. Older
+    entries are misses. Concurrent misses for one key share a single computation
+    (single-flight), so a cold cache costs one query per key, not one per request.
+
+    compute() must not use the request's DB session: a background refresh outlives the
+    request. invalidate() drops everything (rollup backfills, demo seeding); computations
+    that started before it do not write their result back.
+    """
+
+    def __init__(self, max_entries: int = 256, stale_sec: float = 300.0):
+        self.max_entries = max_entries
+        self.stale_sec = stale_sec
+        self._data: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._refreshing: Set[asyncio.Task] = set()
+        self.generation = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    async def get_or_compute(self, key: Hashable, ttl_sec: float, compute: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._data.get(key)
+        now = time.monotonic()
+        if entry is not None and now < entry.fresh_until:
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry.value
+        if entry is not None and now < entry.stale_until:
+            self._data.move_to_end(key)
+            self.stale_hits += 1
+            if key not in self._inflight:
+                task = self._start(key, ttl_sec, compute)
+                self._refreshing.add(task)
+                task.add_done_callback(self._refresh_done)
+            return entry.value
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = self._start(key, ttl_sec, compute)
+            task.add_done_callback(self._miss_done)
+        else:
+            self.coalesced += 1
+        # shield: a cancelled request must not cancel the computation other callers await
+        return await asyncio.shield(task)
+
+    def _start(self, key: Hashable, ttl_sec: float, compute: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        task = asyncio.create_task(self._compute(key, ttl_sec, compute, self.generation))
+        self._inflight[key] = task
+        return task
+
+    async def _compute(self, key: Hashable, ttl_sec: float, compute: Callable[[], Awaitable[Any]], generation: int) -> Any:
+        try:
+            value = await compute()
+        finally:
+            if self._inflight.get(key) is asyncio.current_task():
+                del self._inflight[key]
+        if generation == self.generation:
+            now = time.monotonic()
+            self._data[key] = _Entry(value, now + ttl_sec, now + ttl_sec + self.stale_sec)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    @staticmethod
+    def _miss_done(task: asyncio.Task):
+        # retrieve the error even when every waiter was cancelled, so asyncio does not
+        # report "Task exception was never retrieved"; the waiters themselves still raise it
+        if not task.cancelled():
+            task.exception()
+
+    def _refresh_done(self, task: asyncio.Task):
+        self._refreshing.discard(task)
+        self.refreshes += 1
+        if not task.cancelled() and task.exception() is not None:
+            self.refresh_errors += 1  # keep serving the stale value until it expires
+            print("[analytics_cache] refresh failed", task.exception())
+
+    def invalidate(self):
+        self.generation += 1
+        self._data.clear()
+        self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "stale_sec": self.stale_sec,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else None,
+            "inflight": len(self._inflight),
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+analytics_cache = AnalyticsCache(
+    max_entries=_settings.analytics_cache_max_entries,
+    stale_sec=_settings.analytics_cache_stale_sec,
+)
@@ -0,0 +1,215 @@
+import bisect
+import datetime as dt
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import Select, String, func, literal, select
+from sqlalchemy.dialects.postgresql import array
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import get_settings
+from app.core.db import SessionLocal
+from app.models import Booking, BookingStatus
+
+_settings = get_settings()
+
+# Statuses that occupy a slot; completed/cancelled bookings never conflict.
+LIVE_STATUSES = (BookingStatus.held, BookingStatus.confirmed, BookingStatus.active)
+
+
+def booking_span(eta_dt: dt.datetime) -> Tuple[dt.datetime, dt.datetime]:
+    """Half-open [start, end) a booking occupies its slot: ETA plus BOOKING_DURATION_MIN."""
+    return eta_dt, eta_dt + dt.timedelta(minutes=_settings.booking_duration_min)
+
+
+def overlapping_select(slot_ids: Iterable[str], start: dt.datetime, end: dt.datetime) -> Select:
+    """(booking_id, slot_id, eta_minute) of live bookings on slot_ids whose span intersects
+    [start, end) (served by idx_bookings_slot_eta)."""
+    duration = dt.timedelta(minutes=_settings.booking_duration_min)
+    return select(Booking.booking_id, Booking.slot_id, Booking.eta_minute).where(
+        Booking.slot_id.in_(list(slot_ids)),
+        Booking.status.in_(LIVE_STATUSES),
+        Booking.eta_minute > start - duration,
+        Booking.eta_minute < end,
+    )
+
+
+async def lock_slot(db: AsyncSession, slot_id: str, wait: bool = True) -> bool:
+    """Transaction-scoped advisory lock serialising booking writes on one slot across workers.
+
+    With wait=False returns False instead of blocking when another transaction holds it;
+    callers that already hold a slot lock must not wait on a second one (deadlock).
+    """
+    key = func.hashtext("booking:" + slot_id)
+    if wait:
+        await db.execute(select(func.pg_advisory_xact_lock(key)))
+        return True
+    return bool((await db.execute(select(func.pg_try_advisory_xact_lock(key)))).scalar())
+
+
+async def lock_slots(db: AsyncSession, slot_ids: Iterable[str]):
+    """Blocking advisory locks on many slots in one statement, taken in sorted order so
+    concurrent batch writers cannot deadlock each other."""
+    ids = sorted(set(slot_ids))
+    if not ids:
+        return
+    sid = func.unnest(array(ids, type_=String)).column_valued("sid")
+    await db.execute(
+        select(func.pg_advisory_xact_lock(func.hashtext(literal("booking:") + sid))).order_by(sid)
+    )
+
+
+class BookingIntervalIndex:
+    """Process-local per-slot index of live booking spans.
+
+    Each slot keeps its spans sorted by start, plus the longest span length seen, so an
+    overlap probe bisects to the spans starting in (start - max_len, end) and checks only
+    those: O(log n + k) per slot.
+
+    The index is advisory. Postgres stays authoritative: writers take the slot's advisory
+    lock and re-check overlaps in SQL, and a hit reported here is confirmed against the DB
+    before a request is rejected (other workers may have cancelled or moved the booking).
+
+    With prune_ended (the long-lived process index) spans that ended before now are dropped
+    from a slot whenever it gets a new span, and from every slot on refresh, so the index
+    tracks live bookings instead of growing with every booking ever made. Batch-local
+    indexes leave it off: they must see past ETAs too.
+    """
+
+    def __init__(self, prune_ended: bool = False):
+        self._starts: Dict[str, List[int]] = {}
+        self._spans: Dict[str, List[Tuple[int, int, str]]] = {}  # aligned with _starts
+        self._max_len: Dict[str, int] = {}
+        self._where: Dict[str, str] = {}  # booking_id -> slot_id
+        self.prune_ended = prune_ended
+        self.pruned = 0
+        self.loaded_at: Optional[dt.datetime] = None
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def add(self, slot_id: str, booking_id: str, start: dt.datetime, end: dt.datetime):
+        self.remove(booking_id)
+        if self.prune_ended:
+            self._prune_slot(slot_id, int(time.time()))
+        s, e = int(start.timestamp()), int(end.timestamp())
+        starts = self._starts.setdefault(slot_id, [])
+        spans = self._spans.setdefault(slot_id, [])
+        i = bisect.bisect_right(starts, s)
+        starts.insert(i, s)
+        spans.insert(i, (s, e, booking_id))
+        self._max_len[slot_id] = max(self._max_len.get(slot_id, 0), e - s)
+        self._where[booking_id] = slot_id
+
+    def remove(self, booking_id: str):
+        slot_id = self._where.pop(booking_id, None)
+        if slot_id is None:
+            return
+        spans = self._spans[slot_id]
+        for i, span in enumerate(spans):
+            if span[2] == booking_id:
+                del spans[i]
+                del self._starts[slot_id][i]
+                break
+        if not spans:
+            del self._spans[slot_id], self._starts[slot_id], self._max_len[slot_id]
+
+    def _prune_slot(self, slot_id: str, now: int) -> int:
+        starts = self._starts.get(slot_id)
+        if not starts:
+            return 0
+        spans = self._spans[slot_id]
+        # only spans that started before now can have ended; after a prune these are the
+        # bookings currently in progress, so this stays a short scan
+        ended = [i for i in range(bisect.bisect_left(starts, now)) if spans[i][1] <= now]
+        for i in reversed(ended):
+            del self._where[spans[i][2]]
+            del spans[i], starts[i]
+        if not spans:
+            del self._spans[slot_id], self._starts[slot_id], self._max_len[slot_id]
+        self.pruned += len(ended)
+        return len(ended)
+
+    def prune(self, now: Optional[dt.datetime] = None) -> int:
+        """Drop spans that ended at or before now (default: the current time) on every
+        slot; returns how many were dropped."""
+        ts = int(now.timestamp()) if now is not None else int(time.time())
+        return sum(self._prune_slot(slot_id, ts) for slot_id in list(self._starts))
+
+    def overlapping(self, slot_id: str, start: dt.datetime, end: dt.datetime, exclude: Optional[str] = None) -> List[str]:
+        starts = self._starts.get(slot_id)
+        if not starts:
+            return []
+        s, e = int(start.timestamp()), int(end.timestamp())
+        lo = bisect.bisect_right(starts, s - self._max_len[slot_id])
+        hi = bisect.bisect_left(starts, e)
+        return [
+            bid for (bs, be, bid) in self._spans[slot_id][lo:hi]
+            if be > s and bid != exclude
+        ]
+
+    def replace(self, rows: Iterable[Tuple[str, str, dt.datetime]]):
+        """Rebuild from (booking_id, slot_id, eta_minute) rows of live bookings."""
+        fresh = BookingIntervalIndex()
+        for booking_id, slot_id, eta in rows:
+            fresh.add(slot_id, booking_id, *booking_span(eta))
+        if self.prune_ended:
+            self.pruned += fresh.prune()
+        self._starts, self._spans, self._max_len, self._where = fresh._starts, fresh._spans, fresh._max_len, fresh._where
+        self.loaded_at = dt.datetime.now(dt.timezone.utc)
+
+    async def refresh_from_db(self, db: AsyncSession):
+        horizon = dt.datetime.now(dt.timezone.utc) - dt.timedelta(minutes=_settings.booking_duration_min)
+        res = await db.execute(
+            select(Booking.booking_id, Booking.slot_id, Booking.eta_minute)
+            .where(Booking.status.in_(LIVE_STATUSES), Booking.slot_id.isnot(None), Booking.eta_minute >= horizon)
+        )
+        self.replace(res.all())
+
+    def status(self) -> dict:
+        return {
+            "bookings": len(self._where),
+            "slots": len(self._spans),
+            "pruned": self.pruned,
+            "loaded_at": self.loaded_at.isoformat() if self.loaded_at else None,
+        }
+
+
+booking_intervals = BookingIntervalIndex(prune_ended=True)
+
+
+async def slot_conflicts(
+    db: AsyncSession,
+    slot_id: str,
+    start: dt.datetime,
+    end: dt.datetime,
+    exclude: Optional[str] = None,
+) -> List[str]:
+    """Authoritative overlap check; call with the slot's advisory lock held.
+
+    Repairs the local index from the DB answer: stale entries (cancelled or moved by other
+    workers) are dropped and bookings it had not seen are added.
+    """
+    q = overlapping_select([slot_id], start, end)
+    if exclude is not None:
+        q = q.where(Booking.booking_id != exclude)
+    rows = (await db.execute(q)).all()
+    live = {bid for bid, _, _ in rows}
+    for bid in booking_intervals.overlapping(slot_id, start, end, exclude=exclude):
+        if bid not in live:
+            booking_intervals.remove(bid)
+    for bid, _, eta in rows:
+        booking_intervals.add(slot_id, bid, *booking_span(eta))
+    return sorted(live)
+
+
+async def warm_booking_intervals():
+    """Startup load of live bookings; the index still works (DB-checked) if this fails."""
+    if SessionLocal is None:
+        return
+    try:
+        async with SessionLocal() as db:  # type: ignore
+            await booking_intervals.refresh_from_db(db)
+    except SQLAlchemyError:
+        pass
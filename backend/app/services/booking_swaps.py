@@ -0,0 +1,196 @@
+import datetime as dt
+import uuid
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import String, and_, case, column, insert, literal, or_, select, update, values
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import aliased
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Booking, BookingCandidate, BookingStatus, EventsOutbox, Slot
+from app.services.booking_intervals import (
+    LIVE_STATUSES, BookingIntervalIndex, booking_intervals, booking_span, lock_slots,
+)
+
+
+def _is_uuid(value: str) -> bool:
+    try:
+        uuid.UUID(value)
+        return True
+    except (ValueError, AttributeError, TypeError):
+        return False
+
+
+class SwapOutcome(NamedTuple):
+    booking_id: str
+    ok: bool
+    status_code: int
+    error: Optional[str] = None
+    booking: Optional[Dict[str, Any]] = None  # BookingResponse fields when ok
+
+
+async def swap_bookings(db: AsyncSession, moves: Sequence[Tuple[str, str]]) -> List[SwapOutcome]:
+    """Move bookings to new slots in one transaction; outcomes are in request order.
+
+    Statements: one advisory-lock batch over the target slots, a slot existence check, one
+    read of the moving bookings plus live bookings on the targets, one ``UPDATE bookings ... FROM (VALUES ...)
+    ... RETURNING`` (wrapped in a CTE joined to booking_candidate, so backups come back in
+    the same round trip), one multi-row outbox insert and a single commit.
+
+    A move fails individually with 404 (booking or slot unknown), 409 (booking not live,
+    also when it stopped being live between the read and the UPDATE, or the new slot is
+    taken around its ETA, including by an earlier move in the same call). Later duplicates
+    of a booking id are rejected with 409. Held and confirmed bookings end up confirmed on
+    the new slot; active ones (session running) stay active.
+    """
+    moves = list(moves)
+    outcomes: Dict[int, SwapOutcome] = {}
+    first_seen: Dict[str, int] = {}
+    for i, (bid, _) in enumerate(moves):
+        if not _is_uuid(bid):
+            outcomes[i] = SwapOutcome(bid, False, 404, "booking not found")
+        elif bid in first_seen:
+            outcomes[i] = SwapOutcome(bid, False, 409, "booking listed more than once")
+        else:
+            first_seen[bid] = i
+    if not first_seen:
+        return [outcomes[i] for i in range(len(moves))]
+
+    moving = {bid: moves[i][1] for bid, i in first_seen.items()}
+    await lock_slots(db, moving.values())
+    res = await db.execute(select(Slot.slot_id).where(Slot.slot_id.in_(sorted(set(moving.values())))))
+    known_slots = set(res.scalars().all())
+
+    # moving bookings + every live booking on a target slot, one query
+    res = await db.execute(
+        select(Booking.booking_id, Booking.slot_id, Booking.eta_minute, Booking.status)
+        .where(or_(
+            Booking.booking_id.in_(list(moving)),
+            and_(Booking.slot_id.in_(sorted(set(moving.values()))), Booking.status.in_(LIVE_STATUSES)),
+        ))
+    )
+    current: Dict[str, tuple] = {}
+    occupied = BookingIntervalIndex()
+    for bid, sid, eta, status in res.all():
+        if bid in moving:
+            current[bid] = (sid, eta, status)
+        elif sid is not None:
+            occupied.add(sid, bid, *booking_span(eta))
+    # a moving booking keeps blocking its current slot for the whole batch: later moves
+    # cannot take a slot an earlier one is leaving
+    for bid, (sid, eta, status) in current.items():
+        if status in LIVE_STATUSES and sid is not None:
+            occupied.add(sid, bid, *booking_span(eta))
+
+    accepted: List[Tuple[str, str]] = []
+    for i in sorted(first_seen.values()):
+        bid, new_slot_id = moves[i]
+        if new_slot_id not in known_slots:
+            outcomes[i] = SwapOutcome(bid, False, 404, "slot not found")
+            continue
+        if bid not in current:
+            outcomes[i] = SwapOutcome(bid, False, 404, "booking not found")
+            continue
+        sid, eta, status = current[bid]
+        if status not in LIVE_STATUSES:
+            outcomes[i] = SwapOutcome(bid, False, 409, f"booking is {status.value}")
+            continue
+        span = booking_span(eta)
+        if new_slot_id != sid and occupied.overlapping(new_slot_id, *span, exclude=bid):
+            outcomes[i] = SwapOutcome(bid, False, 409, "slot already booked around this ETA")
+            continue
+        occupied.add(new_slot_id, bid, *span)
+        accepted.append((bid, new_slot_id))
+
+    swapped: Dict[str, Dict[str, Any]] = {}
+    if accepted:
+        v = values(column("booking_id", UUID(as_uuid=False)), column("new_slot_id", String), name="moves").data(accepted)
+        old = aliased(Booking, name="old")
+        status_type = Booking.__table__.c.status.type
+        upd = (
+            update(Booking)
+            .where(
+                Booking.booking_id == v.c.booking_id,
+                old.booking_id == Booking.booking_id,
+                Booking.status.in_(LIVE_STATUSES),  # still live: not completed/cancelled since the read
+            )
+            .values(
+                slot_id=v.c.new_slot_id,
+                # a held booking is confirmed on its new slot; an active one stays active
+                status=case(
+                    (Booking.status == BookingStatus.active, literal(BookingStatus.active, status_type)),
+                    else_=literal(BookingStatus.confirmed, status_type),
+                ),
+            )
+            .returning(
+                Booking.booking_id,
+                Booking.slot_id,
+                old.slot_id.label("old_slot_id"),
+                Booking.eta_minute,
+                Booking.mode,
+                Booking.status,
+                Booking.p_free_at_hold,
+            )
+            .cte("swapped")
+        )
+        rows = await db.execute(
+            select(upd, BookingCandidate.slot_id.label("cand_slot_id"), BookingCandidate.confidence_at_add)
+            .outerjoin(
+                BookingCandidate,
+                (BookingCandidate.booking_id == upd.c.booking_id) & (BookingCandidate.role == "backup"),
+            )
+            .order_by(upd.c.booking_id, BookingCandidate.slot_id)
+        )
+        for r in rows.all():
+            item = swapped.get(r.booking_id)
+            if item is None:
+                item = swapped[r.booking_id] = {
+                    "booking_id": r.booking_id,
+                    "slot_id": r.slot_id or "",
+                    "old_slot_id": r.old_slot_id or "",
+                    "eta_minute": r.eta_minute.isoformat(),
+                    "mode": r.mode.value,
+                    "status": r.status.value,
+                    "p_free_at_hold": float(r.p_free_at_hold) if r.p_free_at_hold is not None else None,
+                    "backups": [],
+                }
+            if r.cand_slot_id is not None:
+                item["backups"].append({
+                    "slot_id": r.cand_slot_id,
+                    "role": "backup",
+                    "confidence": float(r.confidence_at_add) if r.confidence_at_add is not None else None,
+                })
+
+    now = dt.datetime.utcnow()
+    outbox_rows = []
+    for bid, new_slot_id in accepted:
+        i = first_seen[bid]
+        item = swapped.get(bid)
+        if item is None:  # completed, cancelled or deleted between the read and the update
+            outcomes[i] = SwapOutcome(bid, False, 409, "booking is no longer live")
+            continue
+        old_slot_id = item.pop("old_slot_id")
+        outbox_rows.append({
+            "event_id": str(uuid.uuid4()),
+            "event_type": "booking.swapped",
+            "payload": {
+                "booking_id": bid,
+                "old_slot_id": old_slot_id,
+                "new_slot_id": item["slot_id"],
+                "status": item["status"],
+                "mode": item["mode"],
+                "eta_minute": item["eta_minute"],
+                "p_free_at_hold": item["p_free_at_hold"],
+                "backups": item["backups"],
+                "swapped_at": now.isoformat(),
+            },
+            "status": "pending",
+            "created_at": now,
+        })
+        outcomes[i] = SwapOutcome(bid, True, 200, booking=item)
+    if outbox_rows:
+        await db.execute(insert(EventsOutbox).values(outbox_rows))
+    await db.commit()
+    for bid, item in swapped.items():
+        booking_intervals.add(item["slot_id"], bid, *booking_span(current[bid][1]))
+    return [outcomes[i] for i in range(len(moves))]
@@ -0,0 +1,217 @@
+import asyncio
+import datetime as dt
+import time
+import uuid
+from typing import List, NamedTuple, Optional, Sequence, Set
+
+from sqlalchemy import insert, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import get_settings
+from app.models import Booking, BookingStatus, EventsOutbox, Payment, PaymentStatus
+from app.services.booking_intervals import LIVE_STATUSES
+from app.services.payment_fsm import transition_payments
+from app.services.payment_rollups import record_new_payments
+from app.services.slot_catalog import current_price
+
+_settings = get_settings()
+
+
+class EndedSession(NamedTuple):
+    session_id: str
+    booking_id: str
+    ended_at: dt.datetime
+    attempts: int = 0  # failed capture attempts so far
+
+
+class EndPipeline:
+    """Bounded queue between sessions.end and the batched capture worker.
+
+    sessions.end closes the session in its own short transaction and offers the booking
+    here; the end pipeline agent completes bookings and captures payments for up to
+    END_PIPELINE_BATCH_SIZE sessions per transaction. When the queue is full, sessions.end
+    answers 503 with Retry-After instead of growing the backlog (has_room() is checked
+    before the session is closed). Per-batch metrics are exposed via status().
+
+    A booking is queued at most once at a time, so the periodic recovery sweep can re-offer
+    everything it finds without duplicating sessions still waiting here. Sessions whose
+    capture fails are offered again after an exponential backoff, up to max_retries times;
+    after that they are left to the recovery sweep.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 5000,
+        batch_size: int = 200,
+        max_wait_ms: int = 50,
+        max_retries: int = 5,
+        retry_base_sec: float = 1.0,
+    ):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_retries = max_retries
+        self.retry_base_sec = retry_base_sec
+        self._queue: "asyncio.Queue[EndedSession]" = asyncio.Queue(maxsize=max_size)
+        self._queued: Set[str] = set()  # booking_ids currently in the queue
+        self.enqueued = 0
+        self.rejected = 0
+        self.retried = 0
+        self.abandoned = 0
+        self.batches = 0
+        self.completed = 0
+        self.failed = 0
+        self.last_batch_size = 0
+        self.last_batch_ms = 0.0
+        self.max_batch_ms = 0.0
+        self.last_batch_at: Optional[dt.datetime] = None
+
+    def has_room(self) -> bool:
+        return not self._queue.full()
+
+    def retry_after_sec(self) -> int:
+        """Rough time to drain the current backlog, at least a second."""
+        per_batch = max(self.last_batch_ms / 1000.0, self.max_wait)
+        return max(1, int(self._queue.qsize() / max(self.batch_size, 1) * per_batch) + 1)
+
+    def offer(self, item: EndedSession) -> bool:
+        if item.booking_id in self._queued:
+            return True
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        self._queued.add(item.booking_id)
+        self.enqueued += 1
+        return True
+
+    def retry_later(self, item: EndedSession) -> Optional[float]:
+        """Offer a session whose capture failed again after a backoff (base * 2^attempts).
+        Returns the delay, or None once max_retries is spent."""
+        if item.attempts >= self.max_retries:
+            self.abandoned += 1
+            return None
+        delay = self.retry_base_sec * (2 ** item.attempts)
+        asyncio.get_running_loop().call_later(delay, self.offer, item._replace(attempts=item.attempts + 1))
+        self.retried += 1
+        return delay
+
+    def _take(self, item: EndedSession) -> EndedSession:
+        self._queued.discard(item.booking_id)
+        return item
+
+    async def next_batch(self) -> List[EndedSession]:
+        """Wait for one session, then gather more for up to max_wait or batch_size."""
+        batch = [self._take(await self._queue.get())]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._take(self._queue.get_nowait()))
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._take(await asyncio.wait_for(self._queue.get(), timeout=remaining)))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def record_batch(self, size: int, elapsed_ms: float, failed: int = 0):
+        self.batches += 1
+        self.completed += size - failed
+        self.failed += failed
+        self.last_batch_size = size
+        self.last_batch_ms = elapsed_ms
+        self.max_batch_ms = max(self.max_batch_ms, elapsed_ms)
+        self.last_batch_at = dt.datetime.now(dt.timezone.utc)
+
+    def status(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "max_size": self.max_size,
+            "enqueued": self.enqueued,
+            "rejected": self.rejected,
+            "retried": self.retried,
+            "abandoned": self.abandoned,
+            "batches": self.batches,
+            "completed": self.completed,
+            "failed": self.failed,
+            "last_batch_size": self.last_batch_size,
+            "last_batch_ms": round(self.last_batch_ms, 2),
+            "max_batch_ms": round(self.max_batch_ms, 2),
+            "last_batch_at": self.last_batch_at.isoformat() if self.last_batch_at else None,
+        }
+
+
+end_pipeline = EndPipeline(
+    max_size=_settings.end_pipeline_queue_size,
+    batch_size=_settings.end_pipeline_batch_size,
+    max_wait_ms=_settings.end_pipeline_max_wait_ms,
+    max_retries=_settings.end_pipeline_max_retries,
+    retry_base_sec=_settings.end_pipeline_retry_base_sec,
+)
+
+
+async def complete_sessions(db: AsyncSession, items: Sequence[EndedSession]) -> int:
+    """Complete the bookings of ended sessions and capture their payments, in one transaction.
+
+    Statements: ``UPDATE bookings ... RETURNING`` (only bookings still live, so a session
+    queued twice is captured once), ``UPDATE payments ... FROM (VALUES ...) RETURNING`` for
+    payments still awaiting capture (payment_fsm), and for bookings without any payment one
+    multi-row payment insert plus its payment.captured events, then a commit. The amount is
+    the slot's current price.
+    """
+    booking_ids = sorted({i.booking_id for i in items if i.booking_id})
+    if not booking_ids:
+        return 0
+    res = await db.execute(
+        update(Booking)
+        .where(Booking.booking_id.in_(booking_ids), Booking.status.in_(LIVE_STATUSES))
+        .values(status=BookingStatus.completed)
+        .returning(Booking.booking_id, Booking.slot_id)
+    )
+    completed = res.all()
+    if not completed:
+        await db.commit()
+        return 0
+    amounts = {}
+    for bid, slot_id in completed:
+        amounts[bid] = (await current_price(db, slot_id) if slot_id else None) or 0.0
+
+    outcomes = await transition_payments(db, "capture", list(amounts.items()), by="booking_id", commit=False)
+    # bookings without any payment get a captured one; payments already past capture are left alone
+    new_payments: List[dict] = []
+    for o in outcomes:
+        if o.status_code == 404:
+            new_payments.append({
+                "payment_id": str(uuid.uuid4()),
+                "booking_id": o.ref,
+                "amount_authorized": amounts[o.ref],
+                "amount_captured": amounts[o.ref],
+                "status": PaymentStatus.captured,
+            })
+    if new_payments:
+        now = dt.datetime.utcnow()
+        await db.execute(insert(Payment).values(new_payments))
+        await record_new_payments(db, [p["payment_id"] for p in new_payments])
+        await db.execute(insert(EventsOutbox).values([
+            {
+                "event_id": str(uuid.uuid4()),
+                "event_type": "payment.captured",
+                "payload": {
+                    "booking_id": p["booking_id"],
+                    "payment_id": p["payment_id"],
+                    "amount_captured": p["amount_captured"],
+                    "at": now.isoformat(),
+                },
+                "status": "pending",
+                "created_at": now,
+            }
+            for p in new_payments
+        ]))
+    await db.commit()
+    return len(amounts)
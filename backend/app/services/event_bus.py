@@ -0,0 +1,76 @@
+import asyncio
+import datetime as dt
+from typing import Any, Dict, NamedTuple, Optional, Set
+
+# Per-subscriber backlog; a subscriber that falls this far behind is told to resync.
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+
+class BusEvent(NamedTuple):
+    event_id: str
+    event_type: str
+    payload: Dict[str, Any]
+    created_at: Optional[dt.datetime]
+
+
+class EventBus:
+    """In-process fan-out of published outbox events to live subscribers (SSE streams).
+
+    With DATABASE_URL_DIRECT every worker LISTENs for the outbox publisher's NOTIFY and
+    calls publish() once per event, so each process sees the events published by any
+    worker, in outbox order and at-most-once, and the number of viewers never adds DB work.
+    Without a listener (`listening` False, e.g. behind PgBouncer) the publisher hands its
+    own events over directly. A subscriber
+    whose queue overflows, or that may have missed events while the listener reconnected,
+    gets its backlog replaced by a single None, meaning "you missed events, reload a
+    snapshot".
+    """
+
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers: Set[asyncio.Queue] = set()
+        self.listening = False
+        self.published = 0
+        self.overflows = 0
+        self.resyncs = 0
+
+    def subscribe(self) -> asyncio.Queue:
+        q: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q: asyncio.Queue):
+        self._subscribers.discard(q)
+
+    def publish(self, event: BusEvent):
+        self.published += 1
+        for q in self._subscribers:
+            try:
+                q.put_nowait(event)
+            except asyncio.QueueFull:
+                self._reset(q)
+                self.overflows += 1
+
+    def resync(self):
+        """Tell every subscriber to reload a snapshot (events may have been missed)."""
+        self.resyncs += 1
+        for q in self._subscribers:
+            self._reset(q)
+
+    @staticmethod
+    def _reset(q: asyncio.Queue):
+        while not q.empty():
+            q.get_nowait()
+        q.put_nowait(None)
+
+    def status(self) -> dict:
+        return {
+            "subscribers": len(self._subscribers),
+            "listening": self.listening,
+            "published": self.published,
+            "overflows": self.overflows,
+            "resyncs": self.resyncs,
+        }
+
+
+event_bus = EventBus()
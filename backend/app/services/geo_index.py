@@ -0,0 +1,106 @@
+import asyncio
+import math
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Location
+
+EARTH_RADIUS_M = 6_371_000.0
+METERS_PER_DEG_LAT = 111_320.0
+DEFAULT_CELL_DEG = 0.01  # ~1.1 km cells
+REFRESH_SEC = 300  # reload from DB at most this often (picks up lots created by other workers)
+
+
+def haversine_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(1.0, a)))
+
+
+class GeoGrid:
+    """Uniform lat/lng grid over lot entrances (Location.entrance_lat/entrance_lng).
+
+    A radius query only visits the cells overlapping the query's bounding box, so its cost
+    is proportional to the number of nearby lots rather than the whole catalogue.
+    """
+
+    def __init__(self, cell_deg: float = DEFAULT_CELL_DEG):
+        self.cell_deg = cell_deg
+        self._cells: Dict[Tuple[int, int], Dict[str, Tuple[float, float]]] = {}
+        self._points: Dict[str, Tuple[float, float]] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def point(self, location_id: str) -> Optional[Tuple[float, float]]:
+        return self._points.get(location_id)
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return (math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg))
+
+    def add(self, location_id: str, lat: float, lng: float):
+        self.remove(location_id)
+        self._points[location_id] = (lat, lng)
+        self._cells.setdefault(self._cell(lat, lng), {})[location_id] = (lat, lng)
+
+    def remove(self, location_id: str):
+        old = self._points.pop(location_id, None)
+        if old is None:
+            return
+        cell = self._cell(*old)
+        bucket = self._cells.get(cell)
+        if bucket is not None:
+            bucket.pop(location_id, None)
+            if not bucket:
+                del self._cells[cell]
+
+    def replace(self, points: Iterable[Tuple[str, float, float]]):
+        cells: Dict[Tuple[int, int], Dict[str, Tuple[float, float]]] = {}
+        pts: Dict[str, Tuple[float, float]] = {}
+        for location_id, lat, lng in points:
+            pts[location_id] = (lat, lng)
+            cells.setdefault(self._cell(lat, lng), {})[location_id] = (lat, lng)
+        self._cells, self._points = cells, pts
+        self._loaded_at = time.monotonic()
+
+    def nearby(self, lat: float, lng: float, radius_m: float) -> List[Tuple[str, float]]:
+        """Lots within radius_m of (lat, lng) as [(location_id, distance_m)], nearest first."""
+        dlat = radius_m / METERS_PER_DEG_LAT
+        cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+        dlng = min(180.0, radius_m / (METERS_PER_DEG_LAT * cos_lat))
+        lat0, lng0 = self._cell(lat - dlat, lng - dlng)
+        lat1, lng1 = self._cell(lat + dlat, lng + dlng)
+        out: List[Tuple[str, float]] = []
+        for ci in range(lat0, lat1 + 1):
+            for cj in range(lng0, lng1 + 1):
+                bucket = self._cells.get((ci, cj))
+                if not bucket:
+                    continue
+                for location_id, (plat, plng) in bucket.items():
+                    d = haversine_m(lat, lng, plat, plng)
+                    if d <= radius_m:
+                        out.append((location_id, d))
+        out.sort(key=lambda x: x[1])
+        return out
+
+    async def ensure_fresh(self, db: AsyncSession):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < REFRESH_SEC:
+            return
+        async with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < REFRESH_SEC:
+                return
+            res = await db.execute(
+                select(Location.location_id, Location.entrance_lat, Location.entrance_lng)
+                .where(Location.entrance_lat.isnot(None), Location.entrance_lng.isnot(None))
+            )
+            self.replace((lid, float(la), float(ln)) for lid, la, ln in res.all())
+
+
+geo_index = GeoGrid()
@@ -0,0 +1,98 @@
+import asyncio
+import datetime as dt
+import heapq
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import get_settings
+
+_settings = get_settings()
+
+
+def hold_deadline(eta_dt: dt.datetime) -> dt.datetime:
+    """When a smart hold lapses: ETA plus HOLD_GRACE_MIN."""
+    return eta_dt + dt.timedelta(minutes=_settings.hold_grace_min)
+
+
+class HoldExpiryQueue:
+    """Process-local min-heap of (hold_expires_at, booking_id) for the hold expiry agent.
+
+    Rescheduling a booking pushes a new entry and records the live deadline in _due; the
+    older heap entry is skipped when popped (lazy deletion), so schedule/cancel are
+    O(log n) and the agent never scans booking_candidate. schedule() wakes the agent when
+    the new deadline is earlier than the one it is sleeping towards.
+
+    The DB stays authoritative: the agent expires only bookings still held, and reloads
+    upcoming deadlines at startup and every HOLD_EXPIRY_RESYNC_SEC.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, str]] = []
+        self._due: Dict[str, float] = {}
+        self._wake = asyncio.Event()
+        self.loaded_at: Optional[dt.datetime] = None
+        self.expired = 0
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def schedule(self, booking_id: str, expires_at: dt.datetime):
+        ts = expires_at.timestamp()
+        if self._due.get(booking_id) == ts:
+            return
+        head = self.next_deadline()
+        self._due[booking_id] = ts
+        heapq.heappush(self._heap, (ts, booking_id))
+        if head is None or ts < head:
+            self._wake.set()
+
+    def cancel(self, booking_id: str):
+        self._due.pop(booking_id, None)
+
+    def _prune(self):
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def next_deadline(self) -> Optional[float]:
+        self._prune()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: dt.datetime, limit: int) -> List[str]:
+        """Booking ids whose deadline is at or before now, earliest first, at most limit."""
+        ts = now.timestamp()
+        out: List[str] = []
+        while len(out) < limit:
+            self._prune()
+            if not self._heap or self._heap[0][0] > ts:
+                break
+            _, booking_id = heapq.heappop(self._heap)
+            del self._due[booking_id]
+            out.append(booking_id)
+        return out
+
+    def replace(self, rows):
+        """Rebuild from (booking_id, hold_expires_at) rows."""
+        self._due = {bid: at.timestamp() for bid, at in rows}
+        self._heap = [(ts, bid) for bid, ts in self._due.items()]
+        heapq.heapify(self._heap)
+        self.loaded_at = dt.datetime.now(dt.timezone.utc)
+        self._wake.set()
+
+    async def wait(self, timeout: float):
+        """Sleep until timeout or an earlier deadline is scheduled."""
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout=max(timeout, 0.0))
+        except asyncio.TimeoutError:
+            pass
+        self._wake.clear()
+
+    def status(self) -> dict:
+        head = self.next_deadline()
+        return {
+            "pending": len(self._due),
+            "next_expiry": dt.datetime.fromtimestamp(head, dt.timezone.utc).isoformat() if head else None,
+            "expired": self.expired,
+            "loaded_at": self.loaded_at.isoformat() if self.loaded_at else None,
+        }
+
+
+hold_expiry = HoldExpiryQueue()
@@ -0,0 +1,138 @@
+import datetime as dt
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import Date, Select, String, cast, delete, func, literal, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Booking, HourlyRollup, Payment, PaymentStatus, Slot
+from app.services.occupancy_history import NO_LOCATION, Granularity, occupancy_select, occupied_seconds
+from app.services.rollup_tables import rollup_tables
+
+_KEY = [HourlyRollup.hour, HourlyRollup.location_id]
+
+
+class RevenueDelta(NamedTuple):
+    hour: dt.datetime  # UTC, truncated to the hour
+    location_id: str
+    captured_payments: int
+    revenue: float
+
+
+def hour_of(ts: dt.datetime) -> dt.datetime:
+    ts = ts if ts.tzinfo else ts.replace(tzinfo=dt.timezone.utc)
+    return ts.astimezone(dt.timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def _add_on_conflict(stmt, columns: Sequence[str]):
+    return stmt.on_conflict_do_update(
+        index_elements=_KEY,
+        set_={c: getattr(HourlyRollup, c) + getattr(stmt.excluded, c) for c in columns},
+    )
+
+
+async def record_ended_sessions(db: AsyncSession, session_ids: Sequence[str]):
+    """Add sessions that ended in the caller's transaction (ended_at already written) to
+    their hours: one INSERT ... SELECT that buckets them in SQL and upserts the totals.
+    Skipped on a database without hourly_rollups (see rollup_tables)."""
+    if not session_ids or not await rollup_tables.present(db, HourlyRollup.__tablename__):
+        return
+    await _upsert_occupancy(db, occupancy_select("hour", True, ended=True, session_ids=session_ids))
+
+
+async def _upsert_occupancy(db: AsyncSession, occ):
+    occ = occ.subquery("occ")
+    src = select(occ.c.bucket, occ.c.location_id, occ.c.occupied_seconds, occ.c.sessions).order_by(
+        occ.c.bucket, occ.c.location_id,  # same key order in every writer: no upsert deadlocks
+    )
+    stmt = pg_insert(HourlyRollup).from_select(["hour", "location_id", "occupied_seconds", "sessions"], src)
+    await db.execute(_add_on_conflict(stmt, ["occupied_seconds", "sessions"]))
+
+
+async def apply_revenue_deltas(db: AsyncSession, deltas: Iterable[RevenueDelta]):
+    """Fold captured-revenue deltas into hourly_rollups with one multi-row upsert."""
+    merged: Dict[Tuple[dt.datetime, str], List[float]] = {}
+    for d in deltas:
+        acc = merged.setdefault((d.hour, d.location_id), [0, 0.0])
+        acc[0] += d.captured_payments
+        acc[1] += d.revenue
+    rows = [
+        {"hour": hour, "location_id": loc, "captured_payments": n, "revenue": amount}
+        for (hour, loc), (n, amount) in sorted(merged.items())
+        if n or amount
+    ]
+    if rows and await rollup_tables.present(db, HourlyRollup.__tablename__):
+        await db.execute(_add_on_conflict(pg_insert(HourlyRollup).values(rows), ["captured_payments", "revenue"]))
+
+
+async def backfill_hourly_rollups(db: AsyncSession, since: Optional[dt.datetime] = None) -> int:
+    """Recompute every hour from `since` (default: all history) from sessions and payments;
+    the caller commits. Returns the number of hour/location rows written."""
+    start = hour_of(since) if since is not None else None
+    q = delete(HourlyRollup)
+    if start is not None:
+        q = q.where(HourlyRollup.hour >= start)
+    await db.execute(q)
+
+    await _upsert_occupancy(db, occupancy_select("hour", True, start=start, ended=True))
+
+    hour = func.date_trunc("hour", Payment.created_at, "UTC")
+    loc = func.coalesce(cast(Slot.location_id, String), literal(NO_LOCATION))
+    rev = (
+        select(hour, loc, func.count(), func.coalesce(func.sum(Payment.amount_captured), 0))
+        .select_from(Payment)
+        .outerjoin(Booking, Booking.booking_id == Payment.booking_id)
+        .outerjoin(Slot, Slot.slot_id == Booking.slot_id)
+        .where(Payment.status == PaymentStatus.captured)
+        .group_by(hour, loc)
+        .order_by(hour, loc)
+    )
+    if start is not None:
+        rev = rev.where(Payment.created_at >= start)
+    stmt = pg_insert(HourlyRollup).from_select(["hour", "location_id", "captured_payments", "revenue"], rev)
+    await db.execute(_add_on_conflict(stmt, ["captured_payments", "revenue"]))
+
+    q = select(func.count()).select_from(HourlyRollup)
+    if start is not None:
+        q = q.where(HourlyRollup.hour >= start)
+    return int((await db.execute(q)).scalar_one())
+
+
+async def rollup_occupied_seconds(
+    db: AsyncSession,
+    start: dt.datetime,
+    end: dt.datetime,
+    granularity: Granularity = "day",
+    by_location: bool = False,
+) -> Dict[Tuple[str, dt.datetime], float]:
+    """occupied_seconds() served from the rollups: ended sessions come from hourly_rollups
+    (rows in range, re-bucketed to the granularity), open sessions are bucketed live."""
+    bucket = func.date_trunc(granularity, HourlyRollup.hour, "UTC")
+    q = (
+        select(
+            HourlyRollup.location_id if by_location else literal(NO_LOCATION),
+            bucket,
+            func.sum(HourlyRollup.occupied_seconds),
+        )
+        .where(HourlyRollup.hour >= start, HourlyRollup.hour < end)
+        .group_by(bucket)
+    )
+    if by_location:
+        q = q.group_by(HourlyRollup.location_id)
+    res = await db.execute(q)
+    out = {(lid, b): float(secs or 0.0) for lid, b, secs in res.all()}
+    for key, secs in (await occupied_seconds(db, start, end, granularity, by_location, ended=False)).items():
+        out[key] = out.get(key, 0.0) + secs
+    return out
+
+
+def revenue_daily_select(days: int) -> Select:
+    """(UTC date, captured revenue) for the latest `days` days that had captured payments."""
+    day = cast(func.timezone("UTC", HourlyRollup.hour), Date)
+    return (
+        select(day, func.coalesce(func.sum(HourlyRollup.revenue), 0))
+        .group_by(day)
+        .having(func.sum(HourlyRollup.captured_payments) > 0)
+        .order_by(day.desc())
+        .limit(days)
+    )
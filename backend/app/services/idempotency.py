@@ -0,0 +1,163 @@
+import datetime as dt
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import get_settings
+from app.models import IdempotencyKey
+
+_settings = get_settings()
+
+REPLAY_HEADER = "Idempotent-Replayed"
+
+
+class _Stored(NamedTuple):
+    request_hash: str
+    status_code: int
+    response: Any
+    expires_at: float  # time.monotonic() deadline for the LRU copy
+
+
+class IdempotencyStore:
+    """Idempotency-Key support for retried POSTs (bookings, session start, payment preauth).
+
+    The idempotency_keys row is written in the same transaction as the business write, so
+    a key is only recorded once its effects are committed. Concurrent retries carrying the
+    same key serialise on the (scope, key) primary key: the loser's upsert matches nothing,
+    it rolls back its own work and replays the winner's stored response.
+
+    A bounded LRU keeps recently completed keys in memory so hot retries skip the DB; it is
+    per-process, the table is authoritative. Reusing a key with a different body is a 422.
+    """
+
+    def __init__(self, max_entries: int = 4096, ttl_hours: int = 24):
+        self.max_entries = max_entries
+        self.ttl = dt.timedelta(hours=ttl_hours)
+        self._data: "OrderedDict[Tuple[str, str], _Stored]" = OrderedDict()
+        self.replays = 0
+        self.conflicts = 0
+
+    @staticmethod
+    def fingerprint(payload: Any) -> str:
+        raw = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def remember(self, scope: str, key: str, request_hash: str, status_code: int, response: Any):
+        self._data[(scope, key)] = _Stored(request_hash, status_code, response, time.monotonic() + self.ttl.total_seconds())
+        self._data.move_to_end((scope, key))
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def _cached(self, scope: str, key: str) -> Optional[_Stored]:
+        entry = self._data.get((scope, key))
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic():
+            del self._data[(scope, key)]
+            return None
+        self._data.move_to_end((scope, key))
+        return entry
+
+    async def replay(self, db: AsyncSession, scope: str, key: Optional[str], request_hash: str) -> Optional[JSONResponse]:
+        """Stored response for a key already used in this scope, or None for a fresh key."""
+        if not key:
+            return None
+        entry = self._cached(scope, key)
+        if entry is None:
+            try:
+                res = await db.execute(
+                    select(IdempotencyKey.request_hash, IdempotencyKey.status_code, IdempotencyKey.response)
+                    .where(
+                        IdempotencyKey.scope == scope,
+                        IdempotencyKey.key == key,
+                        IdempotencyKey.created_at >= dt.datetime.now(dt.timezone.utc) - self.ttl,
+                    )
+                )
+                row = res.first()
+            except SQLAlchemyError:
+                await db.rollback()
+                row = None
+            if row is None:
+                return None
+            self.remember(scope, key, row[0], row[1], row[2])
+            entry = self._cached(scope, key)
+        if entry.request_hash != request_hash:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+        self.replays += 1
+        return JSONResponse(status_code=entry.status_code, content=entry.response, headers={REPLAY_HEADER: "true"})
+
+    async def commit(
+        self,
+        db: AsyncSession,
+        scope: str,
+        key: Optional[str],
+        request_hash: str,
+        status_code: int,
+        response: Any,
+    ) -> Optional[JSONResponse]:
+        """Record the key inside db's open transaction and commit.
+
+        Returns None when this request's transaction committed. If another request already
+        claimed the key, rolls this transaction back and returns that request's response;
+        if that response cannot be read back either, raises 409 (the work was not done).
+        """
+        if key:
+            now = dt.datetime.now(dt.timezone.utc)
+            stmt = pg_insert(IdempotencyKey).values(
+                scope=scope,
+                key=key,
+                request_hash=request_hash,
+                status_code=status_code,
+                response=response,
+                created_at=now,
+            )
+            # an expired row for the same key is reclaimed; a live one leaves nothing to return
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[IdempotencyKey.scope, IdempotencyKey.key],
+                set_={
+                    "request_hash": stmt.excluded.request_hash,
+                    "status_code": stmt.excluded.status_code,
+                    "response": stmt.excluded.response,
+                    "created_at": stmt.excluded.created_at,
+                },
+                where=IdempotencyKey.created_at < now - self.ttl,
+            ).returning(IdempotencyKey.key)
+            claimed = (await db.execute(stmt)).first() is not None
+            if not claimed:
+                await db.rollback()
+                self.conflicts += 1
+                replay = await self.replay(db, scope, key, request_hash)
+                if replay is None:
+                    raise HTTPException(
+                        status_code=409,
+                        detail="a concurrent request with this Idempotency-Key won; retry to get its response",
+                    )
+                return replay
+        await db.commit()
+        if key:
+            self.remember(scope, key, request_hash, status_code, response)
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "ttl_hours": self.ttl.total_seconds() / 3600,
+            "replays": self.replays,
+            "conflicts": self.conflicts,
+        }
+
+
+idempotency = IdempotencyStore(
+    max_entries=_settings.idempotency_cache_max_entries,
+    ttl_hours=_settings.idempotency_ttl_hours,
+)
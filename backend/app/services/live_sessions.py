@@ -0,0 +1,239 @@
+import datetime as dt
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+from sqlalchemy import Select, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import AppUser, Booking, Location, Payment, Session as SessionModel, Slot
+from app.services.event_bus import BusEvent
+from app.services.slot_catalog import slot_catalog
+
+
+class LiveSession(NamedTuple):
+    session_id: str
+    booking_id: Optional[str]
+    started_at: Optional[dt.datetime]
+    ended_at: Optional[dt.datetime]
+    validation_method: Optional[str]
+    bay_label: Optional[str]
+    grace_ends_at: Optional[dt.datetime]
+    customer_email: Optional[str]
+    lot_id: Optional[str]
+    lot_name: Optional[str]
+    lot_lat: Optional[float]
+    lot_lng: Optional[float]
+    slot_id: Optional[str]
+    dynamic_price: Optional[float]
+    payment_status: Optional[str]
+    amount_authorized: Optional[float]
+    amount_captured: Optional[float]
+
+    @classmethod
+    def from_row(cls, r) -> "LiveSession":
+        def num(v):
+            return float(v) if v is not None else None
+        return cls(
+            r.session_id, r.booking_id, r.started_at, r.ended_at,
+            r.validation_method.value if r.validation_method else None,
+            r.bay_label, r.grace_ends_at, r.email, r.location_id, r.name,
+            num(r.entrance_lat), num(r.entrance_lng), r.slot_id, num(r.dynamic_price),
+            r.pay_status.value if r.pay_status else None,
+            num(r.amount_authorized), num(r.amount_captured),
+        )
+
+
+def live_session_select(location_id: Optional[str] = None) -> Select:
+    """Session ⋈ booking ⋈ user ⋈ slot ⋈ location ⋈ payment, one row per session/payment,
+    optionally only sessions at one location."""
+    q = (
+        select(
+            SessionModel.session_id,
+            SessionModel.booking_id,
+            SessionModel.started_at,
+            SessionModel.ended_at,
+            SessionModel.validation_method,
+            SessionModel.bay_label,
+            SessionModel.grace_ends_at,
+            AppUser.email,
+            Location.location_id,
+            Location.name,
+            Location.entrance_lat,
+            Location.entrance_lng,
+            Slot.slot_id,
+            Slot.dynamic_price,
+            Payment.status.label("pay_status"),
+            Payment.amount_authorized,
+            Payment.amount_captured,
+        )
+        .join(Booking, Booking.booking_id == SessionModel.booking_id, isouter=True)
+        .join(AppUser, Booking.user_id == AppUser.user_id, isouter=True)
+        .join(Slot, Booking.slot_id == Slot.slot_id, isouter=True)
+        .join(Location, Slot.location_id == Location.location_id, isouter=True)
+        .join(Payment, Payment.booking_id == Booking.booking_id, isouter=True)
+    )
+    if location_id is not None:
+        q = q.where(Slot.location_id == location_id)
+    return q
+
+
+# payment event -> (payment_status, payload amount field, LiveSession field)
+_PAYMENT_EVENTS = {
+    "payment.preauth_ok": ("preauth_ok", "amount_authorized", "amount_authorized"),
+    "payment.captured": ("captured", "amount_captured", "amount_captured"),
+    "payment.refunded": ("refunded", None, None),
+}
+
+
+class LiveSessionProjection:
+    """In-process view of active sessions (ended_at IS NULL), keyed by session_id.
+
+    Seeded from live_session_select() at startup, then kept current from published outbox
+    events as deltas: session.* update the session fields, payment.* update the payment
+    fields via the booking, booking.swapped re-reads the one affected row. Reads never
+    touch the DB; dynamic_price is taken from the slot catalogue at read time.
+
+    With the outbox LISTEN fan-out (DATABASE_URL_DIRECT) the event bus carries every
+    worker's events; without it only this worker's. The full join runs again only when
+    the bus asks subscribers to resync (overflow, listener reconnect) and as a safety net
+    every LIVE_SESSIONS_CHECK_SEC (minutes), when check() replaces a drifted projection.
+    """
+
+    def __init__(self):
+        self._by_session: Dict[str, LiveSession] = {}
+        self._by_booking: Dict[str, str] = {}
+        self.loaded_at: Optional[dt.datetime] = None
+        self.applied = 0
+        self.rebuilds = 0
+        self.drift_repairs = 0
+
+    @property
+    def ready(self) -> bool:
+        return self.loaded_at is not None
+
+    def __len__(self) -> int:
+        return len(self._by_session)
+
+    def _put(self, row: LiveSession):
+        if row.ended_at is not None:
+            self._drop(row.session_id)
+            return
+        self._by_session[row.session_id] = row
+        if row.booking_id:
+            self._by_booking[row.booking_id] = row.session_id
+
+    def _drop(self, session_id: str):
+        row = self._by_session.pop(session_id, None)
+        if row is not None and row.booking_id and self._by_booking.get(row.booking_id) == session_id:
+            del self._by_booking[row.booking_id]
+
+    def _replace(self, rows: Iterable[LiveSession]):
+        self._by_session, self._by_booking = {}, {}
+        for row in rows:
+            self._put(row)
+        self.loaded_at = dt.datetime.now(dt.timezone.utc)
+
+    @staticmethod
+    async def load(db: AsyncSession, where=None) -> List[LiveSession]:
+        q = live_session_select().where(SessionModel.ended_at.is_(None))
+        if where is not None:
+            q = q.where(where)
+        return [LiveSession.from_row(r) for r in (await db.execute(q)).all()]
+
+    async def rebuild(self, db: AsyncSession):
+        self._replace(await self.load(db))
+        self.rebuilds += 1
+
+    async def apply(self, db: AsyncSession, evt: BusEvent):
+        """Fold one published outbox event into the projection (no-op for unrelated events)."""
+        p = evt.payload
+        kind = evt.event_type
+        if kind == "session.started" or (kind == "booking.swapped" and p.get("booking_id") in self._by_booking):
+            where = (
+                SessionModel.session_id == p["session_id"] if kind == "session.started"
+                else SessionModel.booking_id == p["booking_id"]
+            )
+            for row in await self.load(db, where):
+                self._put(row)
+        elif kind == "session.ended":
+            self._drop(p.get("session_id"))
+        elif kind in ("session.validated", "session.extended"):
+            row = self._by_session.get(p.get("session_id"))
+            if row is None:
+                return
+            if kind == "session.validated":
+                row = row._replace(validation_method=p.get("method"), bay_label=p.get("bay_label"))
+            else:
+                row = row._replace(grace_ends_at=_ts(p.get("grace_ends_at")))
+            self._put(row)
+        elif kind in _PAYMENT_EVENTS:
+            sid = self._by_booking.get(p.get("booking_id"))
+            if sid is None:
+                return
+            status, src, dst = _PAYMENT_EVENTS[kind]
+            changes: Dict[str, Any] = {"payment_status": status}
+            if src and p.get(src) is not None:
+                changes[dst] = float(p[src])
+            self._put(self._by_session[sid]._replace(**changes))
+        else:
+            return
+        self.applied += 1
+
+    def get(self, session_id: str) -> Optional[LiveSession]:
+        return self._by_session.get(session_id)
+
+    def rows(self, limit: Optional[int] = None, location_id: Optional[str] = None) -> List[LiveSession]:
+        """Active sessions (optionally at one location), newest start first, with catalogue prices."""
+        floor = dt.datetime.min.replace(tzinfo=dt.timezone.utc)
+        rows = self._by_session.values()
+        if location_id is not None:
+            rows = [r for r in rows if r.lot_id == location_id]
+        rows = sorted(rows, key=lambda r: r.started_at or floor, reverse=True)
+        if limit is not None:
+            rows = rows[:limit]
+        out = []
+        for r in rows:
+            info = slot_catalog.get(r.slot_id) if r.slot_id else None
+            out.append(r._replace(dynamic_price=info.dynamic_price) if info is not None else r)
+        return out
+
+    async def check(self, db: AsyncSession, repair: bool = False) -> dict:
+        """Compare against a fresh DB rebuild; with repair=True adopt the rebuild on drift."""
+        fresh = {r.session_id: r for r in await self.load(db)}
+        ignore = LiveSession._fields.index("dynamic_price")  # prices come from the catalogue
+        def key(r: LiveSession):
+            return r[:ignore] + r[ignore + 1:]
+        missing = sorted(set(fresh) - set(self._by_session))
+        extra = sorted(set(self._by_session) - set(fresh))
+        changed = sorted(
+            sid for sid in set(fresh) & set(self._by_session)
+            if key(fresh[sid]) != key(self._by_session[sid])
+        )
+        consistent = not (missing or extra or changed)
+        if repair and not consistent:
+            self._replace(fresh.values())
+            self.drift_repairs += 1
+        return {
+            "consistent": consistent,
+            "sessions": len(fresh),
+            "missing": missing,
+            "extra": extra,
+            "changed": changed,
+            "repaired": repair and not consistent,
+        }
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "sessions": len(self._by_session),
+            "loaded_at": self.loaded_at.isoformat() if self.loaded_at else None,
+            "applied": self.applied,
+            "rebuilds": self.rebuilds,
+            "drift_repairs": self.drift_repairs,
+        }
+
+
+def _ts(value: Optional[str]) -> Optional[dt.datetime]:
+    return dt.datetime.fromisoformat(value.replace("Z", "+00:00")) if value else None
+
+
+live_sessions = LiveSessionProjection()
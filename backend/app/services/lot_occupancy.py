@@ -0,0 +1,87 @@
+from collections import Counter
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from sqlalchemy import Select, select
+
+from app.core.config import get_settings
+from app.models import Booking, Session as SessionModel, Slot
+from app.services.reconciled_index import ReconciledIndex
+
+_settings = get_settings()
+
+
+class LotOccupancy(ReconciledIndex):
+    """Active-session counters and occupied-slot sets per location.
+
+    sessions.start / sessions.end adjust them after their commit, so lot listings are
+    dict reads. Sessions started or ended by other workers are picked up when the
+    counters are rebuilt from the DB, at most every LOT_OCCUPANCY_RECONCILE_SEC (checked
+    lazily by ensure_fresh(), like the slot catalogue; see ReconciledIndex).
+
+    count() is the number of active sessions in a lot (what lot listings report);
+    occupied() is the set of distinct slots they sit on.
+    """
+
+    def __init__(self, reconcile_sec: float = 60.0):
+        super().__init__(reconcile_sec)
+        self._sessions: Dict[str, Tuple[str, str]] = {}  # session_id -> (location_id, slot_id)
+        self._by_location: Dict[str, Counter] = {}
+        self.drift = 0  # sessions added or dropped by reconciles
+
+    def session_started(self, session_id: str, location_id: Optional[str], slot_id: Optional[str]):
+        if location_id is None or slot_id is None:
+            return
+        self._journal("session_started", session_id, location_id, slot_id)
+        if session_id in self._sessions:
+            return
+        self._sessions[session_id] = (location_id, slot_id)
+        self._by_location.setdefault(location_id, Counter())[slot_id] += 1
+
+    def session_ended(self, session_id: str):
+        self._journal("session_ended", session_id)
+        entry = self._sessions.pop(session_id, None)
+        if entry is None:
+            return
+        location_id, slot_id = entry
+        slots = self._by_location[location_id]
+        slots[slot_id] -= 1
+        if slots[slot_id] <= 0:
+            del slots[slot_id]
+        if not slots:
+            del self._by_location[location_id]
+
+    def _snapshot_select(self) -> Select:
+        return (
+            select(SessionModel.session_id, Slot.location_id, Slot.slot_id)
+            .join(Booking, Booking.booking_id == SessionModel.booking_id)
+            .join(Slot, Slot.slot_id == Booking.slot_id)
+            .where(SessionModel.ended_at.is_(None))
+        )
+
+    def _load(self, rows: Iterable[Tuple[str, str, str]]):
+        for session_id, location_id, slot_id in rows:
+            self.session_started(session_id, location_id, slot_id)
+
+    def _adopt(self, fresh: "LotOccupancy"):
+        if self.ready:
+            self.drift += len(set(fresh._sessions) ^ set(self._sessions))
+        self._sessions, self._by_location = fresh._sessions, fresh._by_location
+
+    def count(self, location_id: str) -> int:
+        slots = self._by_location.get(location_id)
+        return sum(slots.values()) if slots else 0
+
+    def occupied(self, location_id: str) -> Set[str]:
+        return set(self._by_location.get(location_id, ()))
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "active_sessions": len(self._sessions),
+            "locations": len(self._by_location),
+            "reconciles": self.reconciles,
+            "drift": self.drift,
+        }
+
+
+lot_occupancy = LotOccupancy(reconcile_sec=_settings.lot_occupancy_reconcile_sec)
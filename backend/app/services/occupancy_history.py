@@ -0,0 +1,196 @@
+import datetime as dt
+from typing import Dict, Iterable, List, Literal, Optional, Sequence, Tuple
+
+from sqlalchemy import CompoundSelect, String, case, cast, extract, func, literal, select, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Booking, Session, Slot
+
+Granularity = Literal["day", "hour"]
+BUCKET = {"day": dt.timedelta(days=1), "hour": dt.timedelta(hours=1)}
+
+NO_LOCATION = ""  # sessions without a booking/slot, and slots without a location
+
+
+def bucket_starts(start: dt.datetime, end: dt.datetime, granularity: Granularity) -> List[dt.datetime]:
+    """Bucket boundaries covering [start, end); start must be aligned to the granularity."""
+    step = BUCKET[granularity]
+    out, t = [], start
+    while t < end:
+        out.append(t)
+        t += step
+    return out
+
+
+def occupancy_select(
+    granularity: Granularity = "day",
+    by_location: bool = False,
+    start: Optional[dt.datetime] = None,
+    end: Optional[dt.datetime] = None,
+    ended: Optional[bool] = None,
+    session_ids: Optional[Sequence[str]] = None,
+) -> CompoundSelect:
+    """(location_id, bucket, occupied_seconds, sessions) per UTC bucket.
+
+    The work stays in Postgres, in difference-array form: each session is clipped to
+    [start, end) and contributes at most four rows (its partial first and last buckets,
+    +1 on the first bucket it covers whole, -1 on the bucket after), so a long or stale
+    open session costs the same as a short one. A running sum of the +1/-1 marks per
+    location gives the sessions covering each bucket whole; the buckets between two marks
+    are filled in from that count. Cost is O(sessions + buckets) rather than O(sessions x
+    buckets spanned), and only the per-bucket totals cross the wire. `sessions` counts each
+    session once, in the bucket it started in. Open sessions count up to now; ended=True/
+    False keeps only ended/open ones. Without by_location every row has location_id ''.
+    bucket_spans() is the same computation in Python.
+    """
+    step = BUCKET[granularity]
+    step_sec = int(step.total_seconds())
+    now = dt.datetime.now(dt.timezone.utc)
+    s = Session.started_at if start is None else func.greatest(Session.started_at, start)
+    e = func.coalesce(Session.ended_at, now)
+    if end is not None:
+        e = func.least(e, end)
+    loc = func.coalesce(cast(Slot.location_id, String), literal(NO_LOCATION)) if by_location else literal(NO_LOCATION)
+    clipped = (
+        select(
+            loc.label("location_id"), s.label("s"), e.label("e"),
+            func.date_trunc(granularity, s, "UTC").label("first"),
+            func.date_trunc(granularity, e, "UTC").label("last"),
+            (func.date_trunc(granularity, Session.started_at, "UTC") == func.date_trunc(granularity, s, "UTC")).label("started_here"),
+        )
+        .select_from(Session)
+        .outerjoin(Booking, Booking.booking_id == Session.booking_id)
+        .outerjoin(Slot, Slot.slot_id == Booking.slot_id)
+        .where(Session.started_at.isnot(None), e > s)
+    )
+    if start is not None:
+        clipped = clipped.where(Session.ended_at.is_(None) | (Session.ended_at > start))
+    if end is not None:
+        clipped = clipped.where(Session.started_at < end)
+    if ended is not None:
+        clipped = clipped.where(Session.ended_at.isnot(None) if ended else Session.ended_at.is_(None))
+    if session_ids is not None:
+        clipped = clipped.where(Session.session_id.in_(list(session_ids)))
+    c = clipped.cte("clipped")
+
+    zero, one = literal(0), literal(1)
+    secs = lambda a, b: extract("epoch", a - b)  # noqa: E731
+    spans_whole = c.c.last > c.c.first + step
+    marks = union_all(
+        # first bucket: the session's part of it, and the session itself if it started there
+        select(c.c.location_id, c.c.first.label("bucket"), secs(func.least(c.c.e, c.c.first + step), c.c.s).label("secs"),
+               zero.label("delta"), case((c.c.started_here, one), else_=zero).label("started")),
+        # last bucket, when it is another one: the part before e
+        select(c.c.location_id, c.c.last, secs(c.c.e, c.c.last), zero, zero).where(c.c.last > c.c.first),
+        # whole buckets in between: +1 on the first of them, -1 on the last bucket
+        select(c.c.location_id, c.c.first + step, zero, one, zero).where(spans_whole),
+        select(c.c.location_id, c.c.last, zero, -one, zero).where(spans_whole),
+    ).cte("marks")
+    per_bucket = (
+        select(
+            marks.c.location_id, marks.c.bucket,
+            func.sum(marks.c.secs).label("secs"), func.sum(marks.c.started).label("started"),
+            func.sum(func.sum(marks.c.delta)).over(partition_by=marks.c.location_id, order_by=marks.c.bucket).label("whole"),
+            func.lead(marks.c.bucket).over(partition_by=marks.c.location_id, order_by=marks.c.bucket).label("next_bucket"),
+        )
+        .group_by(marks.c.location_id, marks.c.bucket)
+        .cte("per_bucket")
+    )
+    pb = per_bucket.c
+    gap = func.generate_series(pb.bucket + step, pb.next_bucket - step, step).table_valued("bucket").lateral("gap").render_derived()
+    occupied = (pb.secs + pb.whole * step_sec).label("occupied_seconds")
+    return union_all(
+        select(pb.location_id, pb.bucket.label("bucket"), occupied, pb.started.label("sessions"))
+        .where((occupied > 0) | (pb.started > 0)),
+        # buckets with no marks of their own, covered whole by the running count
+        select(pb.location_id, gap.c.bucket, pb.whole * step_sec, zero)
+        .select_from(per_bucket)
+        .join(gap, literal(True))
+        .where(pb.whole > 0),
+    )
+
+
+def bucket_spans(
+    spans: Iterable[Tuple[str, dt.datetime, dt.datetime, dt.datetime]],
+    granularity: Granularity = "day",
+) -> Dict[Tuple[str, dt.datetime], Tuple[float, int]]:
+    """occupancy_select's difference-array bucketing over in-memory spans.
+
+    spans are (location_id, started_at, s, e), already clipped to the range. Returns
+    {(location_id, bucket start): (occupied seconds, sessions started in the bucket)}.
+    """
+    step = BUCKET[granularity]
+    secs: Dict[Tuple[str, dt.datetime], float] = {}
+    started: Dict[Tuple[str, dt.datetime], int] = {}
+    delta: Dict[Tuple[str, dt.datetime], int] = {}
+    for loc, started_at, s, e in spans:
+        if e <= s:
+            continue
+        first, last = truncate(s, granularity), truncate(e, granularity)
+        secs[(loc, first)] = secs.get((loc, first), 0.0) + (min(e, first + step) - s).total_seconds()
+        started[(loc, first)] = started.get((loc, first), 0) + (truncate(started_at, granularity) == first)
+        if last > first:
+            secs[(loc, last)] = secs.get((loc, last), 0.0) + (e - last).total_seconds()
+        if last > first + step:
+            delta[(loc, first + step)] = delta.get((loc, first + step), 0) + 1
+            delta[(loc, last)] = delta.get((loc, last), 0) - 1
+    out: Dict[Tuple[str, dt.datetime], Tuple[float, int]] = {}
+    marks = sorted(set(secs) | set(delta))
+    whole = 0
+    for i, (loc, bucket) in enumerate(marks):
+        if i and marks[i - 1][0] != loc:
+            whole = 0
+        whole += delta.get((loc, bucket), 0)
+        occupied = secs.get((loc, bucket), 0.0) + whole * step.total_seconds()
+        if occupied > 0 or started.get((loc, bucket)):
+            out[(loc, bucket)] = (occupied, started.get((loc, bucket), 0))
+        if whole > 0:
+            t = bucket + step
+            while t < marks[i + 1][1]:  # the -1 mark of a whole run always follows
+                out[(loc, t)] = (whole * step.total_seconds(), 0)
+                t += step
+    return out
+
+
+def truncate(ts: dt.datetime, granularity: Granularity) -> dt.datetime:
+    """date_trunc(granularity, ts, 'UTC') for an aware datetime."""
+    ts = ts.astimezone(dt.timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0) if granularity == "day" else ts
+
+
+async def occupied_seconds(
+    db: AsyncSession,
+    start: dt.datetime,
+    end: dt.datetime,
+    granularity: Granularity = "day",
+    by_location: bool = False,
+    ended: Optional[bool] = None,
+) -> Dict[Tuple[str, dt.datetime], float]:
+    """Occupied seconds per (location_id, bucket start) over [start, end); see occupancy_select."""
+    res = await db.execute(occupancy_select(granularity, by_location, start, end, ended=ended))
+    return {(r.location_id, r.bucket): float(r.occupied_seconds or 0.0) for r in res.all()}
+
+
+async def capacity_by_location(db: AsyncSession, by_location: bool = False) -> Dict[str, int]:
+    """Summed slot capacity per location_id ('' for all slots when not by_location)."""
+    if not by_location:
+        res = await db.execute(select(func.coalesce(func.sum(Slot.capacity), 0)))
+        return {NO_LOCATION: int(res.scalar_one() or 0)}
+    loc = func.coalesce(cast(Slot.location_id, String), literal(NO_LOCATION))
+    res = await db.execute(select(loc, func.coalesce(func.sum(Slot.capacity), 0)).group_by(loc))
+    return {lid: int(cap or 0) for lid, cap in res.all()}
+
+
+def occupancy_pct(seconds: float, capacity: int, bucket: dt.timedelta) -> float:
+    denom = capacity * bucket.total_seconds()
+    return 0.0 if denom <= 0 else round(min(100.0, seconds / denom * 100.0), 2)
+
+
+def range_for(days: int, now: Optional[dt.datetime] = None) -> Tuple[dt.datetime, dt.datetime]:
+    """[start, end) covering the last `days` UTC days, today included."""
+    now = now or dt.datetime.now(dt.timezone.utc)
+    today = now.date()
+    start_date = today - dt.timedelta(days=max(days - 1, 0))
+    start = dt.datetime.combine(start_date, dt.time.min, tzinfo=dt.timezone.utc)
+    end = dt.datetime.combine(today + dt.timedelta(days=1), dt.time.min, tzinfo=dt.timezone.utc)
+    return start, end
@@ -0,0 +1,99 @@
+import math
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+from app.core.config import get_settings
+from app.services.geo_index import METERS_PER_DEG_LAT
+
+_settings = get_settings()
+
+CELL_DEG = 0.005  # ~550 m cache cells
+
+
+class OfferCache:
+    """Bounded LRU + TTL cache of offer candidate slots.
+
+    Keyed on (geo cell, extra params). Searches in the same cell share one candidate query,
+    done against the cell centre so the result does not depend on which request filled the
+    entry. Predictions are not cached here: each search scores the candidates at its own
+    ETA (prediction index, DB for misses).
+
+    Invalidated wholesale when prices or predictions change (pricing.adjusted, new predictor
+    batch). The generation counter stops a search that started before an invalidation from
+    writing its now-stale result back.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_sec: float = 60.0):
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.last_invalidated_by: Optional[str] = None
+
+    @staticmethod
+    def key(lat: float, lng: float, *extra: Hashable) -> tuple:
+        cell = (math.floor(lat / CELL_DEG), math.floor(lng / CELL_DEG))
+        return (cell, *extra)
+
+    @staticmethod
+    def cell_center(key: tuple) -> Tuple[float, float]:
+        ci, cj = key[0]
+        return ((ci + 0.5) * CELL_DEG, (cj + 0.5) * CELL_DEG)
+
+    @staticmethod
+    def cell_radius_m(key: tuple) -> float:
+        """Upper bound on the distance from the cell centre to any point in the cell."""
+        lat, _ = OfferCache.cell_center(key)
+        half = CELL_DEG / 2 * METERS_PER_DEG_LAT
+        return math.hypot(half, half * max(math.cos(math.radians(lat)), 0.0)) + 1.0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: Hashable, value: Any, generation: int):
+        if generation != self.generation:
+            return  # invalidated while this value was being computed
+        self._data[key] = (time.monotonic() + self.ttl_sec, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, reason: str):
+        self.generation += 1
+        self._data.clear()
+        self.invalidations += 1
+        self.last_invalidated_by = reason
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "ttl_sec": self.ttl_sec,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "last_invalidated_by": self.last_invalidated_by,
+        }
+
+
+offer_cache = OfferCache(
+    max_entries=_settings.offers_cache_max_entries,
+    ttl_sec=_settings.offers_cache_ttl_sec,
+)
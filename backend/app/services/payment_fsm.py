@@ -0,0 +1,167 @@
+import datetime as dt
+import uuid
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy import Numeric, cast, column, func, insert, select, update, values
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import EventsOutbox, Payment, PaymentStatus
+from app.services.payment_rollups import RollupDelta, apply_rollup_deltas, payment_delta, payment_location
+
+
+class Transition(NamedTuple):
+    target: PaymentStatus
+    sources: Tuple[PaymentStatus, ...]
+    event_type: str
+    error: str  # 409 detail when the payment is in any other state
+
+
+# The payment state machine. A transition only applies to rows currently in one of its
+# source states; the status check is part of the UPDATE, so it doubles as the optimistic
+# concurrency check (of two concurrent captures exactly one matches the row).
+TRANSITIONS: Dict[str, Transition] = {
+    "capture": Transition(
+        PaymentStatus.captured, (PaymentStatus.init, PaymentStatus.preauth_ok),
+        "payment.captured", "payment not capturable",
+    ),
+    "refund": Transition(
+        PaymentStatus.refunded, (PaymentStatus.captured,),
+        "payment.refunded", "payment not refundable",
+    ),
+    "cancel": Transition(
+        PaymentStatus.cancelled, (PaymentStatus.init, PaymentStatus.preauth_ok),
+        "payment.cancelled", "payment not cancellable",
+    ),
+}
+
+
+class PaymentOutcome(NamedTuple):
+    ref: str  # payment_id, or booking_id when transitioning by booking
+    ok: bool
+    status_code: int
+    error: Optional[str] = None
+    payment: Optional[Dict[str, Any]] = None  # PaymentResponse fields when ok
+
+
+def _is_uuid(value: str) -> bool:
+    try:
+        uuid.UUID(value)
+        return True
+    except (ValueError, AttributeError, TypeError):
+        return False
+
+
+def payment_view(p) -> Dict[str, Any]:
+    return {
+        "payment_id": p.payment_id,
+        "booking_id": p.booking_id,
+        "amount_authorized": float(p.amount_authorized or 0.0),
+        "amount_captured": float(p.amount_captured) if p.amount_captured is not None else None,
+        "status": p.status.value,
+        "created_at": p.created_at.isoformat(),
+    }
+
+
+def _event_payload(action: str, p, at: dt.datetime) -> Dict[str, Any]:
+    payload: Dict[str, Any] = {"payment_id": p.payment_id, "booking_id": p.booking_id}
+    if action == "capture":
+        payload["amount_captured"] = float(p.amount_captured or 0.0)
+    elif action == "refund":
+        payload["amount_refunded"] = float(p.amount_captured or 0.0)
+    payload["at"] = at.isoformat()
+    return payload
+
+
+async def transition_payments(
+    db: AsyncSession,
+    action: str,
+    items: Sequence[Tuple[str, Optional[float]]],
+    by: str = "payment_id",
+    commit: bool = True,
+) -> List[PaymentOutcome]:
+    """Apply one transition to many payments; outcomes are in request order.
+
+    items are (ref, amount) pairs, ref being a payment_id (or a booking_id with
+    by="booking_id"); amount overrides the captured amount (default: amount_authorized)
+    and is ignored by other actions.
+
+    Statements: one ``UPDATE payments ... FROM (VALUES ...) WHERE status IN (...)
+    RETURNING``, upserts moving the payments between payment_rollups buckets and hourly
+    revenue, one multi-row outbox insert and the commit (left to the caller with
+    commit=False). Refs the UPDATE did not match cost one extra lookup to tell 404 (no
+    such payment) from 409 (payment in another state, e.g. already captured by a
+    concurrent request). Repeated refs are rejected with 409.
+    """
+    t = TRANSITIONS[action]
+    key = Payment.payment_id if by == "payment_id" else Payment.booking_id
+    items = list(items)
+    outcomes: Dict[int, PaymentOutcome] = {}
+    first_seen: Dict[str, int] = {}
+    for i, (ref, _) in enumerate(items):
+        if not _is_uuid(ref):
+            outcomes[i] = PaymentOutcome(ref, False, 404, "payment not found")
+        elif ref in first_seen:
+            outcomes[i] = PaymentOutcome(ref, False, 409, "payment listed more than once")
+        else:
+            first_seen[ref] = i
+
+    moved: Dict[str, Any] = {}
+    if first_seen:
+        v = values(
+            column("ref", UUID(as_uuid=False)), column("amount", Numeric), name="transitions",
+        ).data([(ref, items[i][1]) for ref, i in first_seen.items()])
+        new_values: Dict[str, Any] = {"status": t.target}
+        if action == "capture":
+            # an all-NULL VALUES column comes back untyped, hence the cast
+            new_values["amount_captured"] = func.coalesce(cast(v.c.amount, Numeric), Payment.amount_authorized)
+        old = Payment.__table__.alias("old")  # pre-update row, for the rollup deltas
+        res = await db.execute(
+            update(Payment)
+            .where(key == v.c.ref, old.c.payment_id == Payment.payment_id, Payment.status.in_(t.sources))
+            .values(**new_values)
+            .returning(
+                key.label("ref"), Payment.payment_id, Payment.booking_id, Payment.amount_authorized,
+                Payment.amount_captured, Payment.status, Payment.created_at,
+                old.c.status.label("old_status"), old.c.amount_captured.label("old_amount_captured"),
+                func.date_trunc("hour", Payment.created_at, "UTC").label("hour"), payment_location(Payment.booking_id).label("location_id"),
+            )
+        )
+        deltas: List[RollupDelta] = []
+        for r in res.all():
+            if r.ref in moved:
+                continue
+            moved[r.ref] = r
+            deltas.append(payment_delta(r.hour, r.location_id, r.old_status, r.amount_authorized, r.old_amount_captured, sign=-1))
+            deltas.append(payment_delta(r.hour, r.location_id, r.status, r.amount_authorized, r.amount_captured))
+        await apply_rollup_deltas(db, deltas)
+
+    missed = [ref for ref in first_seen if ref not in moved]
+    known = set()
+    if missed:
+        res = await db.execute(select(key).where(key.in_(missed)))
+        known = set(res.scalars().all())
+
+    now = dt.datetime.utcnow()
+    outbox_rows = []
+    for ref, i in first_seen.items():
+        r = moved.get(ref)
+        if r is None:
+            if ref in known:
+                outcomes[i] = PaymentOutcome(ref, False, 409, t.error)
+            else:
+                outcomes[i] = PaymentOutcome(ref, False, 404, "payment not found")
+            continue
+        outbox_rows.append({
+            "event_id": str(uuid.uuid4()),
+            "event_type": t.event_type,
+            "payload": _event_payload(action, r, now),
+            "status": "pending",
+            "created_at": now,
+        })
+        outcomes[i] = PaymentOutcome(ref, True, 200, payment=payment_view(r))
+    if outbox_rows:
+        await db.execute(insert(EventsOutbox).values(outbox_rows))
+    if commit:
+        await db.commit()
+    return [outcomes[i] for i in range(len(items))]
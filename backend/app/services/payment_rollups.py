@@ -0,0 +1,146 @@
+import datetime as dt
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import Date, Select, String, cast, delete, func, insert, literal, literal_column, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Booking, Payment, PaymentRollup, PaymentStatus, Slot
+from app.services.hourly_rollups import RevenueDelta, apply_revenue_deltas
+from app.services.rollup_tables import rollup_tables
+
+NO_LOCATION = ""  # payments whose booking has no slot/location
+
+
+class RollupDelta(NamedTuple):
+    hour: dt.datetime  # payment created_at, truncated to the UTC hour
+    location_id: str
+    status: PaymentStatus
+    payments: int
+    amount_authorized: float
+    amount_captured: float
+
+
+def payment_delta(
+    hour: dt.datetime,
+    location_id: Optional[str],
+    status: PaymentStatus,
+    amount_authorized: Optional[float],
+    amount_captured: Optional[float],
+    sign: int = 1,
+) -> RollupDelta:
+    return RollupDelta(
+        hour, location_id or NO_LOCATION, status, sign,
+        sign * float(amount_authorized or 0.0), sign * float(amount_captured or 0.0),
+    )
+
+
+def payment_location(payment_booking_id) -> Select:
+    """Correlated (scalar) location of a payment's booking, for RETURNING clauses."""
+    return (
+        select(Slot.location_id)
+        .join(Booking, Booking.slot_id == Slot.slot_id)
+        .where(Booking.booking_id == payment_booking_id)
+        .scalar_subquery()
+    )
+
+
+async def apply_rollup_deltas(db: AsyncSession, deltas: Iterable[RollupDelta]):
+    """Fold deltas into payment_rollups with one multi-row upsert, inside the caller's
+    transaction, and the captured ones into the hourly revenue rollups. Keys are written in
+    sorted order so concurrent writers touching the same buckets cannot deadlock. Skipped
+    on a database without payment_rollups (see rollup_tables)."""
+    deltas = list(deltas)
+    await apply_revenue_deltas(db, [
+        RevenueDelta(d.hour, d.location_id, d.payments, d.amount_captured)
+        for d in deltas if d.status == PaymentStatus.captured
+    ])
+    merged: Dict[Tuple[dt.date, str, PaymentStatus], List[float]] = {}
+    for d in deltas:
+        acc = merged.setdefault((d.hour.date(), d.location_id, d.status), [0, 0.0, 0.0])
+        acc[0] += d.payments
+        acc[1] += d.amount_authorized
+        acc[2] += d.amount_captured
+    rows = [
+        {"day": day, "location_id": loc, "status": status, "payments": n, "amount_authorized": a, "amount_captured": c}
+        for (day, loc, status), (n, a, c) in sorted(merged.items(), key=lambda kv: (kv[0][0], kv[0][1], kv[0][2].value))
+        if n or a or c
+    ]
+    if not rows or not await rollup_tables.present(db, PaymentRollup.__tablename__):
+        return
+    stmt = pg_insert(PaymentRollup).values(rows)
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[PaymentRollup.day, PaymentRollup.location_id, PaymentRollup.status],
+        set_={
+            "payments": PaymentRollup.payments + stmt.excluded.payments,
+            "amount_authorized": PaymentRollup.amount_authorized + stmt.excluded.amount_authorized,
+            "amount_captured": PaymentRollup.amount_captured + stmt.excluded.amount_captured,
+        },
+    ))
+
+
+async def record_new_payments(db: AsyncSession, payment_ids: Iterable[str]):
+    """Count payments inserted in the caller's transaction, in their current state.
+
+    Flushes first (autoflush is off) and reads the rows back, so each payment lands in the
+    hour of its stored created_at: the bucket transition_payments later moves it out of.
+    """
+    payment_ids = list(payment_ids)
+    if not payment_ids:
+        return
+    await db.flush()
+    res = await db.execute(
+        select(
+            func.date_trunc("hour", Payment.created_at, "UTC"), payment_location(Payment.booking_id),
+            Payment.status, Payment.amount_authorized, Payment.amount_captured,
+        )
+        .where(Payment.payment_id.in_(payment_ids))
+    )
+    await apply_rollup_deltas(db, [payment_delta(*row) for row in res.all()])
+
+
+async def rebuild_payment_rollups(db: AsyncSession) -> int:
+    """Recompute every bucket from payments (backfill, or repair after manual edits); the
+    caller commits. Returns the number of buckets written."""
+    day = cast(func.timezone("UTC", Payment.created_at), Date)  # UTC day, as in the incremental path
+    loc = func.coalesce(cast(Slot.location_id, String), literal(NO_LOCATION))
+    src = (
+        select(
+            day, loc, Payment.status, func.count(),
+            func.coalesce(func.sum(Payment.amount_authorized), 0),
+            func.coalesce(func.sum(Payment.amount_captured), 0),
+        )
+        .select_from(Payment)
+        .outerjoin(Booking, Booking.booking_id == Payment.booking_id)
+        .outerjoin(Slot, Slot.slot_id == Booking.slot_id)
+        .group_by(day, loc, Payment.status)
+    )
+    await db.execute(delete(PaymentRollup))
+    res = await db.execute(
+        insert(PaymentRollup)
+        .from_select(
+            ["day", "location_id", "status", "payments", "amount_authorized", "amount_captured"], src,
+        )
+        .returning(PaymentRollup.day)
+    )
+    return len(res.all())
+
+
+def _summary_columns(status, payments, authorized, captured):
+    return (
+        func.coalesce(func.sum(captured), 0).label("total_revenue"),
+        func.coalesce(func.sum(payments).filter(status == PaymentStatus.captured), 0).label("paid_count"),
+        func.coalesce(func.sum(authorized).filter(status == PaymentStatus.preauth_ok), 0).label("pending_amount"),
+        func.coalesce(func.sum(payments).filter(status == PaymentStatus.cancelled), 0).label("failed_count"),
+    )
+
+
+def summary_select() -> Select:
+    """Payments summary from the rollups: cost scales with days x locations, not payments."""
+    r = PaymentRollup
+    return select(*_summary_columns(r.status, r.payments, r.amount_authorized, r.amount_captured))
+
+
+def live_summary_select() -> Select:
+    """The same summary as one FILTER aggregate over payments (a single scan)."""
+    return select(*_summary_columns(Payment.status, literal_column("1"), Payment.amount_authorized, Payment.amount_captured))
@@ -0,0 +1,83 @@
+import re
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import Select, select
+
+from app.core.config import get_settings
+from app.models import Session as SessionModel
+from app.services.reconciled_index import ReconciledIndex
+
+_settings = get_settings()
+
+_PLATE_NOISE = re.compile(r"[^0-9A-Z]")
+
+
+def normalize_plate(plate: Optional[str]) -> Optional[str]:
+    """Upper-case alphanumerics only ("mh 12-ab 1234" -> "MH12AB1234"); None if nothing left."""
+    if not plate:
+        return None
+    return _PLATE_NOISE.sub("", plate.upper()) or None
+
+
+class PlateIndex(ReconciledIndex):
+    """Hash index from normalised plate to its active session.
+
+    sessions.start / sessions.end maintain it after their commit, so gate validation and
+    the car locator resolve a plate with one dict lookup. Sessions started or ended by
+    other workers appear after the next rebuild from the partial plate index
+    (idx_sessions_plate_active), at most every PLATE_INDEX_RECONCILE_SEC (see
+    ReconciledIndex); callers fall back to the DB for plates it does not know. If a plate
+    has several active sessions the latest start wins.
+    """
+
+    def __init__(self, reconcile_sec: float = 60.0):
+        super().__init__(reconcile_sec)
+        self._by_plate: Dict[str, str] = {}
+        self._by_session: Dict[str, str] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._by_plate)
+
+    def session_started(self, session_id: str, plate: Optional[str]):
+        plate = normalize_plate(plate)
+        if plate is None:
+            return
+        self._journal("session_started", session_id, plate)
+        self._by_plate[plate] = session_id
+        self._by_session[session_id] = plate
+
+    def session_ended(self, session_id: str):
+        self._journal("session_ended", session_id)
+        plate = self._by_session.pop(session_id, None)
+        if plate is not None and self._by_plate.get(plate) == session_id:
+            del self._by_plate[plate]
+
+    def lookup(self, plate: Optional[str]) -> Optional[str]:
+        sid = self._by_plate.get(normalize_plate(plate) or "")
+        if sid is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return sid
+
+    def _snapshot_select(self) -> Select:
+        return (
+            select(SessionModel.session_id, SessionModel.plate)
+            .where(SessionModel.ended_at.is_(None), SessionModel.plate.isnot(None))
+            .order_by(SessionModel.started_at)
+        )
+
+    def _load(self, rows: Iterable[Tuple[str, str]]):
+        for session_id, plate in rows:  # oldest first: the latest start wins
+            self.session_started(session_id, plate)
+
+    def _adopt(self, fresh: "PlateIndex"):
+        self._by_plate, self._by_session = fresh._by_plate, fresh._by_session
+
+    def status(self) -> dict:
+        return {"plates": len(self._by_plate), "hits": self.hits, "misses": self.misses}
+
+
+plate_index = PlateIndex(reconcile_sec=_settings.plate_index_reconcile_sec)
@@ -0,0 +1,191 @@
+import asyncio
+import bisect
+import datetime as dt
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import get_settings
+from app.models import SlotPrediction
+from app.services.prediction_queries import PredictionRequest, nearest_predictions, nearest_predictions_batch
+
+# How far back from "now" a refresh loads predictions. Matches the widest search window
+# (window_minutes <= 240) so lookups for ETAs near now never fall off the loaded range.
+LOOKBACK_MIN = 240
+
+
+class _Snapshot:
+    __slots__ = ("etas", "p_free", "covered_from", "loaded_at", "loaded_mono", "rows")
+
+    def __init__(self, etas: Dict[str, array], p_free: Dict[str, array], covered_from: int, loaded_at: dt.datetime, rows: int):
+        self.etas = etas  # slot_id -> sorted epoch seconds
+        self.p_free = p_free  # slot_id -> p_free aligned with etas
+        self.covered_from = covered_from  # epoch seconds; nothing earlier was loaded
+        self.loaded_at = loaded_at
+        self.loaded_mono = time.monotonic()
+        self.rows = rows
+
+
+class PredictionIndex:
+    """Process-local sorted index over slot_predictions.
+
+    Each slot keeps contiguous arrays of ETAs (epoch seconds) and p_free values so the
+    nearest-ETA lookup is a bisect instead of a DB query. The index is rebuilt wholesale
+    and swapped in with a single reference assignment, so readers never see a half-built
+    snapshot: by the predictor after each run, and lazily by ensure_fresh() once it is
+    refresh_sec old (predictions written by other workers or seeding, slots whose forecast
+    moved on).
+
+    Lookups report misses (unknown slot, a window reaching before the loaded range, or a
+    snapshot past refresh_sec because the refresh failed) separately so callers can fall
+    back to the DB for just those slots.
+    """
+
+    def __init__(self, refresh_sec: float = 60.0):
+        self.refresh_sec = refresh_sec
+        self._snap: Optional[_Snapshot] = None
+        self._lock = asyncio.Lock()
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._snap is not None
+
+    def _expired(self, snap: Optional[_Snapshot]) -> bool:
+        return snap is None or time.monotonic() - snap.loaded_mono >= self.refresh_sec
+
+    def status(self) -> dict:
+        snap = self._snap
+        counters = {"refresh_sec": self.refresh_sec, "refreshes": self.refreshes, "refresh_errors": self.refresh_errors}
+        if snap is None:
+            return {"ready": False, "slots": 0, "rows": 0, "loaded_at": None, **counters}
+        return {
+            "ready": True,
+            "slots": len(snap.etas),
+            "rows": snap.rows,
+            "loaded_at": snap.loaded_at.isoformat(),
+            "expired": self._expired(snap),
+            **counters,
+        }
+
+    def replace(self, rows: Iterable[Tuple[str, dt.datetime, float]], covered_from: dt.datetime):
+        """Rebuild from (slot_id, eta_minute, p_free) rows sorted by slot_id, eta_minute."""
+        etas: Dict[str, array] = {}
+        probs: Dict[str, array] = {}
+        count = 0
+        for slot_id, eta, p in rows:
+            e = etas.get(slot_id)
+            if e is None:
+                e = etas[slot_id] = array("q")
+                probs[slot_id] = array("d")
+            e.append(int(eta.timestamp()))
+            probs[slot_id].append(float(p))
+            count += 1
+        self._snap = _Snapshot(etas, probs, int(covered_from.timestamp()), dt.datetime.now(dt.timezone.utc), count)
+
+    async def refresh_from_db(self, db: AsyncSession, now: Optional[dt.datetime] = None):
+        now = now or dt.datetime.now(dt.timezone.utc)
+        covered_from = now - dt.timedelta(minutes=LOOKBACK_MIN)
+        res = await db.execute(
+            select(SlotPrediction.slot_id, SlotPrediction.eta_minute, SlotPrediction.p_free)
+            .where(SlotPrediction.eta_minute >= covered_from)
+            .order_by(SlotPrediction.slot_id, SlotPrediction.eta_minute)
+        )
+        self.replace(res.all(), covered_from)
+        self.refreshes += 1
+
+    async def ensure_fresh(self, db: AsyncSession):
+        """Reload once the snapshot is refresh_sec old. Only an index that was loaded once
+        (ready) is kept fresh here; a failed reload leaves the expired snapshot in place,
+        which then answers every lookup as a miss."""
+        if self._snap is None or not self._expired(self._snap):
+            return
+        async with self._lock:
+            if not self._expired(self._snap):
+                return
+            try:
+                await self.refresh_from_db(db)
+            except SQLAlchemyError:
+                await db.rollback()
+                self.refresh_errors += 1
+
+    def nearest_many(
+        self,
+        slot_ids: Iterable[str],
+        eta_dt: dt.datetime,
+        window: dt.timedelta,
+    ) -> Tuple[Dict[str, Tuple[dt.datetime, float]], List[str]]:
+        """Return ({slot_id: (eta_minute, p_free)}, missing_slot_ids).
+
+        Same semantics as prediction_queries.nearest_predictions: closest prediction within
+        eta ± window, ties to the earlier one. Slots the index can answer but that have no
+        prediction in the window are in neither result.
+        """
+        snap = self._snap
+        ids = list(slot_ids)
+        if snap is None or self._expired(snap):
+            return {}, ids
+        target = eta_dt.timestamp()
+        win = window.total_seconds()
+        if target - win < snap.covered_from:
+            return {}, ids
+        found: Dict[str, Tuple[dt.datetime, float]] = {}
+        missing: List[str] = []
+        for sid in ids:
+            etas = snap.etas.get(sid)
+            if etas is None:
+                missing.append(sid)
+                continue
+            i = bisect.bisect_left(etas, target)
+            best = -1
+            best_delta = win
+            # predecessor first so ties resolve to the earlier prediction
+            for j in (i - 1, i):
+                if 0 <= j < len(etas):
+                    delta = abs(etas[j] - target)
+                    if delta <= win and (best < 0 or delta < best_delta):
+                        best, best_delta = j, delta
+            if best >= 0:
+                found[sid] = (dt.datetime.fromtimestamp(etas[best], dt.timezone.utc), snap.p_free[sid][best])
+        return found, missing
+
+
+prediction_index = PredictionIndex(refresh_sec=get_settings().prediction_index_refresh_sec)
+
+
+async def nearest_with_fallback(
+    db: AsyncSession,
+    slot_ids: Iterable[str],
+    eta_dt: dt.datetime,
+    window: dt.timedelta,
+) -> Dict[str, Tuple[dt.datetime, float]]:
+    """Index lookup with one set-based DB query for whatever the index misses."""
+    await prediction_index.ensure_fresh(db)
+    found, missing = prediction_index.nearest_many(slot_ids, eta_dt, window)
+    if missing:
+        found.update(await nearest_predictions(db, missing, eta_dt, window))
+    return found
+
+
+async def nearest_with_fallback_batch(
+    db: AsyncSession,
+    requests: Sequence[PredictionRequest],
+) -> List[Dict[str, Tuple[dt.datetime, float]]]:
+    """nearest_with_fallback for several (slot_ids, eta, window) requests: index lookups,
+    then a single DB query for the misses of all of them."""
+    await prediction_index.ensure_fresh(db)
+    found: List[Dict[str, Tuple[dt.datetime, float]]] = []
+    misses: List[PredictionRequest] = []
+    for slot_ids, eta_dt, window in requests:
+        hits, missing = prediction_index.nearest_many(slot_ids, eta_dt, window)
+        found.append(hits)
+        misses.append((missing, eta_dt, window))
+    if any(missing for missing, _, _ in misses):
+        for hits, fetched in zip(found, await nearest_predictions_batch(db, misses)):
+            hits.update(fetched)
+    return found
@@ -0,0 +1,103 @@
+import datetime as dt
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from sqlalchemy import DateTime, Integer, Interval, Select, String, column, select, func, values
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import SlotPrediction
+
+
+def _distance(eta_dt: dt.datetime):
+    return func.abs(func.extract("epoch", SlotPrediction.eta_minute - eta_dt))
+
+
+def nearest_prediction_select(candidates, eta_dt: dt.datetime, window: dt.timedelta) -> Select:
+    """Set-based "nearest prediction in window" lookup for many slots at once.
+
+    candidates: a subquery/CTE exposing a ``slot_id`` column (plus any extra slot columns
+    the caller wants carried through). Returns one row per candidate that has a prediction
+    within ``eta_dt ± window``: all candidate columns plus ``pred_eta`` and ``p_free``.
+
+    Uses DISTINCT ON (slot_id) ordered by absolute distance to the ETA; ties go to the
+    earlier prediction, matching the previous before/after pair of queries. Served by
+    idx_slot_predictions_slot_eta (see /admin/db/indexes).
+    """
+    return (
+        select(
+            *candidates.c,
+            SlotPrediction.eta_minute.label("pred_eta"),
+            SlotPrediction.p_free.label("p_free"),
+        )
+        .join(SlotPrediction, SlotPrediction.slot_id == candidates.c.slot_id)
+        .where(
+            SlotPrediction.eta_minute >= eta_dt - window,
+            SlotPrediction.eta_minute <= eta_dt + window,
+        )
+        .distinct(candidates.c.slot_id)
+        .order_by(candidates.c.slot_id, _distance(eta_dt), SlotPrediction.eta_minute.asc())
+    )
+
+
+async def nearest_predictions(
+    db: AsyncSession,
+    slot_ids: Iterable[str],
+    eta_dt: dt.datetime,
+    window: dt.timedelta,
+) -> Dict[str, Tuple[dt.datetime, float]]:
+    """Nearest prediction per slot id in one round trip: {slot_id: (eta_minute, p_free)}.
+    Slots without a prediction inside the window are absent from the result."""
+    ids = list(dict.fromkeys(slot_ids))
+    if not ids:
+        return {}
+    res = await db.execute(
+        select(SlotPrediction.slot_id, SlotPrediction.eta_minute, SlotPrediction.p_free)
+        .where(
+            SlotPrediction.slot_id.in_(ids),
+            SlotPrediction.eta_minute >= eta_dt - window,
+            SlotPrediction.eta_minute <= eta_dt + window,
+        )
+        .distinct(SlotPrediction.slot_id)
+        .order_by(SlotPrediction.slot_id, _distance(eta_dt), SlotPrediction.eta_minute.asc())
+    )
+    return {sid: (eta, float(p)) for sid, eta, p in res.all()}
+
+
+PredictionRequest = Tuple[Iterable[str], dt.datetime, dt.timedelta]  # (slot_ids, eta, window)
+
+
+async def nearest_predictions_batch(
+    db: AsyncSession,
+    requests: Sequence[PredictionRequest],
+) -> List[Dict[str, Tuple[dt.datetime, float]]]:
+    """nearest_predictions for several (slot_ids, eta, window) requests in one round trip:
+    the requests go in as a VALUES list joined to slot_predictions, with DISTINCT ON
+    (request, slot). Results are in request order."""
+    rows = [
+        (n, sid, eta_dt, window)
+        for n, (slot_ids, eta_dt, window) in enumerate(requests)
+        for sid in dict.fromkeys(slot_ids)
+    ]
+    out: List[Dict[str, Tuple[dt.datetime, float]]] = [{} for _ in requests]
+    if not rows:
+        return out
+    v = values(
+        column("n", Integer), column("slot_id", String), column("eta", DateTime(timezone=True)),
+        column("win", Interval), name="wanted",
+    ).data(rows)
+    res = await db.execute(
+        select(v.c.n, SlotPrediction.slot_id, SlotPrediction.eta_minute, SlotPrediction.p_free)
+        .select_from(v)
+        .join(SlotPrediction, SlotPrediction.slot_id == v.c.slot_id)
+        .where(
+            SlotPrediction.eta_minute >= v.c.eta - v.c.win,
+            SlotPrediction.eta_minute <= v.c.eta + v.c.win,
+        )
+        .distinct(v.c.n, v.c.slot_id)
+        .order_by(
+            v.c.n, v.c.slot_id,
+            func.abs(func.extract("epoch", SlotPrediction.eta_minute - v.c.eta)), SlotPrediction.eta_minute.asc(),
+        )
+    )
+    for n, sid, eta, p in res.all():
+        out[n][sid] = (eta, float(p))
+    return out
@@ -0,0 +1,73 @@
+import asyncio
+import time
+from typing import Iterable, List, Tuple
+
+from sqlalchemy import Select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+class ReconciledIndex:
+    """Base of the process-local session indexes (lot_occupancy, plate_index).
+
+    Requests update an index after their commit; sessions started or ended by other
+    workers are picked up when it is rebuilt from the DB (_snapshot_select()), at most
+    every reconcile_sec, checked lazily by ensure_fresh().
+
+    A reconcile reads its snapshot while other requests keep updating the index. Updates
+    made while the query is out are journaled (_journal()) and replayed onto the snapshot
+    before it is swapped in, so none of them is lost.
+
+    Subclasses implement _snapshot_select(), _load(rows) (fill a fresh instance) and
+    _adopt(fresh) (take over its state), and journal every mutating call under its
+    method name.
+    """
+
+    def __init__(self, reconcile_sec: float = 60.0):
+        self.reconcile_sec = reconcile_sec
+        self._reconciled_at = 0.0
+        self._lock = asyncio.Lock()
+        self._journals: List[list] = []  # one per reconcile in flight
+        self.reconciles = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._reconciled_at > 0
+
+    def _journal(self, method: str, *args):
+        for journal in self._journals:
+            journal.append((method, args))
+
+    def _snapshot_select(self) -> Select:
+        raise NotImplementedError
+
+    def _load(self, rows: Iterable[tuple]):
+        raise NotImplementedError
+
+    def _adopt(self, fresh: "ReconciledIndex"):
+        raise NotImplementedError
+
+    def _replace(self, rows: Iterable[tuple], journal: Iterable[Tuple[str, tuple]] = ()):
+        """Swap in the state of `rows`, then re-apply the calls journaled while they were read."""
+        fresh = type(self)(self.reconcile_sec)
+        fresh._load(rows)
+        for method, args in journal:
+            getattr(fresh, method)(*args)
+        self._adopt(fresh)
+
+    async def reconcile(self, db: AsyncSession):
+        journal: list = []
+        self._journals.append(journal)
+        try:
+            rows = (await db.execute(self._snapshot_select())).all()
+        finally:
+            self._journals.remove(journal)
+        self._replace(rows, journal)
+        self._reconciled_at = time.monotonic()
+        self.reconciles += 1
+
+    async def ensure_fresh(self, db: AsyncSession):
+        if time.monotonic() - self._reconciled_at < self.reconcile_sec:
+            return
+        async with self._lock:
+            if time.monotonic() - self._reconciled_at >= self.reconcile_sec:
+                await self.reconcile(db)
@@ -0,0 +1,51 @@
+import time
+from typing import Dict, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import get_settings
+
+_settings = get_settings()
+
+
+class RollupTables:
+    """Whether the rollup tables created by /admin/db/patch exist.
+
+    Payment and session writes maintain the rollups in their own transaction; on a database
+    that has not been patched yet those writes are skipped instead of failing the request.
+    A table found present is remembered for good; a missing one is looked up again (one
+    to_regclass() query) after ROLLUP_TABLES_RECHECK_SEC. /admin/db/patch resets this
+    process at once; other workers skip rollup writes for up to that long after the patch,
+    so re-run /admin/rollups/backfill once every worker has caught up.
+    """
+
+    def __init__(self, recheck_sec: float = 30.0):
+        self.recheck_sec = recheck_sec
+        self._seen: Dict[str, Tuple[bool, float]] = {}  # table -> (present, checked_at)
+        self.skipped = 0
+
+    async def present(self, db: AsyncSession, table: str) -> bool:
+        seen = self._seen.get(table)
+        if seen is not None and (seen[0] or time.monotonic() - seen[1] < self.recheck_sec):
+            if not seen[0]:
+                self.skipped += 1
+            return seen[0]
+        res = await db.execute(select(func.to_regclass(table).isnot(None)))
+        found = bool(res.scalar())
+        self._seen[table] = (found, time.monotonic())
+        if not found:
+            self.skipped += 1
+        return found
+
+    def forget(self):
+        self._seen.clear()
+
+    def status(self) -> dict:
+        return {
+            "missing": sorted(t for t, (found, _) in self._seen.items() if not found),
+            "skipped_writes": self.skipped,
+        }
+
+
+rollup_tables = RollupTables(recheck_sec=_settings.rollup_tables_recheck_sec)
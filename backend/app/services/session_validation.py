@@ -0,0 +1,198 @@
+import datetime as dt
+import uuid
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from sqlalchemy import String, column, func, insert, or_, select, update, values
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import (
+    Booking, EventsOutbox, Payment, PaymentStatus, Session as SessionModel, ValidationMethod,
+)
+from app.services.plate_index import normalize_plate, plate_index
+from app.services.payment_rollups import record_new_payments
+from app.services.slot_catalog import current_price
+
+
+def _as_uuid(value: Optional[str]) -> Optional[str]:
+    try:
+        return str(uuid.UUID(value)) if value else None
+    except (ValueError, AttributeError, TypeError):
+        return None
+
+
+class GateEvent(NamedTuple):
+    plate: Optional[str]
+    token: Optional[str]  # QR payload: a session_id or booking_id
+    validation_method: Optional[str]
+    bay_label: Optional[str]
+
+
+class GateOutcome(NamedTuple):
+    ok: bool
+    status_code: int
+    session_id: Optional[str] = None
+    booking_id: Optional[str] = None
+    error: Optional[str] = None
+
+
+async def validate_sessions(db: AsyncSession, events: Sequence[GateEvent]) -> List[GateOutcome]:
+    """Apply a burst of gate validations in one transaction; outcomes are in input order.
+
+    Plates are resolved through the in-memory plate_index first. Statements: one lookup of
+    the active sessions matching a resolved session id, a QR token (session or booking id)
+    or, for plates the index does not know, the plate itself (idx_sessions_plate_active),
+    plus a second plate lookup only when an indexed session turns out to have ended; one
+    ``UPDATE sessions ... FROM (VALUES ...)``, one multi-row payments insert for sessions
+    without a pre-authorisation, one multi-row outbox insert (payment.preauth_ok,
+    session.validated) and a single commit.
+
+    A plate with several active sessions resolves to the most recently started one.
+    Several events for the same session are all accepted; the last one's method/bay wins.
+    A missing bay_label keeps the session's current bay. Unmatched events fail with 404,
+    events carrying neither plate nor token with 422. The UPDATE only touches sessions that
+    are still open and its RETURNING set decides the outcome: a session ended concurrently
+    after the lookup fails with 409 and gets no payment or outbox rows.
+    """
+    keys: List[tuple] = []
+    plates, tokens = set(), set()
+    for e in events:
+        plate, token = normalize_plate(e.plate), _as_uuid(e.token)
+        keys.append((plate, token))
+        if plate:
+            plates.add(plate)
+        if token:
+            tokens.add(token)
+
+    indexed: Dict[str, str] = {}  # plate -> session_id
+    if plates:
+        await plate_index.ensure_fresh(db)
+        for plate in plates:
+            sid = plate_index.lookup(plate)
+            if sid is not None:
+                indexed[plate] = sid
+    unindexed = plates - set(indexed)
+    session_ids = tokens | set(indexed.values())
+
+    by_plate: Dict[str, tuple] = {}
+    by_token: Dict[str, tuple] = {}
+
+    async def fetch_active(conds, plate_keys):
+        res = await db.execute(
+            select(
+                SessionModel.session_id, SessionModel.booking_id, SessionModel.plate,
+                Booking.slot_id, Payment.payment_id,
+            )
+            .outerjoin(Booking, Booking.booking_id == SessionModel.booking_id)
+            .outerjoin(Payment, Payment.booking_id == SessionModel.booking_id)
+            .where(SessionModel.ended_at.is_(None), or_(*conds))
+            .order_by(SessionModel.started_at.desc())
+        )
+        for row in res.all():
+            sid, bid, plate = row[0], row[1], row[2]
+            if plate and plate in plate_keys:
+                by_plate.setdefault(plate, row)
+            by_token.setdefault(sid, row)
+            if bid:
+                by_token.setdefault(bid, row)
+
+    if unindexed or session_ids:
+        conds = []
+        if unindexed:
+            conds.append(SessionModel.plate.in_(sorted(unindexed)))
+        if session_ids:
+            conds.append(SessionModel.session_id.in_(sorted(session_ids)))
+        if tokens:
+            conds.append(SessionModel.booking_id.in_(sorted(tokens)))
+        await fetch_active(conds, unindexed)
+    # indexed sessions that ended on another worker since the index was built: the plate
+    # may have a newer session, so look those plates up in the DB after all
+    stale = {plate for plate, sid in indexed.items() if sid not in by_token}
+    if stale:
+        for plate in stale:
+            plate_index.session_ended(indexed.pop(plate))
+        await fetch_active([SessionModel.plate.in_(sorted(stale))], stale)
+
+    outcomes: List[GateOutcome] = []
+    latest: Dict[str, tuple] = {}  # session_id -> (method, bay_label, row)
+    for e, (plate, token) in zip(events, keys):
+        if not plate and not token:
+            outcomes.append(GateOutcome(False, 422, error="plate or a valid QR token is required"))
+            continue
+        if token:
+            row = by_token.get(token)
+        elif plate in indexed:
+            row = by_token.get(indexed[plate])
+        else:
+            row = by_plate.get(plate)
+        if row is None:
+            outcomes.append(GateOutcome(False, 404, error="no active session"))
+            continue
+        method = e.validation_method or (ValidationMethod.qr.value if token else ValidationMethod.plate.value)
+        latest[row[0]] = (method, e.bay_label, row)
+        outcomes.append(GateOutcome(True, 200, session_id=row[0], booking_id=row[1]))
+    if not latest:
+        return outcomes
+
+    v = values(
+        column("session_id", UUID(as_uuid=False)), column("method", String), column("bay_label", String),
+        name="gate",
+    ).data([(sid, method, bay) for sid, (method, bay, _) in latest.items()])
+    res = await db.execute(
+        update(SessionModel)
+        .where(SessionModel.session_id == v.c.session_id, SessionModel.ended_at.is_(None))
+        .values(
+            validation_method=v.c.method,
+            bay_label=func.coalesce(v.c.bay_label, SessionModel.bay_label),
+        )
+        .returning(SessionModel.session_id, SessionModel.bay_label)
+    )
+    bays = dict(res.all())
+    ended = set(latest) - set(bays)
+    if ended:
+        for sid in ended:
+            plate_index.session_ended(sid)
+            del latest[sid]
+        outcomes = [
+            GateOutcome(False, 409, o.session_id, o.booking_id, "session has already ended")
+            if o.ok and o.session_id in ended else o
+            for o in outcomes
+        ]
+        if not latest:
+            return outcomes
+
+    now = dt.datetime.utcnow()
+    payment_rows, outbox_rows = [], []
+    for sid, (method, _, row) in latest.items():
+        bay = bays.get(sid)
+        _, bid, _, slot_id, payment_id = row
+        if bid and payment_id is None:
+            amount = (await current_price(db, slot_id) if slot_id else None) or 0.0
+            payment_id = str(uuid.uuid4())
+            payment_rows.append({
+                "payment_id": payment_id,
+                "booking_id": bid,
+                "amount_authorized": amount,
+                "amount_captured": None,
+                "status": PaymentStatus.preauth_ok,
+            })
+            outbox_rows.append({
+                "event_id": str(uuid.uuid4()),
+                "event_type": "payment.preauth_ok",
+                "payload": {"booking_id": bid, "payment_id": payment_id, "amount_authorized": amount, "at": now.isoformat()},
+                "status": "pending",
+                "created_at": now,
+            })
+        outbox_rows.append({
+            "event_id": str(uuid.uuid4()),
+            "event_type": "session.validated",
+            "payload": {"session_id": sid, "booking_id": bid, "method": method, "bay_label": bay, "at": now.isoformat()},
+            "status": "pending",
+            "created_at": now,
+        })
+    if payment_rows:
+        await db.execute(insert(Payment).values(payment_rows))
+        await record_new_payments(db, [p["payment_id"] for p in payment_rows])
+    await db.execute(insert(EventsOutbox).values(outbox_rows))
+    await db.commit()
+    return outcomes
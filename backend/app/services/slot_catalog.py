@@ -0,0 +1,175 @@
+import asyncio
+import time
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import get_settings
+from app.models import Slot
+
+_settings = get_settings()
+
+
+class SlotInfo(NamedTuple):
+    slot_id: str
+    location_id: Optional[str]
+    cluster_id: str
+    capacity: int
+    is_ev: bool
+    is_accessible: bool
+    base_price: float
+    dynamic_price: float
+
+
+class SlotCatalog:
+    """Process-wide cache of slot attributes with a monotonically increasing version.
+
+    Structural changes (create_lot, admin seeding) call bump(); the next ensure_fresh()
+    reloads everything. Price changes made in this process (pricing agent) are applied in
+    place with apply_prices(); prices changed by other workers are picked up every
+    SLOT_CATALOG_PRICE_TTL_SEC by a prices-only query that rewrites just the slots whose
+    price differs.
+
+    Readers get O(1) dict lookups. On a miss callers fall back to the DB, and call
+    mark_stale() only if the DB knew the slot (the catalogue is behind another worker).
+    """
+
+    def __init__(self, price_ttl_sec: float = 30.0):
+        self.price_ttl_sec = price_ttl_sec
+        self.version = 0
+        self._loaded_version = -1
+        self._prices_checked_at = 0.0
+        self._slots: Dict[str, SlotInfo] = {}
+        self._by_cluster: Dict[str, List[str]] = {}
+        self._by_location: Dict[str, List[str]] = {}
+        self._lock = asyncio.Lock()
+        self.full_reloads = 0
+        self.price_refreshes = 0
+        self.last_bumped_by: Optional[str] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._loaded_version >= 0
+
+    def bump(self, reason: str):
+        self.version += 1
+        self.last_bumped_by = reason
+
+    def mark_stale(self):
+        """A reader found a slot the snapshot lacks (created by another worker)."""
+        self.bump("catalog.miss")
+
+    def _stale(self) -> bool:
+        return self._loaded_version != self.version
+
+    async def ensure_fresh(self, db: AsyncSession):
+        if not self._stale() and time.monotonic() - self._prices_checked_at < self.price_ttl_sec:
+            return
+        async with self._lock:
+            if self._stale():
+                await self._reload(db)
+            elif time.monotonic() - self._prices_checked_at >= self.price_ttl_sec:
+                await self.refresh_prices(db)
+
+    async def _reload(self, db: AsyncSession):
+        version = self.version
+        res = await db.execute(
+            select(
+                Slot.slot_id, Slot.location_id, Slot.cluster_id, Slot.capacity,
+                Slot.is_ev, Slot.is_accessible, Slot.base_price, Slot.dynamic_price,
+            ).order_by(Slot.slot_id)
+        )
+        slots: Dict[str, SlotInfo] = {}
+        by_cluster: Dict[str, List[str]] = {}
+        by_location: Dict[str, List[str]] = {}
+        for sid, lid, cid, cap, ev, acc, base, dyn in res.all():
+            slots[sid] = SlotInfo(sid, lid, cid, int(cap or 1), bool(ev), bool(acc), float(base), float(dyn))
+            by_cluster.setdefault(cid, []).append(sid)
+            if lid is not None:
+                by_location.setdefault(lid, []).append(sid)
+        self._slots, self._by_cluster, self._by_location = slots, by_cluster, by_location
+        # a bump that raced with this load leaves the snapshot stale for the next caller
+        self._loaded_version = version
+        self._prices_checked_at = time.monotonic()
+        self.full_reloads += 1
+
+    async def refresh_prices(self, db: AsyncSession, slot_ids: Optional[Iterable[str]] = None) -> int:
+        """Re-read dynamic_price (all slots, or just slot_ids) and apply the ones that changed."""
+        q = select(Slot.slot_id, Slot.dynamic_price)
+        if slot_ids is not None:
+            q = q.where(Slot.slot_id.in_(list(slot_ids)))
+        res = await db.execute(q)
+        changed = self.apply_prices({sid: float(p) for sid, p in res.all()})
+        self._prices_checked_at = time.monotonic()
+        self.price_refreshes += 1
+        return changed
+
+    def apply_prices(self, prices: Mapping[str, float]) -> int:
+        """Selective in-place price update; unknown slots are ignored. Returns slots changed."""
+        changed = 0
+        for sid, price in prices.items():
+            info = self._slots.get(sid)
+            if info is not None and info.dynamic_price != price:
+                self._slots[sid] = info._replace(dynamic_price=price)
+                changed += 1
+        if changed:
+            # keep the snapshot current: a price tweak never forces a full reload
+            stale = self._stale()
+            self.version += 1
+            if not stale:
+                self._loaded_version = self.version
+        return changed
+
+    def get(self, slot_id: str) -> Optional[SlotInfo]:
+        return self._slots.get(slot_id)
+
+    def resolve(self, ref: str) -> Optional[SlotInfo]:
+        """A slot id, or the first slot (by id) of a cluster or location id."""
+        info = self._slots.get(ref)
+        if info is not None:
+            return info
+        ids = self._by_cluster.get(ref) or self._by_location.get(ref)
+        return self._slots[ids[0]] if ids else None
+
+    def in_cluster(self, cluster_id: str) -> List[str]:
+        return self._by_cluster.get(cluster_id, [])
+
+    def in_location(self, location_id: str) -> List[SlotInfo]:
+        return [self._slots[sid] for sid in self._by_location.get(location_id, [])]
+
+    def all(self) -> List[SlotInfo]:
+        return list(self._slots.values())
+
+    def capacity_by_location(self) -> Dict[str, int]:
+        return {lid: len(ids) for lid, ids in self._by_location.items()}
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "version": self.version,
+            "loaded_version": self._loaded_version,
+            "slots": len(self._slots),
+            "clusters": len(self._by_cluster),
+            "locations": len(self._by_location),
+            "full_reloads": self.full_reloads,
+            "price_refreshes": self.price_refreshes,
+            "last_bumped_by": self.last_bumped_by,
+        }
+
+
+slot_catalog = SlotCatalog(price_ttl_sec=_settings.slot_catalog_price_ttl_sec)
+
+
+async def current_price(db: AsyncSession, slot_id: str) -> Optional[float]:
+    """dynamic_price from the catalogue, or the DB for slots it does not know yet."""
+    await slot_catalog.ensure_fresh(db)
+    info = slot_catalog.get(slot_id)
+    if info is not None:
+        return info.dynamic_price
+    res = await db.execute(select(Slot.dynamic_price).where(Slot.slot_id == slot_id))
+    price = res.scalar_one_or_none()
+    if price is None:
+        return None
+    slot_catalog.mark_stale()
+    return float(price)
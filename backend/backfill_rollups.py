@@ -0,0 +1,53 @@
+"""
+Rebuild the analytics rollups (payment_rollups, hourly_rollups) from sessions and payments.
+
+Usage:
+    python backfill_rollups.py              # all history
+    python backfill_rollups.py --days 7     # hourly rollups for the last 7 days only
+
+Run after bulk loads that bypass the API (seed_data.py, imports). Same as
+POST /admin/rollups/backfill.
+"""
+import asyncio
+import sys
+from datetime import datetime, timedelta, timezone
+
+# Ensure correct event loop on Windows for psycopg async
+if sys.platform.startswith("win"):
+    try:
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())  # type: ignore[attr-defined]
+    except Exception:
+        pass
+
+from app.core.db import SessionLocal
+from app.services.hourly_rollups import backfill_hourly_rollups
+from app.services.payment_rollups import rebuild_payment_rollups
+
+
+async def backfill(days: int | None = None):
+    if SessionLocal is None:
+        print("❌ Database not configured. Check your .env file.")
+        sys.exit(1)
+    since = datetime.now(timezone.utc) - timedelta(days=days) if days else None
+    async with SessionLocal() as db:
+        buckets = await rebuild_payment_rollups(db)
+        hours = await backfill_hourly_rollups(db, since)
+        await db.commit()
+    print(f"✓ payment_rollups: {buckets} buckets")
+    print(f"✓ hourly_rollups: {hours} rows" + (f" since {since.isoformat()}" if since else ""))
+
+
+def _parse_args(argv: list[str]) -> int | None:
+    if "--days" in argv:
+        return int(argv[argv.index("--days") + 1])
+    return None
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(backfill(_parse_args(sys.argv[1:])))
+    except Exception as e:
+        print(f"❌ Error backfilling rollups: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
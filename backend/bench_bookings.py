@@ -0,0 +1,99 @@
+"""
+Booking creation latency benchmark.
+
+Times POST /bookings/ against a running API (seed data first, e.g. `python seed_data.py --lite`).
+Every request gets its own (slot, ETA): requests cycle through the slots and each pass moves the
+ETA on by --eta-step minutes (keep it above BOOKING_DURATION_MIN), so the timed path is a clean
+create, not a 409 or a reroute. Each run starts on a random day within --spread-days, clear of the
+bookings earlier runs left behind. Run once before and once after a change and compare the
+percentiles; errors should stay at 0.
+
+Usage:
+    python bench_bookings.py                                   # 200 smart_hold bookings on localhost:8000
+    python bench_bookings.py --mode guaranteed -n 500
+    python bench_bookings.py --base-url http://api:8000 --slot-id LOT1_S042 --concurrency 8
+
+Requires httpx (see requirements.txt).
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+
+def _pct(sorted_ms, q: float) -> float:
+    if not sorted_ms:
+        return float("nan")
+    idx = min(len(sorted_ms) - 1, max(0, round(q * (len(sorted_ms) - 1))))
+    return sorted_ms[idx]
+
+
+async def _list_slots(client: httpx.AsyncClient) -> list:
+    res = await client.get("/inventory/slots")
+    res.raise_for_status()
+    slot_ids = [s["slot_id"] for s in res.json()]
+    if not slot_ids:
+        raise SystemExit("no slots found; seed the database first")
+    return slot_ids
+
+
+async def run(args):
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=30.0) as client:
+        slot_ids = [args.slot_id] if args.slot_id else await _list_slots(client)
+        day = random.randrange(args.spread_days) if args.spread_days > 0 else 0
+        base = datetime.now(timezone.utc) + timedelta(days=day, minutes=args.eta_minutes)
+
+        def body(i: int) -> dict:
+            # slot i mod |slots|, one ETA step per pass over the slots: no two requests overlap
+            eta = base + timedelta(minutes=args.eta_step * (i // len(slot_ids)))
+            return {"slot_id": slot_ids[i % len(slot_ids)], "eta": eta.isoformat(), "mode": args.mode,
+                    "window_minutes": args.window}
+
+        latencies = []
+        errors = 0
+        sem = asyncio.Semaphore(args.concurrency)
+
+        async def one(i: int):
+            nonlocal errors
+            async with sem:
+                t0 = time.perf_counter()
+                res = await client.post("/bookings/", json=body(i))
+                latencies.append((time.perf_counter() - t0) * 1000)
+                if res.status_code >= 400:
+                    errors += 1
+
+        for i in range(args.warmup):
+            await client.post("/bookings/", json=body(i))
+        t_start = time.perf_counter()
+        await asyncio.gather(*(one(args.warmup + i) for i in range(args.n)))
+        elapsed = time.perf_counter() - t_start
+
+    lat = sorted(latencies)
+    print(f"POST /bookings/ mode={args.mode} slots={len(slot_ids)} n={args.n} concurrency={args.concurrency}")
+    print(f"  errors: {errors}")
+    print(f"  throughput: {args.n / elapsed:.1f} req/s")
+    print(f"  mean: {statistics.fmean(lat):.1f} ms  p50: {_pct(lat, 0.50):.1f} ms  "
+          f"p95: {_pct(lat, 0.95):.1f} ms  p99: {_pct(lat, 0.99):.1f} ms  max: {lat[-1]:.1f} ms")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark booking creation latency")
+    ap.add_argument("--base-url", default="http://localhost:8000")
+    ap.add_argument("--slot-id", default=None, help="single target slot (default: cycle through /inventory/slots)")
+    ap.add_argument("--mode", default="smart_hold", choices=["smart_hold", "guaranteed"])
+    ap.add_argument("-n", type=int, default=200, help="number of timed requests")
+    ap.add_argument("--warmup", type=int, default=10)
+    ap.add_argument("--concurrency", type=int, default=1)
+    ap.add_argument("--eta-minutes", type=int, default=30)
+    ap.add_argument("--eta-step", type=int, default=180, help="minutes between passes over the slots")
+    ap.add_argument("--spread-days", type=int, default=365, help="start each run on a random day in this range")
+    ap.add_argument("--window", type=int, default=60)
+    asyncio.run(run(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
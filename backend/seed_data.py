@@ -30,6 +30,8 @@ from app.models import (
     Payment, PaymentStatus,
     SlotPrediction, PredictionBatch
 )
+from app.services.hourly_rollups import backfill_hourly_rollups
+from app.services.payment_rollups import rebuild_payment_rollups
 
 async def seed_all(lite: bool = False):
     if SessionLocal is None:
@@ -282,6 +284,16 @@ async def seed_all(lite: bool = False):
         print(f"✓ Created {len(sessions)} sessions")
         print(f"✓ Created {len(payments)} payments")
 
+        # rows above bypass the API, so rebuild the analytics rollups from them
+        try:
+            await rebuild_payment_rollups(db)
+            await backfill_hourly_rollups(db)
+            await db.commit()
+            print("✓ Rebuilt analytics rollups")
+        except Exception as e:
+            await db.rollback()
+            print(f"⚠️  Rollups not rebuilt ({e.__class__.__name__}); run POST /admin/db/patch")
+
         # 7. Predictive data (seed simple probabilities for demo UX)
         print("\n🔮 Seeding predictive availability (demo) ...")
         horizon_min = 120 if not lite else 60
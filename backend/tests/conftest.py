@@ -0,0 +1,23 @@
+import asyncio
+
+import pytest
+
+
+class _SlowDB:
+    """Stands in for the AsyncSession: returns `rows`, running `during` while the query is out."""
+
+    def __init__(self, rows, during=lambda: None):
+        self.rows, self.during = rows, during
+
+    async def execute(self, _stmt):
+        await asyncio.sleep(0)
+        self.during()
+        return self
+
+    def all(self):
+        return self.rows
+
+
+@pytest.fixture
+def slow_db():
+    return _SlowDB
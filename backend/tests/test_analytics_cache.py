@@ -0,0 +1,60 @@
+import asyncio
+import gc
+
+from app.services.analytics_cache import AnalyticsCache
+
+
+def test_concurrent_misses_share_one_computation():
+    cache = AnalyticsCache()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def run():
+        return await asyncio.gather(*[cache.get_or_compute("k", 60, compute) for _ in range(10)])
+
+    assert asyncio.run(run()) == [1] * 10
+    assert len(calls) == 1 and cache.misses == 1 and cache.coalesced == 9
+
+
+def test_stale_value_served_while_refreshing():
+    cache = AnalyticsCache(stale_sec=60)
+    version = [0]
+
+    async def compute():
+        version[0] += 1
+        return version[0]
+
+    async def run():
+        assert await cache.get_or_compute("k", 0, compute) == 1  # ttl 0: stale right away
+        assert await cache.get_or_compute("k", 60, compute) == 1  # stale hit, refresh starts
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        return await cache.get_or_compute("k", 60, compute)
+
+    assert asyncio.run(run()) == 2
+    assert cache.stale_hits == 1 and cache.hits == 1 and cache.refreshes == 1
+
+
+def test_failed_miss_retrieved_when_every_waiter_is_cancelled():
+    cache = AnalyticsCache()
+    unretrieved = []
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def run():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, ctx: unretrieved.append(ctx))
+        waiter = asyncio.ensure_future(cache.get_or_compute("k", 60, compute))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0.05)
+        assert not cache.stats()["inflight"]
+
+    asyncio.run(run())
+    gc.collect()
+    assert unretrieved == []
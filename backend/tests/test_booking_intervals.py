@@ -0,0 +1,62 @@
+import datetime as dt
+
+from app.services.booking_intervals import BookingIntervalIndex
+
+T0 = dt.datetime(2025, 11, 9, 14, 0, tzinfo=dt.timezone.utc)
+
+
+def _at(minutes: int) -> dt.datetime:
+    return T0 + dt.timedelta(minutes=minutes)
+
+
+def test_half_open_overlap():
+    idx = BookingIntervalIndex()
+    idx.add("S1", "b1", _at(0), _at(120))
+    assert idx.overlapping("S1", _at(60), _at(180)) == ["b1"]
+    assert idx.overlapping("S1", _at(-60), _at(1)) == ["b1"]
+    # touching spans do not conflict
+    assert idx.overlapping("S1", _at(120), _at(240)) == []
+    assert idx.overlapping("S1", _at(-120), _at(0)) == []
+    assert idx.overlapping("S2", _at(0), _at(120)) == []
+
+
+def test_long_span_found_from_far_start():
+    idx = BookingIntervalIndex()
+    idx.add("S1", "long", _at(0), _at(600))
+    idx.add("S1", "short", _at(300), _at(330))
+    assert sorted(idx.overlapping("S1", _at(500), _at(510))) == ["long"]
+    assert idx.overlapping("S1", _at(500), _at(510), exclude="long") == []
+
+
+def test_remove_and_move():
+    idx = BookingIntervalIndex()
+    idx.add("S1", "b1", _at(0), _at(120))
+    idx.add("S2", "b1", _at(0), _at(120))  # swap to another slot
+    assert idx.overlapping("S1", _at(0), _at(120)) == []
+    assert idx.overlapping("S2", _at(0), _at(120)) == ["b1"]
+    idx.remove("b1")
+    assert len(idx) == 0 and idx.overlapping("S2", _at(0), _at(120)) == []
+
+
+def test_prune_ended_spans():
+    idx = BookingIntervalIndex()  # T0 is in the past: explicit prunes only
+    idx.add("S1", "done", _at(0), _at(120))
+    idx.add("S1", "running", _at(60), _at(180))
+    idx.add("S2", "later", _at(200), _at(320))
+    assert idx.prune(now=_at(120)) == 1  # half-open: ended exactly at now
+    assert len(idx) == 2 and idx.overlapping("S1", _at(0), _at(200)) == ["running"]
+    assert idx.prune(now=_at(400)) == 2
+    assert len(idx) == 0 and idx.status()["slots"] == 0
+
+
+def test_add_prunes_the_slot_it_touches():
+    now = dt.datetime.now(dt.timezone.utc)
+    idx = BookingIntervalIndex(prune_ended=True)
+    idx.add("S1", "old", now - dt.timedelta(hours=5), now - dt.timedelta(hours=3))
+    idx.add("S1", "new", now + dt.timedelta(hours=1), now + dt.timedelta(hours=3))
+    assert len(idx) == 1 and idx.pruned == 1
+    # batch-local indexes keep past spans
+    batch = BookingIntervalIndex()
+    batch.add("S1", "old", now - dt.timedelta(hours=5), now - dt.timedelta(hours=3))
+    batch.add("S1", "new", now + dt.timedelta(hours=1), now + dt.timedelta(hours=3))
+    assert len(batch) == 2
@@ -0,0 +1,51 @@
+import asyncio
+import datetime as dt
+
+from app.services.end_pipeline import EndedSession, EndPipeline
+
+T0 = dt.datetime(2025, 11, 9, 14, 0, tzinfo=dt.timezone.utc)
+
+
+def _item(n: int) -> EndedSession:
+    return EndedSession(f"s{n}", f"b{n}", T0)
+
+
+def test_offer_rejects_when_full_and_skips_queued_bookings():
+    async def run():
+        p = EndPipeline(max_size=2, batch_size=10, max_wait_ms=1)
+        assert p.offer(_item(1)) and p.offer(_item(1))  # already queued: accepted, not added
+        assert p.offer(_item(2))
+        assert not p.has_room()
+        assert not p.offer(_item(3))
+        assert (p.enqueued, p.rejected, p.status()["queued"]) == (2, 1, 2)
+        assert p.retry_after_sec() >= 1
+
+    asyncio.run(run())
+
+
+def test_next_batch_caps_size_and_frees_room():
+    async def run():
+        p = EndPipeline(max_size=10, batch_size=3, max_wait_ms=5)
+        for n in range(5):
+            p.offer(_item(n))
+        assert [i.session_id for i in await p.next_batch()] == ["s0", "s1", "s2"]
+        assert [i.session_id for i in await p.next_batch()] == ["s3", "s4"]  # partial after max_wait
+        assert p.offer(_item(0))  # taken off the queue, so it can be queued again
+        p.record_batch(3, 1.5, failed=1)
+        assert (p.batches, p.completed, p.failed) == (1, 2, 1)
+
+    asyncio.run(run())
+
+
+def test_retry_later_backs_off_then_gives_up():
+    async def run():
+        p = EndPipeline(max_size=10, batch_size=10, max_wait_ms=1, max_retries=2, retry_base_sec=0.01)
+        assert p.retry_later(_item(1)) == 0.01
+        assert p.retry_later(_item(1)._replace(attempts=1)) == 0.02
+        assert p.retry_later(_item(1)._replace(attempts=2)) is None
+        await asyncio.sleep(0.05)
+        batch = await p.next_batch()
+        assert [(i.session_id, i.attempts) for i in batch] == [("s1", 1)]  # second retry deduplicated
+        assert (p.retried, p.abandoned) == (2, 1)
+
+    asyncio.run(run())
@@ -0,0 +1,31 @@
+import datetime as dt
+
+from app.services.hold_expiry import HoldExpiryQueue
+
+T0 = dt.datetime(2025, 11, 9, 14, 0, tzinfo=dt.timezone.utc)
+
+
+def _at(minutes: int) -> dt.datetime:
+    return T0 + dt.timedelta(minutes=minutes)
+
+
+def test_pop_due_in_deadline_order():
+    q = HoldExpiryQueue()
+    q.schedule("b2", _at(20))
+    q.schedule("b1", _at(10))
+    q.schedule("b3", _at(30))
+    assert q.pop_due(_at(5), limit=10) == []
+    assert q.pop_due(_at(25), limit=1) == ["b1"]
+    assert q.pop_due(_at(25), limit=10) == ["b2"]
+    assert len(q) == 1 and q.next_deadline() == _at(30).timestamp()
+
+
+def test_reschedule_and_cancel_skip_stale_entries():
+    q = HoldExpiryQueue()
+    q.schedule("b1", _at(10))
+    q.schedule("b1", _at(40))  # moved later: the 10-minute entry is stale
+    q.schedule("b2", _at(15))
+    q.cancel("b2")
+    assert q.pop_due(_at(30), limit=10) == []
+    assert q.pop_due(_at(40), limit=10) == ["b1"]
+    assert len(q) == 0 and q.next_deadline() is None
@@ -0,0 +1,40 @@
+import asyncio
+
+from app.services.lot_occupancy import LotOccupancy
+
+
+def test_started_and_ended_counts():
+    occ = LotOccupancy()
+    occ.session_started("s1", "L1", "S1")
+    occ.session_started("s2", "L1", "S1")
+    occ.session_started("s3", "L1", "S2")
+    occ.session_started("s1", "L1", "S1")  # repeated start is ignored
+    occ.session_started("s4", None, "S9")  # unlocated sessions are not tracked
+    assert occ.count("L1") == 3 and occ.occupied("L1") == {"S1", "S2"}
+    occ.session_ended("s1")
+    occ.session_ended("s3")
+    occ.session_ended("nope")
+    assert occ.count("L1") == 1 and occ.occupied("L1") == {"S1"}
+    occ.session_ended("s2")
+    assert occ.count("L1") == 0 and occ.status()["locations"] == 0
+
+
+def test_replace_counts_drift():
+    occ = LotOccupancy()
+    occ._replace([("s1", "L1", "S1")])
+    occ._reconciled_at = 1.0
+    occ._replace([("s1", "L1", "S1"), ("s2", "L2", "S5")])
+    assert occ.drift == 1 and occ.count("L2") == 1
+
+
+def test_reconcile_keeps_changes_made_during_the_query(slow_db):
+    occ = LotOccupancy()
+    occ.session_started("old", "L1", "S1")
+
+    def during():
+        occ.session_started("new", "L1", "S2")  # committed after the snapshot was taken
+        occ.session_ended("old")  # the snapshot still lists it
+
+    asyncio.run(occ.reconcile(slow_db([("old", "L1", "S1")], during)))
+    assert occ.occupied("L1") == {"S2"} and occ.count("L1") == 1
+    assert occ.drift == 0 and occ._journals == []
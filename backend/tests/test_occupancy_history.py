@@ -0,0 +1,66 @@
+import datetime as dt
+
+from app.services.occupancy_history import bucket_spans, bucket_starts, occupancy_pct
+
+T0 = dt.datetime(2025, 11, 1, tzinfo=dt.timezone.utc)
+DAY = dt.timedelta(days=1)
+
+
+def _at(hours: float) -> dt.datetime:
+    return T0 + dt.timedelta(hours=hours)
+
+
+# (started_at, ended_at): short, boundary-aligned, overnight, multi-week and still open
+SESSIONS = [
+    (_at(1), _at(3)),
+    (_at(24), _at(48)),
+    (_at(22.5), _at(26.25)),
+    (_at(30), _at(30)),
+    (_at(-50), _at(10)),
+    (_at(5), _at(24 * 20 + 7)),
+    (_at(24 * 3 + 12), None),
+]
+
+
+def _per_day_loop(start, end, now):
+    """The original /analytics/occupancy/daily loop: every session against every day."""
+    out = {}
+    for day_start in bucket_starts(start, end, "day"):
+        day_end = day_start + DAY
+        total = 0.0
+        for s_start, s_end in SESSIONS:
+            s_end = s_end if s_end is not None else now
+            overlap_start, overlap_end = max(s_start, day_start), min(s_end, day_end)
+            if overlap_end > overlap_start:
+                total += (overlap_end - overlap_start).total_seconds()
+        out[day_start] = total
+    return out
+
+
+def test_difference_array_matches_per_day_loop():
+    start, end, now = T0, T0 + 30 * DAY, _at(24 * 25 + 3)
+    spans = [
+        ("", s, max(s, start), min(e if e is not None else now, end))
+        for s, e in SESSIONS
+        if s < end and (e is None or e > start)
+    ]
+    got = bucket_spans(spans, "day")
+    expected = _per_day_loop(start, end, now)
+    for day, seconds in expected.items():
+        assert abs(got.get(("", day), (0.0, 0))[0] - seconds) < 1e-6, day
+    assert set(day for _, day in got) == {day for day, seconds in expected.items() if seconds > 0}
+    # each session is counted once, in the bucket it started in (not the clipped start)
+    assert sum(n for _, n in got.values()) == 5
+    assert occupancy_pct(got[("", T0 + DAY)][0], 3, DAY) == round(100 * (24 + 2.25 + 24) * 3600 / (3 * 86400), 2)
+
+
+def test_hourly_buckets_per_location():
+    spans = [("A", _at(0.5), _at(0.5), _at(3.25)), ("B", _at(1), _at(1), _at(2))]
+    got = bucket_spans(spans, "hour")
+    assert got == {
+        ("A", _at(0)): (1800.0, 1),
+        ("A", _at(1)): (3600.0, 0),
+        ("A", _at(2)): (3600.0, 0),
+        ("A", _at(3)): (900.0, 0),
+        ("B", _at(1)): (3600.0, 1),
+    }
@@ -0,0 +1,34 @@
+import asyncio
+
+from app.services.plate_index import PlateIndex, normalize_plate
+
+
+def test_started_and_ended():
+    idx = PlateIndex()
+    idx.session_started("s1", "mh 12-ab 1234")
+    assert normalize_plate("MH12ab1234") == "MH12AB1234"
+    assert idx.lookup("MH12AB1234") == "s1"
+    idx.session_started("s2", "MH12AB1234")  # latest start wins
+    idx.session_ended("s1")  # ending the older session keeps the newer one
+    assert idx.lookup("mh12ab1234") == "s2"
+    idx.session_ended("s2")
+    assert idx.lookup("MH12AB1234") is None and len(idx) == 0
+
+
+def test_replace_latest_start_wins():
+    idx = PlateIndex()
+    idx.session_started("gone", "KA01")
+    idx._replace([("s1", "KA01"), ("s2", "KA01"), ("s3", "DL02")])
+    assert idx.lookup("KA01") == "s2" and idx.lookup("DL02") == "s3" and len(idx) == 2
+
+
+def test_reconcile_keeps_changes_made_during_the_query(slow_db):
+    idx = PlateIndex()
+    idx.session_started("old", "KA01")
+
+    def during():
+        idx.session_started("new", "DL02")
+        idx.session_ended("old")
+
+    asyncio.run(idx.reconcile(slow_db([("old", "KA01")], during)))
+    assert idx.lookup("KA01") is None and idx.lookup("DL02") == "new"
@@ -0,0 +1,53 @@
+import datetime as dt
+
+from app.services.prediction_index import PredictionIndex
+
+NOW = dt.datetime(2025, 11, 9, 14, 0, tzinfo=dt.timezone.utc)
+WINDOW = dt.timedelta(minutes=60)
+
+
+def _index():
+    idx = PredictionIndex()
+    rows = [
+        ("S1", NOW + dt.timedelta(minutes=15), 0.2),
+        ("S1", NOW + dt.timedelta(minutes=45), 0.8),
+        ("S2", NOW + dt.timedelta(minutes=90), 0.5),
+    ]
+    idx.replace(rows, covered_from=NOW - dt.timedelta(hours=4))
+    return idx
+
+
+def test_nearest_picks_closest_and_ties_to_earlier():
+    idx = _index()
+    found, missing = idx.nearest_many(["S1"], NOW + dt.timedelta(minutes=40), WINDOW)
+    assert missing == []
+    assert found["S1"][1] == 0.8
+    # exactly between 15 and 45 -> earlier prediction wins (matches the DB ordering)
+    found, _ = idx.nearest_many(["S1"], NOW + dt.timedelta(minutes=30), WINDOW)
+    assert found["S1"][1] == 0.2
+
+
+def test_outside_window_is_absent_not_missing():
+    idx = _index()
+    found, missing = idx.nearest_many(["S2"], NOW, dt.timedelta(minutes=30))
+    assert found == {} and missing == []
+
+
+def test_unknown_slot_and_uncovered_range_are_misses():
+    idx = _index()
+    found, missing = idx.nearest_many(["S1", "S9"], NOW, WINDOW)
+    assert "S1" in found and missing == ["S9"]
+    found, missing = idx.nearest_many(["S1"], NOW - dt.timedelta(hours=4), WINDOW)
+    assert found == {} and missing == ["S1"]
+
+
+def test_not_ready_reports_everything_missing():
+    found, missing = PredictionIndex().nearest_many(["S1"], NOW, WINDOW)
+    assert found == {} and missing == ["S1"]
+
+
+def test_expired_snapshot_reports_everything_missing():
+    idx = _index()
+    idx.refresh_sec = 0.0
+    found, missing = idx.nearest_many(["S1"], NOW + dt.timedelta(minutes=40), WINDOW)
+    assert found == {} and missing == ["S1"]
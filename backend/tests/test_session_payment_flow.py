@@ -1,4 +1,5 @@
 import datetime as dt
+import time
 import uuid
 from fastapi.testclient import TestClient
 
@@ -46,15 +47,22 @@ def test_booking_session_payment_flow():
     })
     assert validate_resp.status_code == 200, validate_resp.text
 
-    # 4. End session (auto capture payment)
-    end_resp = client.post(f'/sessions/{session_id}/end')
-    assert end_resp.status_code == 200, end_resp.text
+    # 4. End session; capture is queued for the end pipeline, which only runs once the
+    # app's startup hooks have (hence the context manager)
+    with TestClient(app) as live_client:
+        end_resp = live_client.post(f'/sessions/{session_id}/end')
+        assert end_resp.status_code == 200, end_resp.text
 
-    # 5. List outbox events to ensure payment.captured emitted
-    events_resp = client.get('/admin/outbox/events?limit=25')
-    assert events_resp.status_code == 200
-    events = events_resp.json()
-    types = [e['event_type'] for e in events]
+        # 5. Wait for the pipeline to drain, then check payment.captured was emitted
+        deadline = time.monotonic() + 10
+        while True:
+            events_resp = live_client.get('/admin/outbox/events?limit=25')
+            assert events_resp.status_code == 200
+            events = events_resp.json()
+            types = [e['event_type'] for e in events]
+            if 'payment.captured' in types or time.monotonic() > deadline:
+                break
+            time.sleep(0.1)
     assert 'payment.captured' in types
     assert 'session.validated' in types
     assert 'booking.created' in types  # booking event earlier